@@ -94,19 +94,33 @@ module ProbabilisticAnnotation
     */
     typedef tuple<string annotation, float probability> function_probability;
 
+    /*
+       A roleset_probability is a (roleset index, probability) pair associated with a gene
+       The roleset index is the position of the roleset in the rolesets list of a ProbAnno object.
+    */
+    typedef tuple<int roleset, float probability> roleset_probability;
+
     /* Object to carry alternative functions and probabilities for genes in a genome    
 
+        Each roleset is stored once as a list of indices into the list of roles and the
+        alternative functions of a gene refer to rolesets by index.  Joining the roles of a
+        roleset with a "///" delimiter gives the annotation of a function_probability.
+
         probanno_id id - ID of the probabilistic annotation object    
         genome_id genome - ID of the genome the probabilistic annotation was built for
         workspace_id genome_workspace - ID of the workspace containing genome
-        mapping<feature_id, list<function_probability>> roleset_probabilities - mapping of features to list of alternative function_probability objects
+        list<string> roles - list of roles in the rolesets
+        list<list<int>> rolesets - list of rolesets where a roleset is a list of role indices
+        mapping<feature_id, list<roleset_probability>> feature_probabilities - mapping of features to list of alternative roleset_probability objects
         list<feature_id> skipped_features - list of features in genome with no probability
     */
     typedef structure {
 		probanno_id id;
 		genome_id genome;
 		workspace_id genome_workspace;
-		mapping<feature_id, list<function_probability>> roleset_probabilities;
+		list<string> roles;
+		list<list<int>> rolesets;
+		mapping<feature_id, list<roleset_probability>> feature_probabilities;
 		list<feature_id> skipped_features;
     } ProbAnno;
     
@@ -158,6 +172,10 @@ module ProbabilisticAnnotation
        workspace_id probanno_workspace - ID workspace where ProbAnno object is saved
        bool overwrite - True to overwrite existing ProbAnno object with same name
 	   bool verbose - True to print verbose messages
+	   int search_shards - Number of concurrent searches to split the query proteins across
+	   bool incremental - True to only search for proteins that changed since the previous version of the ProbAnno object
+	   int max_targets_per_query - Maximum number of hits kept for each query protein (0 for no limit)
+	   float min_relative_score - Minimum score (negative log E-value) of a hit as a fraction of the best score for the query protein
     */
     typedef structure {
 		genome_id genome;
@@ -166,6 +184,10 @@ module ProbabilisticAnnotation
 		workspace_id probanno_workspace;
 		bool overwrite;
 		bool verbose;
+		int search_shards;
+		bool incremental;
+		int max_targets_per_query;
+		float min_relative_score;
     } AnnotateParams;
 
 	/*
@@ -174,18 +196,62 @@ module ProbabilisticAnnotation
 		job ID of the submitted job.
 	*/
     funcdef annotate(AnnotateParams input) returns (job_id jobid);
+
+    /* An entry in the list of genomes for the "annotate_batch" function.
+
+       genome_id genome - ID of Genome object
+       workspace_id genome_workspace - ID of workspace where Genome object is stored
+       probanno_id probanno - ID of ProbAnno object
+       workspace_id probanno_workspace - ID workspace where ProbAnno object is saved
+    */
+    typedef structure {
+		genome_id genome;
+		workspace_id genome_workspace;
+		probanno_id probanno;
+		workspace_id probanno_workspace;
+    } AnnotateBatchEntry;
+
+    /* Input parameters for the "annotate_batch" function.
+
+       list<AnnotateBatchEntry> genomes - List of Genome objects to annotate
+	   bool verbose - True to print verbose messages
+	   int search_shards - Number of concurrent searches to split the query proteins across
+	   int max_targets_per_query - Maximum number of hits kept for each query protein (0 for no limit)
+	   float min_relative_score - Minimum score (negative log E-value) of a hit as a fraction of the best score for the query protein
+    */
+    typedef structure {
+		list<AnnotateBatchEntry> genomes;
+		bool verbose;
+		int search_shards;
+		int max_targets_per_query;
+		float min_relative_score;
+    } AnnotateBatchParams;
+
+	/*
+		Generate alternative annotations for every gene in a batch of genomes
+		together with their likelihoods.  The query proteins from all of the
+		genomes are searched for in one search.  Results are stored in a ProbAnno
+		object for each genome.  Returns the job ID of the submitted job.
+	*/
+    funcdef annotate_batch(AnnotateBatchParams input) returns (job_id jobid);
     
     /* Input parameters for the "calculate" function.
     
 		probanno_id probanno - ID of ProbAnno object
 		workspace_id probanno_workspace - ID of workspace where ProbAnno object is stored
+		template_id template_model - ID of TemplateModel object (optional, the static
+			database files are used when not specified)
+		workspace_id template_workspace - ID of workspace where TemplateModel object is
+			stored (required when template_model is specified)
+		rxnprobs_id rxnprobs - ID of RxnProbs object
+		workspace_id rxnprobs_workspace - ID of workspace where RxnProbs object is saved
 		bool verbose - True to print verbose messages
     */
     typedef structure {
     	probanno_id probanno;
     	workspace_id probanno_workspace;
 		template_id template_model;
-		workspace_id template_model_workspace;
+		workspace_id template_workspace;
 		rxnprobs_id rxnprobs;
 		workspace_id rxnprobs_workspace;
     	bool verbose;
@@ -198,6 +264,45 @@ module ProbabilisticAnnotation
     */
     funcdef calculate(CalculateParams input) returns(object_metadata output);
 
+    /* An entry in the list of ProbAnno objects for the "calculate_batch" function.
+
+		probanno_id probanno - ID of ProbAnno object
+		workspace_id probanno_workspace - ID of workspace where ProbAnno object is stored
+		rxnprobs_id rxnprobs - ID of RxnProbs object
+		workspace_id rxnprobs_workspace - ID of workspace where RxnProbs object is saved
+    */
+    typedef structure {
+    	probanno_id probanno;
+    	workspace_id probanno_workspace;
+		rxnprobs_id rxnprobs;
+		workspace_id rxnprobs_workspace;
+    } CalculateBatchEntry;
+
+    /* Input parameters for the "calculate_batch" function.
+
+		list<CalculateBatchEntry> probannos - List of ProbAnno objects to calculate
+		template_id template_model - ID of TemplateModel object used for all of the ProbAnno
+			objects (optional, the static database files are used when not specified)
+		workspace_id template_workspace - ID of workspace where TemplateModel object is
+			stored (required when template_model is specified)
+		bool verbose - True to print verbose messages
+    */
+    typedef structure {
+		list<CalculateBatchEntry> probannos;
+		template_id template_model;
+		workspace_id template_workspace;
+    	bool verbose;
+    } CalculateBatchParams;
+
+    /*
+    	Calculate reaction likelihoods from a batch of probabilistic annotations
+    	and a template model.  The reaction likelihoods for the ProbAnno objects
+    	are calculated in parallel.  Results are stored in a RxnProbs object for
+    	each ProbAnno object.  Returns the metadata for the reaction probability
+    	objects in the same order as the input list.
+    */
+    funcdef calculate_batch(CalculateBatchParams input) returns(list<object_metadata> output);
+
     /*
         Inputs for get_rxnprobs function.
 
@@ -240,7 +345,7 @@ module ProbabilisticAnnotation
     /* 
         Output for get_probanno function.
 		It is a mapping from a feature (gene) ID to a list of (annotation, likelihood) tuples.
-		Annotations are roles separated by a "///" delimiter
+		Annotations are roles separated by a "///" delimiter (for every version of the ProbAnno object)
     */
     typedef mapping<feature_id, list<function_probability>> roleset_probabilities;
     
@@ -99,6 +99,47 @@ class TestPythonClient(unittest.TestCase):
             traceback.print_exc(file=sys.stderr)
             self.fail(msg = "The expected object %s did not get created in the workspace %s!\n" %(self._config["probannoid"], self._config["test_ws"]))
         
+    def test_annotate_batch(self):
+        ''' Run annotate_batch on a batch of valid Genome objects and verify that the job runs and returns a valid ProbAnno object for each genome.'''
+
+        # Run the annotate_batch() function to generate a ProbAnno object for each genome.
+        probannoIds = [ '%s.batch%d' %(self._config['probannoid'], index) for index in range(2) ]
+        paClient = ProbabilisticAnnotation(self._config["probanno_url"], token=self._token)
+        jobid = paClient.annotate_batch( { 'genomes': [ {
+            "genome": self._config["genomeid"],
+            "genome_workspace": self._config["test_ws"],
+            "probanno": probannoId,
+            "probanno_workspace": self._config["test_ws"] } for probannoId in probannoIds ] } )
+
+        # Allow time for the command to run.
+        time.sleep(float(self._config["runtime"]))
+
+        # Make sure the job has completed.
+        ujsClient = UserAndJobState(self._config['ujs_url'], token=self._token)
+        jobList = ujsClient.list_jobs([ self._config['test_user'] ], 'CE')
+        jobCompleted = False
+        for job in jobList:
+            if jobid == job[0]:
+                jobCompleted = True
+                jobInfo = job
+        self.assertTrue(jobCompleted, 'Job did not complete before timeout of %s seconds' %(self._config['runtime']))
+
+        # See if the job ended in error.
+        details = ''
+        if jobInfo[11] == 1:
+            details = ujsClient.get_detailed_error(jobInfo[0])
+        self.assertEqual(jobInfo[11], 0, 'Job ended in error: %s' %(details))
+
+        # Look for the ProbAnno objects in the test workspace.
+        wsClient = Workspace(self._config["workspace_url"], token=self._token)
+        for probannoId in probannoIds:
+            try:
+                objectList = wsClient.get_objects( [ { 'workspace': self._config['test_ws'], 'name': probannoId } ] )
+                self.assertEqual(objectList[0]['info'][1], probannoId, 'ProbAnno object id %s is not %s' %(objectList[0]['info'][1], probannoId))
+            except WorkspaceServerError as e:
+                traceback.print_exc(file=sys.stderr)
+                self.fail(msg = "The expected object %s did not get created in the workspace %s!\n" %(probannoId, self._config["test_ws"]))
+
     def test_calculate(self):
         ''' Run pa-calculate on a valid ProbAnno object and verify that the job runs and returns a valid RxnProbs object.'''
         
@@ -122,6 +163,29 @@ class TestPythonClient(unittest.TestCase):
             traceback.print_exc(file=sys.stderr)
             self.fail(msg = "The expected object %s did not get created in the workspace %s!\n" %(self._config["rxnprobsid"], self._config["test_ws"]))
 
+    def test_calculate_batch(self):
+        ''' Run calculate_batch on a batch of valid ProbAnno objects and verify that it returns a valid RxnProbs object for each ProbAnno object.'''
+
+        # Run the calculate_batch() function to generate a RxnProbs object for each ProbAnno object.
+        rxnprobsIds = [ '%s.batch%d' %(self._config['rxnprobsid'], index) for index in range(2) ]
+        paClient = ProbabilisticAnnotation(self._config["probanno_url"], token=self._token)
+        objectInfoList = paClient.calculate_batch( { 'probannos': [ {
+            "probanno": self._config["probannoid"],
+            "probanno_workspace": self._config["test_ws"],
+            "rxnprobs": rxnprobsId,
+            "rxnprobs_workspace": self._config["test_ws"] } for rxnprobsId in rxnprobsIds ] } )
+        self.assertEqual([ objectInfo[1] for objectInfo in objectInfoList ], rxnprobsIds, 'RxnProbs object ids are not %s' %(rxnprobsIds))
+
+        # Look for the RxnProbs objects in the test workspace.
+        wsClient = Workspace(self._config["workspace_url"], token=self._token)
+        for rxnprobsId in rxnprobsIds:
+            try:
+                objectList = wsClient.get_objects( [ { 'workspace': self._config['test_ws'], 'name': rxnprobsId } ] )
+                self.assertEqual(objectList[0]['info'][1], rxnprobsId, 'RxnProbs object id %s is not %s' %(objectList[0]['info'][1], rxnprobsId))
+            except WorkspaceServerError as e:
+                traceback.print_exc(file=sys.stderr)
+                self.fail(msg = "The expected object %s did not get created in the workspace %s!\n" %(rxnprobsId, self._config["test_ws"]))
+
     def test_get_rxnprobs(self):
         ''' Verify that we can successfully get a list of rxnprobs data from a valid RxnProbs object.'''
         paClient = ProbabilisticAnnotation(self._config["probanno_url"], token=self._token)
@@ -161,7 +225,9 @@ if __name__ == '__main__':
     suite = unittest.TestSuite()
     suite.addTest(TestPythonClient('test_loadGenome'))
     suite.addTest(TestPythonClient('test_annotate'))
+    suite.addTest(TestPythonClient('test_annotate_batch'))
     suite.addTest(TestPythonClient('test_calculate'))
+    suite.addTest(TestPythonClient('test_calculate_batch'))
     suite.addTest(TestPythonClient('test_get_rxnprobs'))
     suite.addTest(TestPythonClient('test_get_probanno'))
 #    suite.addTest(TestPythonClient('test_cleanup'))
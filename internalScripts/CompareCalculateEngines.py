@@ -0,0 +1,99 @@
+#! /usr/bin/python
+
+import argparse
+import sys
+import os
+import json
+import time
+from biokbase.probabilistic_annotation.Impl import ProbabilisticAnnotation, LikelihoodMatrix
+from biokbase.probabilistic_annotation.DataParser import DataParser
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults, probanno_rolesets, ProbAnnoType
+from biokbase import log
+
+desc = '''
+Compare the complex and reaction probabilities calculated by the python
+(reference) and numpy (sparse matrix) calculate engines from the same ProbAnno
+object.  The ProbAnno object is read from a JSON file with the data of the
+object (e.g. saved from the output of get_probanno() or from the workspace).
+The static database files are found using the data_folder_path variable in
+the specified configuration file.  The exit status is 1 when any complex or
+reaction differs between the engines (the comparison is exact and includes
+the order of the complexes and reactions and the Gene-Protein-Reaction
+relationships).
+'''
+
+class CompareContext(dict):
+    ''' Context object with the logging methods used by the calculate engines. '''
+
+    def log_debug(self, message):
+        return
+
+    def log_err(self, message):
+        print message
+        return
+
+    def get_log_level(self):
+        return log.INFO
+
+class CalculateEngines(ProbabilisticAnnotation):
+    ''' Calculate engines set up with a configuration and without connecting to other services. '''
+
+    def __init__(self, config):
+        self.config = config
+        self.dataParser = DataParser(config)
+        return
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='CompareCalculateEngines.py', description=desc)
+    parser.add_argument('configFilePath', help='path to configuration file', action='store')
+    parser.add_argument('probannoFile', help='path to JSON file with data of ProbAnno object', action='store')
+    parser.add_argument('--repeat', help='number of times to run each engine for timing', action='store', type=int, dest='repeat', default=1)
+    args = parser.parse_args()
+
+    if LikelihoodMatrix is None:
+        print 'The numpy engine is not available because NumPy or SciPy is not installed'
+        exit(1)
+
+    engines = CalculateEngines(set_config_defaults(get_config(args.configFilePath)))
+    ctx = CompareContext()
+    data = json.load(open(args.probannoFile, 'r'))
+    if 'roleset_probabilities' in data:
+        probannoObject = { 'info': [ 0, 'probanno', 'ProbabilisticAnnotation.ProbAnno-1.0' ], 'data': data }
+    else:
+        probannoObject = { 'info': [ 0, 'probanno', ProbAnnoType ], 'data': data }
+    genome = data.get('genome', os.path.basename(args.probannoFile))
+    roles, rolesets, featureProbs = probanno_rolesets(probannoObject, engines.config['separator'])
+
+    # Load the static data and build the sparse matrices before timing so both engines start with a warm cache.
+    engines._matrixReactionProbabilities(ctx, dict(), genome, roles, rolesets, dict(), None)
+    engines._complexProbabilities(ctx, dict(), genome, list(), None)
+
+    start = time.time()
+    for count in range(args.repeat):
+        roleProbs = engines._rolesetProbabilitiesToRoleProbabilities(ctx, dict(), genome, roles, rolesets, featureProbs, None)
+        totalRoleProbs = engines._totalRoleProbabilities(ctx, dict(), genome, roleProbs, None)
+        referenceComplexProbs = engines._complexProbabilities(ctx, dict(), genome, totalRoleProbs, None)
+        referenceReactionProbs = engines._reactionProbabilities(ctx, dict(), genome, referenceComplexProbs, None)
+    referenceTime = (time.time() - start) / args.repeat
+    start = time.time()
+    for count in range(args.repeat):
+        matrixComplexProbs, matrixReactionProbs = engines._matrixReactionProbabilities(ctx, dict(), genome, roles, rolesets, featureProbs, None)
+    matrixTime = (time.time() - start) / args.repeat
+
+    # Compare the complexes and reactions including their order and the types of the likelihoods.
+    numMismatches = 0
+    for name, reference, matrix in [ ('Complex', referenceComplexProbs, matrixComplexProbs), ('Reaction', referenceReactionProbs, matrixReactionProbs) ]:
+        if len(reference) != len(matrix):
+            print '%s lists have different lengths: %d versus %d' %(name, len(reference), len(matrix))
+            numMismatches += 1
+            continue
+        for index in range(len(reference)):
+            if list(reference[index]) != list(matrix[index]) or type(reference[index][1]) != type(matrix[index][1]):
+                print '%s %d differs: %s versus %s' %(name, index, reference[index], matrix[index])
+                numMismatches += 1
+
+    print 'Compared %d complexes and %d reactions, %d mismatches' %(len(referenceComplexProbs), len(referenceReactionProbs), numMismatches)
+    print 'Python engine %.3f seconds, numpy engine %.3f seconds' %(referenceTime, matrixTime)
+    if numMismatches > 0:
+        exit(1)
+    exit(0)
@@ -0,0 +1,76 @@
+#! /usr/bin/python
+
+import argparse
+import sys
+import os
+import time
+from biokbase.probabilistic_annotation.Worker import ProbabilisticAnnotationWorker
+from biokbase.probabilistic_annotation.DataParser import DataParser, SearchOutputColumns
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults
+
+desc = '''
+Compare the roleset probabilities calculated by the python (reference) and
+numpy (vectorized) marble-picking engines from the same search results file.
+The static database files are found using the data_folder_path variable in
+the specified configuration file.  Search results files from older versions
+have the 12 default columns of BLAST output format 6 and are parsed with
+--columns "qseqid sseqid pident length mismatch gapopen qstart qend sstart
+send evalue bitscore".  The exit status is 1 when any likelihood
+differs by more than the tolerance or the engines found different rolesets.
+'''
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='CompareMarbleEngines.py', description=desc)
+    parser.add_argument('configFilePath', help='path to configuration file', action='store')
+    parser.add_argument('blastResultFile', help='path to search results file in BLAST output format 6', action='store')
+    parser.add_argument('--columns', help='space separated list of columns in search results file', action='store', dest='columns', default=' '.join(SearchOutputColumns))
+    parser.add_argument('--tolerance', help='maximum allowed difference in likelihood', action='store', type=float, dest='tolerance', default=1e-9)
+    args = parser.parse_args()
+
+    # Set up a worker the same way as when running a job.
+    worker = ProbabilisticAnnotationWorker()
+    worker.config = set_config_defaults(get_config(args.configFilePath))
+    worker.ctx = { 'client_ip': 'localhost', 'user_id': os.environ.get('USER', ''), 'module': 'CompareMarbleEngines',
+                   'method': 'compare', 'call_id': '0', 'token': None }
+    worker.dataParser = DataParser(worker.config)
+    worker.dataParser.searchColumns = args.columns.split()
+    try:
+        worker.dataParser.searchColumnIndexes()
+    except ValueError as e:
+        print e
+        exit(1)
+    workFolder = os.path.dirname(os.path.abspath(args.blastResultFile))
+    input = { 'genome': os.path.basename(args.blastResultFile) }
+
+    # Load the static data before timing so both engines start with a warm cache.
+    worker.dataParser.getTargetRolestrings()
+
+    start = time.time()
+    reference = worker._rolesetProbabilitiesMarble(input, args.blastResultFile, workFolder)
+    referenceTime = time.time() - start
+    start = time.time()
+    vectorized = worker._rolesetProbabilitiesMarbleVectorized(input, args.blastResultFile, workFolder)
+    vectorizedTime = time.time() - start
+
+    # Compare the rolesets and likelihoods for every query gene.
+    numMismatches = 0
+    maxDifference = 0.0
+    for query in set(reference.keys()) | set(vectorized.keys()):
+        referenceProbs = dict(reference.get(query, []))
+        vectorizedProbs = dict(vectorized.get(query, []))
+        if set(referenceProbs.keys()) != set(vectorizedProbs.keys()):
+            print 'Query %s has different rolesets: %s versus %s' %(query, sorted(referenceProbs.keys()), sorted(vectorizedProbs.keys()))
+            numMismatches += 1
+            continue
+        for roleset in referenceProbs:
+            difference = abs(referenceProbs[roleset] - vectorizedProbs[roleset])
+            maxDifference = max(maxDifference, difference)
+            if difference > args.tolerance:
+                print 'Query %s roleset %s has likelihood %f versus %f' %(query, roleset, referenceProbs[roleset], vectorizedProbs[roleset])
+                numMismatches += 1
+
+    print 'Compared %d query genes, %d mismatches, maximum difference %g' %(len(reference), numMismatches, maxDifference)
+    print 'Python engine %.3f seconds, numpy engine %.3f seconds' %(referenceTime, vectorizedTime)
+    if numMismatches > 0:
+        exit(1)
+    exit(0)
@@ -0,0 +1,153 @@
+#! /usr/bin/python
+
+import argparse
+import sys
+import os
+import time
+from biokbase.probabilistic_annotation.Worker import ProbabilisticAnnotationWorker
+from biokbase.probabilistic_annotation.DataParser import DataParser
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults
+from biokbase.probabilistic_annotation.SearchBackend import searchBackendClass
+
+desc = '''
+Report the recall of the k-mer search prefilter by searching for the query
+proteins in a FASTA file in the full search database and in the candidate
+database selected by the prefilter.  A hit is recalled when the prefiltered
+search found the same query and target pair as the full search.  The report
+also counts query proteins whose most likely roleset changed.  The static
+database files are found using the data_folder_path variable in the specified
+configuration file and the prefilter parameters from the configuration file
+can be overridden to tune them.  The k-mer index is built if it is missing.
+'''
+
+def readQueries(fastaFile):
+    ''' Read the query proteins from a FASTA file.
+
+        @param fastaFile Path to FASTA file
+        @return List of fasta records with query proteins
+    '''
+
+    queries = list()
+    queryId = None
+    sequence = list()
+    for line in open(fastaFile, 'r'):
+        line = line.strip('\r\n')
+        if line.startswith('>'):
+            if queryId is not None:
+                queries.append('>%s\n%s\n' %(queryId, ''.join(sequence)))
+            queryId = line[1:].split()[0]
+            sequence = list()
+        else:
+            sequence.append(line.strip())
+    if queryId is not None:
+        queries.append('>%s\n%s\n' %(queryId, ''.join(sequence)))
+    return queries
+
+def bestRoleset(rolesetProbabilities):
+    ''' Get the most likely roleset of a query protein.
+
+        @param rolesetProbabilities List of tuples with roleset and likelihood
+        @return Roleset with the highest likelihood or None when there are no rolesets
+    '''
+
+    if len(rolesetProbabilities) == 0:
+        return None
+    return max(rolesetProbabilities, key=lambda x: (x[1], x[0]))[0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='PrefilterRecall.py', description=desc)
+    parser.add_argument('configFilePath', help='path to configuration file', action='store')
+    parser.add_argument('queryFile', help='path to FASTA file with query proteins', action='store')
+    parser.add_argument('--kmer-size', help='length of k-mers', action='store', type=int, dest='kmerSize', default=None)
+    parser.add_argument('--min-kmers', help='minimum number of shared k-mers for a candidate', action='store', type=int, dest='minKmers', default=None)
+    parser.add_argument('--max-candidates', help='maximum number of candidates for each query protein', action='store', type=int, dest='maxCandidates', default=None)
+    args = parser.parse_args()
+
+    # Set up a worker the same way as when running a job.
+    worker = ProbabilisticAnnotationWorker()
+    worker.config = set_config_defaults(get_config(args.configFilePath))
+    worker.config['search_prefilter'] = 'kmer'
+    if args.kmerSize is not None:
+        worker.config['prefilter_kmer_size'] = str(args.kmerSize)
+    if args.minKmers is not None:
+        worker.config['prefilter_min_kmers'] = str(args.minKmers)
+    if args.maxCandidates is not None:
+        worker.config['prefilter_max_candidates'] = str(args.maxCandidates)
+    if not searchBackendClass(worker.config).supportsCandidateDatabase:
+        print 'The search prefilter does not work with search_program %s' %(worker.config['search_program'])
+        exit(1)
+    worker.ctx = { 'client_ip': 'localhost', 'user_id': os.environ.get('USER', ''), 'module': 'PrefilterRecall',
+                   'method': 'recall', 'call_id': '0', 'token': None }
+    worker.dataParser = DataParser(worker.config)
+    workFolder = os.path.dirname(os.path.abspath(args.queryFile))
+    input = { 'genome': os.path.basename(args.queryFile) }
+    queries = readQueries(args.queryFile)
+
+    # Build the k-mer index if needed.
+    kmerSize = int(worker.config['prefilter_kmer_size'])
+    kmerIndex = worker.dataParser.readKmerIndex(kmerSize)
+    if kmerIndex is None:
+        print 'Building k-mer index with %d-mers' %(kmerSize)
+        worker.dataParser.buildKmerIndex(kmerSize)
+    else:
+        kmerIndex.close()
+
+    # Search the full database.
+    start = time.time()
+    worker.searchDatabase = None
+    fullResultFile = worker._runBlast(input, queries, workFolder)
+    os.rename(fullResultFile, fullResultFile+'.full')
+    fullResultFile += '.full'
+    fullTime = time.time() - start
+
+    # Search the candidate database selected by the prefilter.
+    start = time.time()
+    worker.searchDatabase = worker._prefilterDatabase(input, queries, workFolder)
+    if worker.searchDatabase is None:
+        print 'The search prefilter did not select any candidate targets'
+        exit(1)
+    prefilterResultFile = worker._runBlast(input, queries, workFolder)
+    prefilterTime = time.time() - start
+    numCandidates = len([ line for line in open(worker.searchDatabase['path'], 'r') if line.startswith('>') ])
+
+    # Compare the hits found by the two searches.
+    fullHits = worker.dataParser.parseBlastOutput(fullResultFile)
+    prefilterHits = worker.dataParser.parseBlastOutput(prefilterResultFile)
+    numHits = 0
+    numRecalled = 0
+    totalScore = 0.0
+    recalledScore = 0.0
+    numBestRecalled = 0
+    numLostQueries = 0
+    for query in fullHits:
+        found = set([ target for target, score in prefilterHits.get(query, []) ])
+        if len(found) == 0:
+            numLostQueries += 1
+        for target, score in fullHits[query]:
+            numHits += 1
+            totalScore += score
+            if target in found:
+                numRecalled += 1
+                recalledScore += score
+        bestTarget = max(fullHits[query], key=lambda x: x[1])[0]
+        if bestTarget in found:
+            numBestRecalled += 1
+
+    # Compare the most likely roleset of each query protein.
+    fullProbs = worker._rolesetProbabilitiesMarble(input, fullResultFile, workFolder)
+    prefilterProbs = worker._rolesetProbabilitiesMarble(input, prefilterResultFile, workFolder)
+    numChanged = 0
+    for query in fullProbs:
+        if bestRoleset(fullProbs[query]) != bestRoleset(prefilterProbs.get(query, [])):
+            numChanged += 1
+
+    numQueries = max(len(fullHits), 1)
+    print 'Prefilter with %d-mers, minimum %s shared k-mers, maximum %s candidates selected %d candidate targets for %d query proteins' \
+        %(kmerSize, worker.config['prefilter_min_kmers'], worker.config['prefilter_max_candidates'], numCandidates, len(queries))
+    print 'Hit recall %.4f (%d of %d hits), score-weighted recall %.4f' \
+        %(float(numRecalled) / max(numHits, 1), numRecalled, numHits, recalledScore / max(totalScore, 1e-300))
+    print 'Best hit recall %.4f (%d of %d query proteins with hits), %d query proteins lost all hits' \
+        %(float(numBestRecalled) / numQueries, numBestRecalled, len(fullHits), numLostQueries)
+    print 'Most likely roleset changed for %d of %d query proteins' %(numChanged, len(fullProbs))
+    print 'Full search %.3f seconds, prefiltered search %.3f seconds' %(fullTime, prefilterTime)
+    exit(0)
@@ -0,0 +1,130 @@
+import unittest
+import tempfile
+import shutil
+import random
+import json
+import os
+from biokbase.probabilistic_annotation.Impl import ProbabilisticAnnotation, LikelihoodMatrix
+from biokbase.probabilistic_annotation.Worker import ProbabilisticAnnotationWorker
+from biokbase.probabilistic_annotation.DataParser import DataParser
+from biokbase.probabilistic_annotation.JobMetrics import JobMetrics
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults, compact_rolesets
+from biokbase import log
+
+# Path to top of repository.
+TopPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class Context(dict):
+    ''' Context object with the logging methods used by the calculate engines. '''
+
+    def log_debug(self, message):
+        pass
+
+    def log_err(self, message):
+        pass
+
+    def get_log_level(self):
+        return log.INFO
+
+class CalculateEngines(ProbabilisticAnnotation):
+    ''' Calculate engines set up with a configuration and without connecting to other services. '''
+
+    def __init__(self, config):
+        self.config = config
+        self.dataParser = DataParser(config)
+        return
+
+@unittest.skipIf(LikelihoodMatrix is None, 'NumPy or SciPy is not available')
+class TestCalculateEngines(unittest.TestCase):
+
+    def setUp(self):
+        # Copy the test static database files so they can be replaced with generated files.
+        self.tempFolder = tempfile.mkdtemp()
+        dataFolder = os.path.join(self.tempFolder, 'data')
+        shutil.copytree(os.path.join(TopPath, 'client-tests', 'TESTDATA'), dataFolder)
+        self.config = set_config_defaults(get_config(os.path.join(TopPath, 'deploy.cfg')))
+        self.config['data_folder_path'] = dataFolder
+        self.config['work_folder_path'] = os.path.join(self.tempFolder, 'jobs')
+        self.config['load_data_option'] = 'preload'
+        self.config['search_program'] = 'stub'
+        self.config['search_program_path'] = ''
+        self.ctx = Context()
+
+    def tearDown(self):
+        DataParser(self.config).clearStaticDataCache()
+        shutil.rmtree(self.tempFolder)
+
+    def _compare(self, roles, rolesets, featureProbs):
+        ''' Verify both engines calculate the same role, complex, and reaction probabilities. '''
+
+        engines = CalculateEngines(self.config)
+        roleProbs = engines._rolesetProbabilitiesToRoleProbabilities(self.ctx, dict(), 'genome', roles, rolesets, featureProbs, None)
+        totalRoleProbs = engines._totalRoleProbabilities(self.ctx, dict(), 'genome', roleProbs, None)
+        complexProbs = engines._complexProbabilities(self.ctx, dict(), 'genome', totalRoleProbs, None)
+        reactionProbs = engines._reactionProbabilities(self.ctx, dict(), 'genome', complexProbs, None)
+        matrixComplexProbs, matrixReactionProbs = engines._matrixReactionProbabilities(self.ctx, dict(), 'genome', roles, rolesets, featureProbs, None)
+
+        # The comparison is exact and includes the order of the complexes and reactions.
+        self.assertEqual(matrixComplexProbs, complexProbs)
+        self.assertEqual(matrixReactionProbs, reactionProbs)
+        matrixTotalRoleProbs = engines._likelihoodMatrix().reactionProbabilities(roles, rolesets, featureProbs, self.config['dilution_percent'])[0]
+        self.assertEqual(sorted(matrixTotalRoleProbs), sorted(totalRoleProbs))
+        return totalRoleProbs, complexProbs, reactionProbs
+
+    def test_testdata(self):
+        '''Annotate the test genome with the stub search program and compare the engines with the test static database files.'''
+
+        worker = ProbabilisticAnnotationWorker()
+        worker.config = dict(self.config)
+        worker.ctx = { 'client_ip': '', 'user_id': '', 'module': '', 'method': 'annotate', 'call_id': '', 'token': '' }
+        worker.metrics = JobMetrics()
+        worker.dataParser = DataParser(worker.config)
+        workFolder = os.path.join(self.tempFolder, 'jobs', 'annotate')
+        os.makedirs(workFolder)
+        genome = json.load(open(os.path.join(TopPath, 'client-tests', 'TESTFASTA.annotated.genome'), 'r'))
+        input = { 'genome': 'genome', 'genome_workspace': 'enginetest', 'probanno': 'probanno', 'probanno_workspace': 'enginetest' }
+        proteins = worker._genomeProteins(input, { 'data': genome })
+        rolestringTuples = worker._rolesetProbabilities(input, proteins, workFolder, None, 'test')
+        self.assertTrue(len(rolestringTuples) > 0)
+        roles, rolesets, featureProbs = compact_rolesets(rolestringTuples, self.config['separator'])
+        totalRoleProbs, complexProbs, reactionProbs = self._compare(roles, rolesets, featureProbs)
+        self.assertTrue(len(reactionProbs) > 0)
+
+    def test_generated(self):
+        '''Compare the engines with generated static database files and roleset probabilities.'''
+
+        # Generate complexes with roles that are in the subsystems, roles that are not, and
+        # reactions with complexes that are not in the complex to roles mapping.
+        generator = random.Random(23)
+        separator = self.config['separator']
+        roles = [ 'Role %d' %(index) for index in range(60) ]
+        dataParser = DataParser(self.config)
+        dataParser.writeFilteredOtuRoles(dict([ ('kb|g.0.peg.%d' %(index), [ roles[index] ]) for index in range(45) ]))
+        complexRoles = dict()
+        for index in range(80):
+            complexRoles['kb|cpx.%d' %(index)] = generator.sample(roles + [ 'Other role %d' %(other) for other in range(5) ], generator.randint(1, 4))
+        dataParser.writeComplexRoles(complexRoles)
+        reactionComplexes = dict()
+        for index in range(150):
+            reactionComplexes['kb|rxn.%d' %(index)] = generator.sample(complexRoles.keys() + [ 'kb|cpx.missing%d' %(other) for other in range(5) ], generator.randint(1, 3))
+        dataParser.writeReactionComplex(reactionComplexes)
+        dataParser.writeStatusFile('ready')
+
+        # Generate roleset probabilities with tied likelihoods so several genes are in a relationship.
+        rolestringTuples = dict()
+        for index in range(120):
+            rolestrings = [ separator.join(sorted(generator.sample(roles[:50], generator.randint(1, 2)))) for count in range(generator.randint(1, 4)) ]
+            rolestringTuples['kb|g.1.peg.%d' %(index)] = [ (rolestring, generator.choice([ 0.5, 0.25, generator.random() ])) for rolestring in set(rolestrings) ]
+        roles, rolesets, featureProbs = compact_rolesets(rolestringTuples, separator)
+        for dilutionPercent in [ '80', '0', '100' ]:
+            self.config['dilution_percent'] = dilutionPercent
+            totalRoleProbs, complexProbs, reactionProbs = self._compare(roles, rolesets, featureProbs)
+
+            # The genes in each relationship are sorted.
+            for role, likelihood, gpr in totalRoleProbs:
+                genes = gpr.strip('()').split(' or ')
+                self.assertEqual(genes, sorted(genes))
+            self.assertTrue(len([ role for role, likelihood, gpr in totalRoleProbs if ' or ' in gpr ]) > 0)
+
+if __name__ == '__main__':
+    unittest.main()
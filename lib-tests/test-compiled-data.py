@@ -0,0 +1,104 @@
+import unittest
+import tempfile
+import shutil
+import os
+from biokbase.probabilistic_annotation.DataParser import DataParser
+from biokbase.probabilistic_annotation.CompiledData import CompiledMapping, CompiledFileError, writeCompiledMapping
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults
+
+# Path to top of repository.
+TopPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestCompiledData(unittest.TestCase):
+
+    def setUp(self):
+        # Copy the test static database files so compiled files are written in a temporary directory.
+        self.tempFolder = tempfile.mkdtemp()
+        dataFolder = os.path.join(self.tempFolder, 'data')
+        shutil.copytree(os.path.join(TopPath, 'client-tests', 'TESTDATA'), dataFolder)
+        self.config = set_config_defaults(get_config(os.path.join(TopPath, 'deploy.cfg')))
+        self.config['data_folder_path'] = dataFolder
+        self.config['work_folder_path'] = os.path.join(self.tempFolder, 'jobs')
+        self.config['load_data_option'] = 'preload'
+        self.config['search_program'] = 'stub'
+        self.dataParser = DataParser(self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempFolder)
+
+    def _roundTrip(self, mapping, sourcePath):
+        ''' Write a mapping to a compiled file and read it back. '''
+
+        path = os.path.join(self.tempFolder, 'mapping.bin')
+        writeCompiledMapping(path, mapping, sourcePath)
+        compiled = CompiledMapping(path)
+        try:
+            self.assertEqual(compiled.toDict(), mapping)
+            for key in mapping:
+                self.assertEqual(compiled.get(key), mapping[key])
+                self.assertEqual([ compiled.string(stringId) for stringId in compiled.getIds(key) ], mapping[key])
+            self.assertEqual(compiled.get('not a key'), None)
+            self.assertEqual(compiled.getIds('not a key'), ())
+            self.assertTrue(compiled.isCurrent(sourcePath))
+        finally:
+            compiled.close()
+
+    def test_static_data_files(self):
+        '''Compile the mappings read from the test static database files and verify they match the text readers.'''
+
+        otu_fidsToRoles, otu_rolesToFids = self.dataParser.readFilteredOtuRoles()
+        self._roundTrip(otu_fidsToRoles, self.dataParser.DataFiles['subsystem_otu_fid_roles_file'])
+        self._roundTrip(self.dataParser.readComplexRoles(), self.dataParser.DataFiles['complexes_roles_file'])
+        self._roundTrip(self.dataParser.readReactionComplex(), self.dataParser.DataFiles['reaction_complexes_file'])
+
+    def test_names(self):
+        '''Compile a mapping with shared, empty, and non-ASCII values and verify it reads back.'''
+
+        sourcePath = self.dataParser.DataFiles['complexes_roles_file']
+        mapping = dict()
+        for index in range(1000):
+            mapping['key%04d' %(index)] = [ 'value%d' %(value) for value in range(index % 7) ]
+        mapping['empty'] = list()
+        mapping['duplicate'] = [ 'value1', 'value1' ]
+        mapping['accent'] = [ u'\xe9nolase'.encode('utf-8') ]
+        self._roundTrip(mapping, sourcePath)
+
+    def test_stale(self):
+        '''Verify a compiled file is not current after the text file it was built from changes.'''
+
+        sourcePath = self.dataParser.DataFiles['complexes_roles_file']
+        path = os.path.join(self.tempFolder, 'mapping.bin')
+        writeCompiledMapping(path, self.dataParser.readComplexRoles(), sourcePath)
+        fid = open(sourcePath, 'a')
+        fid.write('kb|cpx.new\tnew role\n')
+        fid.close()
+        compiled = CompiledMapping(path)
+        self.assertFalse(compiled.isCurrent(sourcePath))
+        compiled.close()
+
+    def test_invalid(self):
+        '''Verify files that are not compiled files are rejected.'''
+
+        path = os.path.join(self.tempFolder, 'bad.bin')
+        for data in [ 'PACD', 'XXXX' + '\0' * 60 ]:
+            fid = open(path, 'wb')
+            fid.write(data)
+            fid.close()
+            self.assertRaises(CompiledFileError, CompiledMapping, path)
+
+    def test_kmer_index(self):
+        '''Build the k-mer index and verify it lists the subsystem proteins with each k-mer.'''
+
+        kmerSize = 4
+        self.dataParser.buildKmerIndex(kmerSize)
+        kmerIndex = self.dataParser.readKmerIndex(kmerSize)
+        self.assertNotEqual(kmerIndex, None)
+        try:
+            for fid, sequence in self.dataParser.readSubsystemFasta().iteritems():
+                for index in range(len(sequence) - kmerSize + 1):
+                    self.assertIn(fid, kmerIndex.get(sequence[index:index+kmerSize]))
+        finally:
+            kmerIndex.close()
+
+if __name__ == '__main__':
+    unittest.main()
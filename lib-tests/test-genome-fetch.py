@@ -0,0 +1,57 @@
+import unittest
+import tempfile
+import shutil
+import json
+import os
+from biokbase.probabilistic_annotation.Worker import ProbabilisticAnnotationWorker
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults, make_workspace_client, make_object_identity
+
+# Path to top of repository.
+TopPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestGenomeFetch(unittest.TestCase):
+
+    def setUp(self):
+        # Store the test Genome object in a local workspace directory.
+        self.tempFolder = tempfile.mkdtemp()
+        self.config = set_config_defaults(get_config(os.path.join(TopPath, 'deploy.cfg')))
+        self.config['workspace_url'] = 'file://' + os.path.join(self.tempFolder, 'workspaces')
+        self.config['work_folder_path'] = self.tempFolder
+        self.genome = json.load(open(os.path.join(TopPath, 'client-tests', 'TESTFASTA.annotated.genome'), 'r'))
+        self.wsClient = make_workspace_client(self.config['workspace_url'])
+        self.wsClient.save_objects( { 'workspace': 'fetchtest', 'objects': [ { 'type': 'KBaseGenomes.Genome', 'name': 'genome', 'data': self.genome } ] } )
+        self.input = { 'genome': 'genome', 'genome_workspace': 'fetchtest' }
+
+    def tearDown(self):
+        shutil.rmtree(self.tempFolder)
+
+    def _getProteins(self, fetchMode):
+        ''' Get the Genome object and its proteins with the specified genome fetch mode. '''
+
+        worker = ProbabilisticAnnotationWorker()
+        worker.config = dict(self.config)
+        worker.config['genome_fetch_mode'] = fetchMode
+        genomeObject = worker._getGenomeObjects( [ make_object_identity('fetchtest', 'genome') ], self.wsClient)[0]
+        return genomeObject, worker._genomeProteins(self.input, genomeObject)
+
+    def test_full(self):
+        '''Get the complete Genome object and verify the proteins are found.'''
+
+        genomeObject, proteins = self._getProteins('full')
+        self.assertEqual(genomeObject['data'], self.genome)
+        featureIds = [ feature['id'] for feature in self.genome['features'] if 'protein_translation' in feature ]
+        self.assertEqual(sorted([ fid for sequence, fids in proteins.values() for fid in fids ]), sorted(featureIds))
+
+    def test_subset(self):
+        '''Get a subset of the Genome object and verify it has the same proteins as the complete object.'''
+
+        fullObject, fullProteins = self._getProteins('full')
+        genomeObject, proteins = self._getProteins('subset')
+        self.assertEqual(sorted(genomeObject['data'].keys()), [ 'features', 'id' ])
+        for feature in genomeObject['data']['features']:
+            self.assertTrue(set(feature.keys()) <= set([ 'id', 'protein_translation' ]))
+        self.assertEqual(proteins, fullProteins)
+        self.assertEqual(genomeObject['info'], fullObject['info'])
+
+if __name__ == '__main__':
+    unittest.main()
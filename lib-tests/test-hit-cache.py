@@ -0,0 +1,84 @@
+import unittest
+import tempfile
+import shutil
+import os
+from biokbase.probabilistic_annotation.HitCache import HitCache, searchNamespace, sequenceChecksum, encodeHits
+
+class TestHitCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempFolder = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempFolder, 'hitcache.db')
+        self.namespace = searchNamespace('checksum', { 'search_program': 'blastp', 'search_program_evalue': '1E-5' })
+
+    def tearDown(self):
+        shutil.rmtree(self.tempFolder)
+
+    def _entrySize(self, checksum, hits):
+        ''' Get the size of a cache entry. '''
+
+        return len(encodeHits(hits)) + len(checksum)
+
+    def test_round_trip(self):
+        '''Store hits and verify they are found, including a protein with no hits.'''
+
+        cache = HitCache(self.path, 1024 * 1024, self.namespace)
+        checksumToHits = { sequenceChecksum('MKV'): [ ('kb|g.0.peg.1', 123.5), ('kb|g.0.peg.2', 0.25) ],
+                           sequenceChecksum('MAL'): list() }
+        cache.store(checksumToHits)
+        missing = sequenceChecksum('MWW')
+        self.assertEqual(cache.lookup(checksumToHits.keys() + [ missing ]), checksumToHits)
+        self.assertEqual(cache.statistics(), { 'hits': 2, 'misses': 1, 'added': 2, 'evicted': 0 })
+        cache.close()
+
+        # Entries are available to a new object.
+        cache = HitCache(self.path, 1024 * 1024, self.namespace)
+        self.assertEqual(cache.lookup(checksumToHits.keys()), checksumToHits)
+        cache.close()
+
+    def test_namespaces(self):
+        '''Verify entries are only found with the namespace they were stored with.'''
+
+        checksum = sequenceChecksum('MKV')
+        cache = HitCache(self.path, 1024 * 1024, self.namespace)
+        cache.store( { checksum: [ ('kb|g.0.peg.1', 10.0) ] } )
+        cache.close()
+
+        otherDatabase = searchNamespace('other', { 'search_program': 'blastp', 'search_program_evalue': '1E-5' })
+        otherParams = searchNamespace('checksum', { 'search_program': 'blastp', 'search_program_evalue': '1E-10' })
+        self.assertEqual(len(set([ self.namespace, otherDatabase, otherParams ])), 3)
+        for namespace in [ otherDatabase, otherParams ]:
+            cache = HitCache(self.path, 1024 * 1024, namespace)
+            self.assertEqual(cache.lookup([ checksum ]), dict())
+            cache.store( { checksum: [ ('kb|g.0.peg.2', 20.0) ] } )
+            self.assertEqual(cache.lookup([ checksum ]), { checksum: [ ('kb|g.0.peg.2', 20.0) ] })
+            cache.close()
+
+        cache = HitCache(self.path, 1024 * 1024, self.namespace)
+        self.assertEqual(cache.lookup([ checksum ]), { checksum: [ ('kb|g.0.peg.1', 10.0) ] })
+        cache.close()
+
+    def test_evict(self):
+        '''Verify the least recently used entries are removed when the cache is full.'''
+
+        hits = [ ('kb|g.0.peg.1', 10.0) ]
+        checksums = [ sequenceChecksum('M' * length) for length in range(1, 11) ]
+        entrySize = self._entrySize(checksums[0], hits)
+
+        # Room for ten entries which is reduced to nine when the cache is full.
+        cache = HitCache(self.path, entrySize * 10, self.namespace)
+        for checksum in checksums:
+            cache.store( { checksum: hits } )
+        self.assertEqual(cache.statistics()['evicted'], 0)
+
+        # Use the oldest entry so the second oldest entry is the least recently used.
+        self.assertEqual(cache.lookup(checksums[:1]).keys(), checksums[:1])
+        newChecksum = sequenceChecksum('MKV')
+        cache.store( { newChecksum: hits } )
+        self.assertEqual(cache.statistics()['evicted'], 2)
+        found = cache.lookup(checksums + [ newChecksum ])
+        self.assertEqual(sorted(found.keys()), sorted([ checksums[0] ] + checksums[3:] + [ newChecksum ]))
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
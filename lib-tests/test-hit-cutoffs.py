@@ -0,0 +1,100 @@
+import unittest
+import os
+from biokbase.probabilistic_annotation.Worker import ProbabilisticAnnotationWorker
+from biokbase.probabilistic_annotation.DataParser import DataParser
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Path to top of repository.
+TopPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Hits for each query protein as lists of tuples with target ID and score.  The hits are not
+# sorted by score and some scores are tied, including at the cutoffs.
+QueryHits = [
+    [ ('t1', 50.0), ('t2', 120.0), ('t3', 60.0), ('t4', 120.0), ('t5', 59.9), ('t6', 60.0) ],
+    [ ('t1', 10.0) ],
+    [ ('t2', 30.0), ('t3', 30.0), ('t4', 30.0) ],
+    [ ('t1', -2.0), ('t2', -0.5), ('t3', -1.0) ],
+    [ ('t5', 0.0), ('t6', 0.0), ('t7', -3.0) ],
+    [ ('t1', 8.0), ('t2', -1.0), ('t3', 3.9), ('t4', 4.0) ]
+]
+
+@unittest.skipIf(numpy is None, 'NumPy is not available')
+class TestHitCutoffs(unittest.TestCase):
+
+    def setUp(self):
+        self.config = set_config_defaults(get_config(os.path.join(TopPath, 'deploy.cfg')))
+        self.config['data_folder_path'] = os.path.join(TopPath, 'client-tests', 'TESTDATA')
+        self.config['search_program'] = 'stub'
+        self.dataParser = DataParser(self.config)
+
+    def _compare(self, maxTargets, minRelativeScore):
+        ''' Verify both implementations of the cutoffs keep the same hits. '''
+
+        worker = ProbabilisticAnnotationWorker()
+        worker.config = dict(self.config)
+        worker.config['max_targets_per_query'] = str(maxTargets)
+        worker.config['min_relative_score'] = str(minRelativeScore)
+
+        # Interleave the hits of the query proteins so the array order differs from the query order.
+        positions = list()
+        for hitIndex in range(max([ len(hits) for hits in QueryHits ])):
+            for query in range(len(QueryHits)):
+                if hitIndex < len(QueryHits[query]):
+                    positions.append( (query, hitIndex) )
+        queryIndex = numpy.array([ query for query, hitIndex in positions ])
+        scores = numpy.array([ QueryHits[query][hitIndex][1] for query, hitIndex in positions ])
+        keep = worker._hitArraysCutoffs(queryIndex, scores, len(QueryHits))
+
+        for query in range(len(QueryHits)):
+            arrayHits = [ QueryHits[query][hitIndex] for position, (hitQuery, hitIndex) in enumerate(positions) if hitQuery == query and keep[position] ]
+            kept, numDropped, droppedScore = self.dataParser.truncateHits(QueryHits[query], maxTargets, minRelativeScore)
+            self.assertEqual(arrayHits, kept, 'query %d with max_targets_per_query=%d and min_relative_score=%s' %(query, maxTargets, minRelativeScore))
+            self.assertEqual(numDropped, len(QueryHits[query]) - len(kept))
+            self.assertTrue(len(kept) > 0)
+
+    def test_no_cutoffs(self):
+        '''Verify all hits are kept without cutoffs.'''
+
+        self._compare(0, 0.0)
+        for hits in QueryHits:
+            self.assertEqual(self.dataParser.truncateHits(hits, 0, 0.0), (hits, 0, 0.0))
+
+    def test_max_targets(self):
+        '''Verify the same hits are kept with only the maximum number of targets.'''
+
+        for maxTargets in [ 1, 2, 3, 10 ]:
+            self._compare(maxTargets, 0.0)
+
+        # Ties keep the hits in the order of the search results.
+        self.assertEqual(self.dataParser.truncateHits(QueryHits[0], 3, 0.0)[0], [ ('t2', 120.0), ('t3', 60.0), ('t4', 120.0) ])
+
+    def test_min_relative_score(self):
+        '''Verify the same hits are kept with only the minimum relative score.'''
+
+        for minRelativeScore in [ 0.5, 0.4995, 1.0 ]:
+            self._compare(0, minRelativeScore)
+
+        # Hits with a score equal to the floor are kept.
+        self.assertEqual(self.dataParser.truncateHits(QueryHits[0], 0, 0.5)[0], [ ('t2', 120.0), ('t3', 60.0), ('t4', 120.0), ('t6', 60.0) ])
+
+    def test_negative_best_score(self):
+        '''Verify the floor is not applied when the best score is not positive.'''
+
+        for query in [ 3, 4 ]:
+            self.assertEqual(self.dataParser.truncateHits(QueryHits[query], 0, 0.5)[0], QueryHits[query])
+        self._compare(0, 0.5)
+        self._compare(1, 0.5)
+
+    def test_combined(self):
+        '''Verify the same hits are kept with both cutoffs.'''
+
+        for maxTargets in [ 1, 2, 3 ]:
+            for minRelativeScore in [ 0.5, 0.9 ]:
+                self._compare(maxTargets, minRelativeScore)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import tempfile
+import shutil
+import multiprocessing
+import time
+import os
+from biokbase.probabilistic_annotation.Helpers import make_job_queue_directory, submit_queued_job, claim_queued_jobs, \
+    finish_queued_job, requeue_running_jobs, queued_job_id
+
+def claimAll(workDirectory, claims):
+    ''' Claim jobs one at a time until the queue is empty and report the claimed entries. '''
+
+    while True:
+        claimed = claim_queued_jobs(workDirectory, 1)
+        if len(claimed) == 0:
+            break
+        claims.put(claimed[0])
+    return
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.workDirectory = tempfile.mkdtemp()
+        self.queueDirectory = make_job_queue_directory(self.workDirectory)
+        self.runningDirectory = os.path.join(self.queueDirectory, 'running')
+
+    def tearDown(self):
+        shutil.rmtree(self.workDirectory)
+
+    def _submit(self, jobIds):
+        ''' Submit jobs with increasing submit times and return the names of their entry files. '''
+
+        entryNames = list()
+        for jobId in jobIds:
+            entryNames.append(os.path.basename(submit_queued_job(self.workDirectory, jobId)))
+            time.sleep(0.001)
+        return entryNames
+
+    def test_submit(self):
+        '''Submit jobs and verify the entries are complete and sort in submit order.'''
+
+        jobIds = [ '5432b1c0e4b0d7a9f3e2a1b%d' %(index) for index in range(5) ] + [ 'job-with-dashes' ]
+        entryNames = self._submit(jobIds)
+        self.assertEqual(sorted(os.listdir(self.queueDirectory)), sorted(entryNames + [ 'running' ]))
+        self.assertEqual(sorted(entryNames), entryNames)
+        for jobId, entryName in zip(jobIds, entryNames):
+            self.assertEqual(queued_job_id(entryName), jobId)
+            self.assertEqual(open(os.path.join(self.queueDirectory, entryName), 'r').read(), jobId + '\n')
+
+    def test_claim(self):
+        '''Claim jobs in submit order and verify their entries move to the running directory.'''
+
+        entryNames = self._submit([ 'job%d' %(index) for index in range(5) ])
+
+        # A partial entry that is still being written is never claimed.
+        open(os.path.join(self.queueDirectory, '.partial-job'), 'w').close()
+        self.assertEqual(claim_queued_jobs(self.workDirectory, 2), entryNames[:2])
+        self.assertEqual(sorted(os.listdir(self.runningDirectory)), entryNames[:2])
+        self.assertEqual(claim_queued_jobs(self.workDirectory, 10), entryNames[2:])
+        self.assertEqual(claim_queued_jobs(self.workDirectory, 10), list())
+        self.assertEqual(sorted(os.listdir(self.queueDirectory)), [ '.partial-job', 'running' ])
+        for entryName in entryNames:
+            finish_queued_job(self.workDirectory, entryName)
+        self.assertEqual(os.listdir(self.runningDirectory), list())
+
+    def test_concurrent_claim(self):
+        '''Claim jobs from several processes at once and verify every job is claimed exactly once.'''
+
+        entryNames = self._submit([ 'job%d' %(index) for index in range(40) ])
+        claims = multiprocessing.Queue()
+        processes = [ multiprocessing.Process(target=claimAll, args=(self.workDirectory, claims)) for index in range(4) ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        claimed = list()
+        while len(claimed) < len(entryNames):
+            claimed.append(claims.get(timeout=10))
+        self.assertTrue(claims.empty())
+        self.assertEqual(sorted(claimed), entryNames)
+        self.assertEqual(sorted(os.listdir(self.runningDirectory)), entryNames)
+
+    def test_requeue(self):
+        '''Verify jobs that were running when the pool stopped are submitted again ahead of later jobs.'''
+
+        entryNames = self._submit([ 'job%d' %(index) for index in range(4) ])
+        running = claim_queued_jobs(self.workDirectory, 2)
+        laterNames = self._submit([ 'later' ])
+        self.assertEqual(requeue_running_jobs(self.workDirectory), running)
+        self.assertEqual(os.listdir(self.runningDirectory), list())
+        self.assertEqual(claim_queued_jobs(self.workDirectory, 10), entryNames + laterNames)
+        self.assertEqual(requeue_running_jobs(self.workDirectory), entryNames + laterNames)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import tempfile
+import shutil
+import random
+import os
+from biokbase.probabilistic_annotation.Worker import ProbabilisticAnnotationWorker
+from biokbase.probabilistic_annotation.DataParser import DataParser
+from biokbase.probabilistic_annotation.JobMetrics import JobMetrics
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Path to top of repository.
+TopPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Maximum allowed difference in likelihood between the engines.
+Tolerance = 1e-12
+
+@unittest.skipIf(numpy is None, 'NumPy is not available')
+class TestMarbleEngines(unittest.TestCase):
+
+    def setUp(self):
+        # Build static database files with targets that have one or more roles in a temporary directory.
+        self.tempFolder = tempfile.mkdtemp()
+        dataFolder = os.path.join(self.tempFolder, 'data')
+        shutil.copytree(os.path.join(TopPath, 'client-tests', 'TESTDATA'), dataFolder)
+        self.config = set_config_defaults(get_config(os.path.join(TopPath, 'deploy.cfg')))
+        self.config['data_folder_path'] = dataFolder
+        self.config['load_data_option'] = 'preload'
+        self.config['search_program'] = 'stub'
+        generator = random.Random(17)
+        roles = [ 'Role %d' %(index) for index in range(8) ]
+        self.targets = [ 'kb|g.%d.peg.%d' %(index % 5, index) for index in range(40) ]
+        fid = open(os.path.join(dataFolder, 'SUBSYSTEM_OTU_FID_ROLES'), 'w')
+        for target in self.targets:
+            fid.write('%s\t%s\n' %(target, self.config['separator'].join(generator.sample(roles, generator.choice([ 1, 1, 1, 2, 3 ])))))
+        fid.close()
+
+        # Build search results with hits for each query gene together, including tied scores,
+        # E-values above 1, a perfect hit, and a hit with a negative bit score that is thrown out.
+        self.resultFile = os.path.join(self.tempFolder, 'results')
+        lines = list()
+        for query in range(30):
+            targets = generator.sample(self.targets, generator.randint(1, 15))
+            evalues = [ generator.choice([ 1e-50, 1e-20 ]) if generator.random() < 0.2 else 10 ** -generator.uniform(-0.5, 150) for target in targets ]
+            for target, evalue in zip(targets, evalues):
+                lines.append('kb|g.99.peg.%d\t%s\t%g\t%.1f\n' %(query, target, evalue, 100.0))
+        lines.append('kb|g.99.peg.30\t%s\t0\t500.0\n' %(self.targets[0]))
+        lines.append('kb|g.99.peg.30\t%s\t1e-10\t-1.0\n' %(self.targets[1]))
+        open(self.resultFile, 'w').write(''.join(lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempFolder)
+
+    def _worker(self, maxTargets, minRelativeScore):
+        ''' Set up a worker the same way as when running a job. '''
+
+        worker = ProbabilisticAnnotationWorker()
+        worker.config = dict(self.config)
+        worker.config['max_targets_per_query'] = str(maxTargets)
+        worker.config['min_relative_score'] = str(minRelativeScore)
+        worker.ctx = { 'client_ip': '', 'user_id': '', 'module': '', 'method': 'annotate', 'call_id': '', 'token': '' }
+        worker.metrics = JobMetrics()
+        worker.dataParser = DataParser(worker.config)
+        return worker
+
+    def _compare(self, resultFile, maxTargets=0, minRelativeScore=0.0):
+        ''' Verify both engines calculate the same roleset probabilities and keep the same hits. '''
+
+        input = { 'genome': 'genome' }
+        worker = self._worker(maxTargets, minRelativeScore)
+        referenceHits = dict()
+        reference = worker._rolesetProbabilitiesMarble(input, resultFile, self.tempFolder, referenceHits)
+        worker = self._worker(maxTargets, minRelativeScore)
+        vectorizedHits = dict()
+        vectorized = worker._rolesetProbabilitiesMarbleVectorized(input, resultFile, self.tempFolder, vectorizedHits)
+
+        self.assertEqual(sorted(reference.keys()), sorted(vectorized.keys()))
+        for query in reference:
+            referenceProbs = dict(reference[query])
+            vectorizedProbs = dict(vectorized[query])
+            self.assertEqual(sorted(referenceProbs.keys()), sorted(vectorizedProbs.keys()))
+            for roleset in referenceProbs:
+                self.assertAlmostEqual(referenceProbs[roleset], vectorizedProbs[roleset], delta=Tolerance)
+        self.assertEqual(referenceHits, vectorizedHits)
+        return reference
+
+    def test_no_cutoffs(self):
+        '''Verify the engines calculate the same roleset probabilities without cutoffs.'''
+
+        reference = self._compare(self.resultFile)
+        self.assertEqual(len(reference), 31)
+        self.assertEqual(len(reference['kb|g.99.peg.30']), 1)
+
+    def test_cutoffs(self):
+        '''Verify the engines calculate the same roleset probabilities with the per-query cutoffs.'''
+
+        for maxTargets, minRelativeScore in [ (3, 0.0), (0, 0.5), (2, 0.8), (1, 1.0) ]:
+            self._compare(self.resultFile, maxTargets, minRelativeScore)
+
+    def test_split_query(self):
+        '''Verify the engines calculate the same roleset probabilities when the hits for a query gene are not together.'''
+
+        lines = open(self.resultFile, 'r').readlines()
+        splitFile = os.path.join(self.tempFolder, 'split')
+        open(splitFile, 'w').write(''.join(lines[1::2] + lines[::2]))
+        self._compare(splitFile)
+
+if __name__ == '__main__':
+    unittest.main()
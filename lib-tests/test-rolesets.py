@@ -0,0 +1,98 @@
+import unittest
+import tempfile
+import shutil
+import os
+from biokbase.probabilistic_annotation.Impl import ProbabilisticAnnotation
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults, make_workspace_client, \
+    compact_rolesets, expand_rolesets, probanno_rolesets, ProbAnnoType
+
+# Path to top of repository.
+TopPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Type of version 1.0 ProbAnno object.
+OldProbAnnoType = 'ProbabilisticAnnotation.ProbAnno-1.0'
+
+class Context(dict):
+    ''' Context object for calling server methods without a server. '''
+
+    def log_err(self, message):
+        pass
+
+    def log_debug(self, message):
+        pass
+
+class TestRolesets(unittest.TestCase):
+
+    def setUp(self):
+        self.tempFolder = tempfile.mkdtemp()
+        self.config = set_config_defaults(get_config(os.path.join(TopPath, 'deploy.cfg')))
+        self.separator = self.config['separator']
+        self.config['workspace_url'] = 'file://' + os.path.join(self.tempFolder, 'workspaces')
+        self.config['work_folder_path'] = os.path.join(self.tempFolder, 'jobs')
+        self.config['data_folder_path'] = os.path.join(self.tempFolder, 'data')
+        shutil.copytree(os.path.join(TopPath, 'client-tests', 'TESTDATA'), self.config['data_folder_path'])
+        self.config['load_data_option'] = 'preload'
+        self.config['search_program'] = 'stub'
+        self.wsClient = make_workspace_client(self.config['workspace_url'])
+
+        # Roleset probabilities in version 1.0 format with shared and multiple role rolesets.
+        enolase = 'Enolase (EC 4.2.1.11)'
+        kinase = 'Pyruvate kinase (EC 2.7.1.40)'
+        both = self.separator.join(sorted([ enolase, kinase ]))
+        self.rolesetProbabilities = { 'kb|g.0.peg.1': [ [ enolase, 0.75 ], [ both, 0.25 ] ],
+                                      'kb|g.0.peg.2': [ [ kinase, 1.0 ] ],
+                                      'kb|g.0.peg.3': [ [ both, 0.5 ], [ enolase, 0.125 ], [ kinase, 0.125 ] ],
+                                      'kb|g.0.peg.4': [ ] }
+
+    def tearDown(self):
+        shutil.rmtree(self.tempFolder)
+
+    def _objectData(self):
+        ''' Build the data for a version 2.0 ProbAnno object from the roleset probabilities. '''
+
+        roles, rolesets, featureProbs = compact_rolesets(self.rolesetProbabilities, self.separator)
+        return { 'id': 'probanno', 'genome': 'genome', 'genome_workspace': 'rolesettest', 'roles': roles,
+                 'rolesets': rolesets, 'feature_probabilities': featureProbs, 'skipped_features': [] }
+
+    def _listTuples(self, queryToTuplist):
+        ''' Convert the tuples in roleset probabilities to lists as they are after a workspace round trip. '''
+
+        return dict([ (query, [ list(tup) for tup in queryToTuplist[query] ]) for query in queryToTuplist ])
+
+    def test_round_trip(self):
+        '''Encode roleset probabilities and verify they decode to the same values.'''
+
+        roles, rolesets, featureProbs = compact_rolesets(self.rolesetProbabilities, self.separator)
+        self.assertEqual(roles, sorted(roles))
+        self.assertEqual(len(rolesets), 3)
+        self.assertEqual(self._listTuples(expand_rolesets(roles, rolesets, featureProbs, self.separator)), self.rolesetProbabilities)
+
+        # The encoding does not depend on the order of the input.
+        reordered = dict([ (query, list(reversed(self.rolesetProbabilities[query]))) for query in self.rolesetProbabilities ])
+        otherRoles, otherRolesets, otherFeatureProbs = compact_rolesets(reordered, self.separator)
+        self.assertEqual((otherRoles, otherRolesets), (roles, rolesets))
+
+    def test_old_object(self):
+        '''Verify a version 1.0 object is encoded when it is read and a version 2.0 object is used as stored.'''
+
+        oldObject = { 'info': [ 0, 'probanno', OldProbAnnoType ], 'data': { 'roleset_probabilities': self.rolesetProbabilities } }
+        self.assertEqual(probanno_rolesets(oldObject, self.separator), compact_rolesets(self.rolesetProbabilities, self.separator))
+        data = self._objectData()
+        newObject = { 'info': [ 0, 'probanno', ProbAnnoType ], 'data': data }
+        self.assertEqual(probanno_rolesets(newObject, self.separator), (data['roles'], data['rolesets'], data['feature_probabilities']))
+
+    def test_get_probanno(self):
+        '''Verify get_probanno() returns roleset probabilities with a rolestring in every tuple for both object versions.'''
+
+        self.wsClient.save_objects( { 'workspace': 'rolesettest', 'objects': [
+            { 'type': ProbAnnoType, 'name': 'probanno', 'data': self._objectData() },
+            { 'type': OldProbAnnoType, 'name': 'oldprobanno', 'data': { 'id': 'oldprobanno', 'roleset_probabilities': self.rolesetProbabilities } } ] } )
+        os.environ['KB_SERVICE_DIR'] = self.tempFolder
+        impl = ProbabilisticAnnotation(self.config)
+        ctx = Context( { 'token': None } )
+        for name in [ 'probanno', 'oldprobanno' ]:
+            output = impl.get_probanno(ctx, { 'probanno': name, 'probanno_workspace': 'rolesettest' })[0]
+            self.assertEqual(self._listTuples(output), self.rolesetProbabilities)
+
+if __name__ == '__main__':
+    unittest.main()
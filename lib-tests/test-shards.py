@@ -0,0 +1,73 @@
+import unittest
+import random
+import os
+from biokbase.probabilistic_annotation.Worker import ProbabilisticAnnotationWorker, MinProteinsPerShard
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults
+
+# Path to top of repository.
+TopPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.config = set_config_defaults(get_config(os.path.join(TopPath, 'deploy.cfg')))
+        self.worker = ProbabilisticAnnotationWorker()
+        self.worker.config = self.config
+        self.worker.ctx = { 'client_ip': '', 'user_id': '', 'module': '', 'method': 'annotate', 'call_id': '', 'token': '' }
+
+    def _queries(self, numProteins, seed=5):
+        ''' Build fasta records for query proteins with lengths like a bacterial genome. '''
+
+        generator = random.Random(seed)
+        queries = list()
+        for index in range(numProteins):
+            length = min(int(generator.lognormvariate(5.6, 0.6)), 3000)
+            queries.append('>kb|g.0.peg.%d\n%s\n' %(index, 'M' * length))
+        return queries
+
+    def _checkShards(self, queries, shards, numShards):
+        ''' Verify the shards have all of the proteins in their original order and about the same number of residues. '''
+
+        self.assertEqual(len(shards), numShards)
+        position = dict([ (queries[index], index) for index in range(len(queries)) ])
+        for shard in shards:
+            self.assertTrue(len(shard) >= MinProteinsPerShard or numShards == 1)
+            indexes = [ position[record] for record in shard ]
+            self.assertEqual(indexes, sorted(indexes))
+        self.assertEqual(sorted([ record for shard in shards for record in shard ]), sorted(queries))
+
+        # Each shard is within the longest protein of the average number of residues.
+        sizes = [ sum([ len(record) for record in shard ]) for shard in shards ]
+        longest = max([ len(record) for record in queries ])
+        self.assertTrue(max(sizes) - min(sizes) <= longest)
+
+    def test_balance(self):
+        '''Split a genome into shards and verify they have about the same number of residues.'''
+
+        queries = self._queries(4000)
+        for numShards in [ 2, 3, 4, 8 ]:
+            self._checkShards(queries, self.worker._shardQueries({ 'search_shards': numShards }, queries), numShards)
+
+    def test_configuration(self):
+        '''Verify the number of shards comes from the configuration variable when the input parameter is not set.'''
+
+        queries = self._queries(4000)
+        self.config['search_shards'] = '4'
+        self._checkShards(queries, self.worker._shardQueries({ 'search_shards': None }, queries), 4)
+        self._checkShards(queries, self.worker._shardQueries({ 'search_shards': 2 }, queries), 2)
+        self.config['search_shards'] = '1'
+        self.assertEqual(self.worker._shardQueries(dict(), queries), [ queries ])
+
+    def test_minimum(self):
+        '''Verify small genomes use fewer shards so each shard has at least the minimum number of proteins.'''
+
+        queries = self._queries(MinProteinsPerShard * 3 - 1)
+        self._checkShards(queries, self.worker._shardQueries({ 'search_shards': 8 }, queries), 2)
+        queries = self._queries(MinProteinsPerShard * 3)
+        self._checkShards(queries, self.worker._shardQueries({ 'search_shards': 8 }, queries), 3)
+        queries = self._queries(MinProteinsPerShard * 2 - 1)
+        self.assertEqual(self.worker._shardQueries({ 'search_shards': 8 }, queries), [ queries ])
+        self.assertEqual(self.worker._shardQueries({ 'search_shards': 8 }, list()), [ list() ])
+
+if __name__ == '__main__':
+    unittest.main()
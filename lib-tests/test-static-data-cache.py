@@ -0,0 +1,85 @@
+import unittest
+import tempfile
+import shutil
+import os
+from biokbase.probabilistic_annotation.DataParser import DataParser
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults
+
+# Path to top of repository.
+TopPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestStaticDataCache(unittest.TestCase):
+
+    def setUp(self):
+        # Copy the test static database files so they can be changed.
+        self.tempFolder = tempfile.mkdtemp()
+        dataFolder = os.path.join(self.tempFolder, 'data')
+        shutil.copytree(os.path.join(TopPath, 'client-tests', 'TESTDATA'), dataFolder)
+        self.config = set_config_defaults(get_config(os.path.join(TopPath, 'deploy.cfg')))
+        self.config['data_folder_path'] = dataFolder
+        self.config['load_data_option'] = 'preload'
+        self.config['search_program'] = 'stub'
+        DataParser(self.config).writeStatusFile('ready')
+
+    def tearDown(self):
+        DataParser(self.config).clearStaticDataCache()
+        shutil.rmtree(self.tempFolder)
+
+    def _updateComplexRoles(self, dataParser):
+        ''' Add a complex to the complex roles file and mark the update done in the status file. '''
+
+        complexRoles = dict(dataParser.readComplexRoles())
+        complexRoles['kb|cpx.new'] = [ 'New role' ]
+        dataParser.writeComplexRoles(complexRoles)
+        dataParser.writeStatusFile('ready')
+
+    def test_shared(self):
+        '''Verify DataParser objects for the same data folder share the cached data.'''
+
+        first = DataParser(self.config)
+        second = DataParser(self.config)
+        self.assertTrue(first.getComplexRoles() is second.getComplexRoles())
+        self.assertEqual(first.getStaticDataChecksum(), second.getStaticDataChecksum())
+
+    def test_one_version(self):
+        '''Verify a DataParser object keeps the version of the data from its first call after the files change.'''
+
+        dataParser = DataParser(self.config)
+        checksum = dataParser.getStaticDataChecksum()
+        complexRoles = dataParser.getComplexRoles()
+        self._updateComplexRoles(dataParser)
+        self.assertTrue(dataParser.getComplexRoles() is complexRoles)
+        self.assertEqual(dataParser.getStaticDataChecksum(), checksum)
+        self.assertNotIn('kb|cpx.new', dataParser.getRoleComplexes().get('New role', []))
+
+        # A new object or a refreshed object sees the new version.
+        newParser = DataParser(self.config)
+        self.assertIn('kb|cpx.new', newParser.getComplexRoles())
+        self.assertNotEqual(newParser.getStaticDataChecksum(), checksum)
+        dataParser.refreshStaticData()
+        self.assertIn('kb|cpx.new', dataParser.getComplexRoles())
+        self.assertEqual(dataParser.getStaticDataChecksum(), newParser.getStaticDataChecksum())
+
+    def test_status_file(self):
+        '''Verify changed files are only noticed after the status file is updated.'''
+
+        dataParser = DataParser(self.config)
+        dataParser.getComplexRoles()
+        complexRoles = dict(dataParser.readComplexRoles())
+        complexRoles['kb|cpx.new'] = [ 'New role' ]
+        dataParser.writeComplexRoles(complexRoles)
+        self.assertNotIn('kb|cpx.new', DataParser(self.config).getComplexRoles())
+        dataParser.writeStatusFile('ready')
+        self.assertIn('kb|cpx.new', DataParser(self.config).getComplexRoles())
+
+    def test_clear(self):
+        '''Verify clearing the cache rebuilds the data.'''
+
+        dataParser = DataParser(self.config)
+        complexRoles = dataParser.getComplexRoles()
+        dataParser.clearStaticDataCache()
+        self.assertFalse(dataParser.getComplexRoles() is complexRoles)
+        self.assertEqual(dataParser.getComplexRoles(), complexRoles)
+
+if __name__ == '__main__':
+    unittest.main()
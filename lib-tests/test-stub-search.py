@@ -0,0 +1,116 @@
+import unittest
+import tempfile
+import shutil
+import json
+import os
+from biokbase.probabilistic_annotation.Worker import ProbabilisticAnnotationWorker
+from biokbase.probabilistic_annotation.DataParser import DataParser, SearchOutputColumns
+from biokbase.probabilistic_annotation.SearchBackend import searchBackendClass, StubSearchBackend
+from biokbase.probabilistic_annotation.JobMetrics import JobMetrics
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults
+
+# Path to top of repository.
+TopPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Role of the reference protein in the test static database files.
+EnolaseRole = 'Enolase (EC 4.2.1.11)'
+
+class ProgressRecorder:
+    ''' User and job state client that records the progress of a job. '''
+
+    def __init__(self):
+        self.stages = list()
+
+    def update_job_progress(self, jobId, token, status, progress, estimate):
+        self.stages.append(status)
+
+class TestStubSearch(unittest.TestCase):
+
+    def setUp(self):
+        # Copy the test static database files so the search database is built in a temporary directory.
+        self.tempFolder = tempfile.mkdtemp()
+        dataFolder = os.path.join(self.tempFolder, 'data')
+        shutil.copytree(os.path.join(TopPath, 'client-tests', 'TESTDATA'), dataFolder)
+        self.config = set_config_defaults(get_config(os.path.join(TopPath, 'deploy.cfg')))
+        self.config['data_folder_path'] = dataFolder
+        self.config['work_folder_path'] = os.path.join(self.tempFolder, 'jobs')
+        self.config['load_data_option'] = 'preload'
+        self.config['search_program'] = 'stub'
+        self.config['search_program_path'] = ''
+        self.genome = json.load(open(os.path.join(TopPath, 'client-tests', 'TESTFASTA.annotated.genome'), 'r'))
+        self.input = { 'genome': 'genome', 'genome_workspace': 'stubtest', 'probanno': 'probanno', 'probanno_workspace': 'stubtest' }
+
+    def tearDown(self):
+        shutil.rmtree(self.tempFolder)
+
+    def _rolesetProbabilities(self, outputMode):
+        ''' Search for the proteins in the test Genome object and calculate the roleset probabilities. '''
+
+        worker = ProbabilisticAnnotationWorker()
+        worker.config = dict(self.config)
+        worker.config['search_output_mode'] = outputMode
+        worker.ctx = { 'client_ip': '', 'user_id': '', 'module': '', 'method': 'annotate', 'call_id': '', 'token': '' }
+        worker.metrics = JobMetrics()
+        worker.dataParser = DataParser(worker.config)
+        workFolder = os.path.join(self.tempFolder, 'jobs', outputMode)
+        os.makedirs(workFolder)
+        proteins = worker._genomeProteins(self.input, { 'data': self.genome })
+        progress = ProgressRecorder()
+        rolestringTuples = worker._rolesetProbabilities(self.input, proteins, workFolder, progress, 'test')
+        return rolestringTuples, progress
+
+    def test_backend(self):
+        '''Select the stub backend by name and verify it runs the stub search program without a search database.'''
+
+        self.assertEqual(searchBackendClass(self.config), StubSearchBackend)
+        backend = StubSearchBackend(self.config)
+        self.assertEqual(backend.databaseFiles(), dict())
+        self.assertEqual(backend.databaseCommand(), None)
+        args = backend.searchCommand('query.faa', 'results', '1', SearchOutputColumns)
+        self.assertTrue(args[1].endswith('StubSearch.py'))
+        self.assertEqual(args[args.index('-outfmt')+1], '6 ' + ' '.join(SearchOutputColumns))
+
+    def test_search_file(self):
+        '''Search with the stub backend writing the results to a file and verify the roleset probabilities.'''
+
+        rolestringTuples, progress = self._rolesetProbabilities('file')
+        self.assertIn('running blast', progress.stages)
+        self._checkRolesetProbabilities(rolestringTuples)
+
+    def test_search_stream(self):
+        '''Search with the stub backend streaming the results and verify the roleset probabilities.'''
+
+        rolestringTuples, progress = self._rolesetProbabilities('stream')
+        self.assertIn('running blast and calculating roleset probabilities', progress.stages)
+        self._checkRolesetProbabilities(rolestringTuples)
+
+    def test_output_modes(self):
+        '''Verify the roleset probabilities are the same when the results are written to a file or streamed.'''
+
+        fileTuples, progress = self._rolesetProbabilities('file')
+        streamTuples, progress = self._rolesetProbabilities('stream')
+        self.assertEqual(fileTuples, streamTuples)
+
+    def _checkRolesetProbabilities(self, rolestringTuples):
+        ''' Verify the feature identical to the reference protein is annotated with the role of the reference protein. '''
+
+        enolaseIds = [ feature['id'] for feature in self.genome['features'] if feature['protein_translation'] == self._referenceSequence() ]
+        self.assertEqual(len(enolaseIds), 1)
+        self.assertIn(enolaseIds[0], rolestringTuples)
+        rolesets = dict(rolestringTuples[enolaseIds[0]])
+        self.assertIn(EnolaseRole, rolesets)
+
+        # The identical protein has the best hit so it has the largest likelihood.
+        for query in rolestringTuples:
+            if query != enolaseIds[0]:
+                for roleset, likelihood in rolestringTuples[query]:
+                    self.assertTrue(likelihood < rolesets[EnolaseRole])
+
+    def _referenceSequence(self):
+        ''' Get the sequence of the reference protein in the test subsystem FASTA file. '''
+
+        lines = open(os.path.join(self.config['data_folder_path'], 'SUBSYSTEM_FASTA'), 'r').read().split('\n')
+        return ''.join([ line.strip() for line in lines[1:] ])
+
+if __name__ == '__main__':
+    unittest.main()
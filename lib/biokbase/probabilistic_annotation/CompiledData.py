@@ -0,0 +1,265 @@
+#!/usr/bin/python
+
+''' Read and write compiled static database files.
+
+    A compiled file stores a mapping of a name to a list of names (e.g. a k-mer to the
+    feature IDs of the subsystem proteins with the k-mer) in a binary format that can be
+    memory-mapped.  All of the names in a file are interned into integer IDs in a string
+    table so that lookups do not need to parse or split text.  The file is kept mapped
+    and searched one key at a time so processes that map the same file share its pages.
+    All integers are unsigned 32-bit values in little-endian byte order.  The file has
+    these sections:
+
+      1. Header with the magic string, format version, number of keys, number of values,
+         number of strings, and the size and modification time of the text file the
+         compiled file was built from
+      2. String offset table with the offset of each string in the string data section
+         (there is one extra entry with the end of the last string)
+      3. Key table with the string ID of each key sorted by name
+      4. Value offset table with the index into the value table of the first value of
+         each key (there is one extra entry with the end of the last list)
+      5. Value table with the string ID of each value
+      6. String data section with the UTF-8 encoded strings
+'''
+
+import os
+import mmap
+import struct
+
+# Identifies a compiled static database file.
+CompiledMagic = 'PACD'
+
+# Current version of the compiled file format.
+CompiledVersion = 1
+
+# Format of the header: magic, version, number of keys, number of values, number of strings,
+# reserved, size of source file, modification time of source file.
+HeaderFormat = '<4sIIIIIQQ'
+HeaderSize = struct.calcsize(HeaderFormat)
+
+# Exception thrown when a compiled file is not valid
+class CompiledFileError(Exception):
+    pass
+
+def writeCompiledMapping(path, mapping, sourcePath):
+    ''' Write a mapping to a compiled file.
+
+        The file is written to a temporary file and renamed so processes that have the
+        old file mapped continue to see a consistent file.
+
+        @param path Path to compiled file
+        @param mapping Dictionary mapping a name to list of names
+        @param sourcePath Path to text file the mapping was read from
+        @return Nothing
+    '''
+
+    # Intern all of the names into integer IDs.
+    stringToId = dict()
+    strings = list()
+    def intern(name):
+        if name not in stringToId:
+            stringToId[name] = len(strings)
+            strings.append(name)
+        return stringToId[name]
+
+    # Keys are sorted by their encoded names so a key can be found with a binary search.
+    keys = sorted(mapping.keys(), key=lambda k: _encode(k))
+    keyIds = list()
+    valueOffsets = [ 0 ]
+    valueIds = list()
+    for key in keys:
+        keyIds.append(intern(key))
+        for value in mapping[key]:
+            valueIds.append(intern(value))
+        valueOffsets.append(len(valueIds))
+
+    # Build the string data section.
+    stringOffsets = [ 0 ]
+    stringData = list()
+    for name in strings:
+        encoded = _encode(name)
+        stringData.append(encoded)
+        stringOffsets.append(stringOffsets[-1] + len(encoded))
+
+    info = os.stat(sourcePath)
+    tempPath = path + '.tmp'
+    fid = open(tempPath, 'wb')
+    fid.write(struct.pack(HeaderFormat, CompiledMagic, CompiledVersion, len(keyIds), len(valueIds), len(strings),
+                          0, info.st_size, int(info.st_mtime)))
+    fid.write(struct.pack('<%dI' %(len(stringOffsets)), *stringOffsets))
+    fid.write(struct.pack('<%dI' %(len(keyIds)), *keyIds))
+    fid.write(struct.pack('<%dI' %(len(valueOffsets)), *valueOffsets))
+    fid.write(struct.pack('<%dI' %(len(valueIds)), *valueIds))
+    fid.write(''.join(stringData))
+    fid.close()
+    os.rename(tempPath, path)
+    return
+
+def _encode(name):
+    ''' Encode a name for storing in a compiled file.
+
+        @param name Name string
+        @return UTF-8 encoded byte string
+    '''
+
+    if isinstance(name, unicode):
+        return name.encode('utf-8')
+    return name
+
+class CompiledMapping:
+
+    def __init__(self, path):
+        ''' Open a compiled file and map it into memory.
+
+            @param path Path to compiled file
+            @raise CompiledFileError when the file is not a valid compiled file
+        '''
+
+        self.path = path
+        fid = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            fid.close()
+            raise CompiledFileError('Compiled file %s is empty or could not be mapped' %(path))
+        fid.close()
+        if len(self.data) < HeaderSize:
+            self.data.close()
+            raise CompiledFileError('Compiled file %s is too short' %(path))
+        (magic, version, self.numKeys, self.numValues, self.numStrings, reserved, self.sourceSize, self.sourceMtime) = \
+            struct.unpack_from(HeaderFormat, self.data, 0)
+        if magic != CompiledMagic or version != CompiledVersion:
+            self.data.close()
+            raise CompiledFileError('Compiled file %s has unsupported format %s version %d' %(path, magic, version))
+
+        # Compute the offsets of the sections in the file.
+        self.stringOffsetsStart = HeaderSize
+        self.keysStart = self.stringOffsetsStart + 4 * (self.numStrings + 1)
+        self.valueOffsetsStart = self.keysStart + 4 * self.numKeys
+        self.valuesStart = self.valueOffsetsStart + 4 * (self.numKeys + 1)
+        self.stringDataStart = self.valuesStart + 4 * self.numValues
+        if self.stringDataStart > len(self.data):
+            self.data.close()
+            raise CompiledFileError('Compiled file %s is truncated' %(path))
+        return
+
+    def isCurrent(self, sourcePath):
+        ''' Check if the compiled file was built from the current version of a text file.
+
+            @param sourcePath Path to text file
+            @return True if the size and modification time of the text file match
+        '''
+
+        if not os.path.exists(sourcePath):
+            return False
+        info = os.stat(sourcePath)
+        return info.st_size == self.sourceSize and int(info.st_mtime) == self.sourceMtime
+
+    def string(self, stringId):
+        ''' Get the name for a string ID.
+
+            @param stringId Integer ID of string
+            @return Name string
+        '''
+
+        (start, end) = struct.unpack_from('<2I', self.data, self.stringOffsetsStart + 4 * stringId)
+        return self.data[self.stringDataStart + start:self.stringDataStart + end]
+
+    def keyString(self, index):
+        ''' Get the name of the key at a position in the key table.
+
+            @param index Position in key table
+            @return Name string
+        '''
+
+        (stringId,) = struct.unpack_from('<I', self.data, self.keysStart + 4 * index)
+        return self.string(stringId)
+
+    def valueIds(self, index):
+        ''' Get the string IDs of the values for the key at a position in the key table.
+
+            @param index Position in key table
+            @return Tuple of integer string IDs
+        '''
+
+        (start, end) = struct.unpack_from('<2I', self.data, self.valueOffsetsStart + 4 * index)
+        return struct.unpack_from('<%dI' %(end - start), self.data, self.valuesStart + 4 * start)
+
+    def get(self, key, default=None):
+        ''' Look up the list of values for a key without loading the whole file.
+
+            @param key Name of key
+            @param default Value returned when the key is not found
+            @return List of names
+        '''
+
+        index = self._findKey(key)
+        if index is None:
+            return default
+        return [ self.string(stringId) for stringId in self.valueIds(index) ]
+
+    def getIds(self, key):
+        ''' Look up the string IDs of the values for a key without loading the whole file.
+
+            @param key Name of key
+            @return Tuple of integer string IDs (empty when the key is not found)
+        '''
+
+        index = self._findKey(key)
+        if index is None:
+            return ()
+        return self.valueIds(index)
+
+    def _findKey(self, key):
+        ''' Find the position of a key in the key table with a binary search.
+
+            @param key Name of key
+            @return Position in key table or None when the key is not found
+        '''
+
+        encoded = _encode(key)
+        low = 0
+        high = self.numKeys
+        while low < high:
+            mid = (low + high) // 2
+            if self.keyString(mid) < encoded:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.numKeys and self.keyString(low) == encoded:
+            return low
+        return None
+
+    def toDict(self):
+        ''' Convert the compiled file to a dictionary.
+
+            @return Dictionary mapping a name to list of names
+        '''
+
+        strings = self.strings()
+        keyIds = struct.unpack_from('<%dI' %(self.numKeys), self.data, self.keysStart)
+        valueOffsets = struct.unpack_from('<%dI' %(self.numKeys + 1), self.data, self.valueOffsetsStart)
+        valueIds = struct.unpack_from('<%dI' %(self.numValues), self.data, self.valuesStart)
+        mapping = dict()
+        for index in xrange(self.numKeys):
+            mapping[strings[keyIds[index]]] = [ strings[stringId] for stringId in valueIds[valueOffsets[index]:valueOffsets[index+1]] ]
+        return mapping
+
+    def strings(self):
+        ''' Get all of the names in the string table.
+
+            @return List of name strings indexed by string ID
+        '''
+
+        offsets = struct.unpack_from('<%dI' %(self.numStrings + 1), self.data, self.stringOffsetsStart)
+        blob = self.data[self.stringDataStart:self.stringDataStart + offsets[-1]]
+        return [ blob[offsets[index]:offsets[index+1]] for index in xrange(self.numStrings) ]
+
+    def close(self):
+        ''' Unmap the compiled file.
+
+            @return Nothing
+        '''
+
+        self.data.close()
+        return
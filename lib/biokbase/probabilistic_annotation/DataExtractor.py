@@ -704,3 +704,26 @@ def reactionComplexLinks(count, config):
             complexToRxn[cplxlist[ii]] = [ rxnlist[ii] ]
 
     return rxnToComplex, complexToRxn
+
+def reactionModelSeedIds(count, config):
+    ''' Query the CDM for the ModelSEED ID of every reaction.
+
+        @param count Number of entities to retrieve in each function call
+        @param config Dictionary of configuration variables
+        @return Dictionary keyed by reaction ID in KBase format of reaction ID in ModelSEED format
+    '''
+
+    cdmi_entity = CDMI_EntityAPI(config["cdmi_url"])
+
+    rxnToModelSeedId = dict()
+    start = 0
+    done = False
+    while not done:
+        subdict = cdmi_entity.all_entities_Reaction(start, count, ['id', 'source_id'])
+        for rxn in subdict:
+            rxnToModelSeedId[rxn] = subdict[rxn]['source_id']
+        start += count
+        if len(subdict) < count:
+            done = True
+
+    return rxnToModelSeedId
@@ -8,17 +8,40 @@ import subprocess
 import json
 import traceback
 import time
+import hashlib
+import threading
+import sqlite3
+import shutil
+import mmap
+import ctypes
+import ctypes.util
 from shock import Client as ShockClient
 from biokbase import log
-from biokbase.probabilistic_annotation.Helpers import now
+from biokbase.probabilistic_annotation.Helpers import now, reference_search_parameters, search_thread_count
+from biokbase.probabilistic_annotation.HitCache import sequenceChecksum
+from biokbase.probabilistic_annotation.ExactMatchIndex import ExactMatchIndex, ExactMatchIndexError, writeExactMatchIndex
+from biokbase.probabilistic_annotation.CompiledData import CompiledMapping, CompiledFileError, writeCompiledMapping
+from biokbase.probabilistic_annotation.SearchBackend import getSearchBackend
 
 # E values of less than 1E-200 are treated as 1E-200 to avoid log of 0 issues.
 MIN_EVALUE = 1E-200
 
-# Exception thrown when makeblastdb command failed
+# Columns of the search results requested from the search programs.  Only the columns
+# used to score hits are requested.  Columns are named with the BLAST output format 6
+# field names.
+SearchOutputColumns = [ 'qseqid', 'sseqid', 'evalue', 'bitscore' ]
+
+# Columns of BLAST output format 6 with the default field list.
+Blast6Columns = [ 'qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore' ]
+
+# Exception thrown when command to build a search database failed
 class MakeblastdbError(Exception):
     pass
 
+# Exception thrown when search for reference proteins failed
+class ReferenceSearchError(Exception):
+    pass
+
 # Exception thrown when static database file is missing from Shock.
 class MissingFileError(Exception):
     pass
@@ -27,6 +50,26 @@ class MissingFileError(Exception):
 class NotReadyError(Exception):
     pass
 
+# Cache of data from the static database files shared by all DataParser objects in
+# a process.  The cache is keyed by path to the data folder and each entry has the
+# checksum of the static database files when the entry was built and a dictionary
+# keyed by name of the cached data.  Data in the cache must be treated as read-only.
+StaticDataCache = dict()
+StaticDataCacheLock = threading.RLock()
+
+# MD5 checksums of the contents of static database files that were not loaded from Shock.
+# The dictionary is keyed by path to file and each entry has the size and modification
+# time of the file when the checksum was calculated so a file is only read again after
+# it changes.
+LocalFileChecksums = dict()
+
+# Search database files locked in memory by this process.  The dictionary is keyed by
+# path to file and each entry has the address and size of the mapping of the file.
+LockedSearchFiles = dict()
+
+# Number of bytes read at a time when preloading search database files.
+PreloadChunkSize = 8 * 1024 * 1024
+
 ''' Read and write data files. '''
 
 class DataParser:
@@ -40,15 +83,22 @@ class DataParser:
         # Save the configuration variables related to data files.
         self.dataFolderPath = config['data_folder_path']
         self.separator = config['separator']
-        self.searchProgram = config['search_program']
-        self.searchProgramPath = config['search_program_path']
         self.shockURL = config['shock_url']
         self.loadDataOption = config['load_data_option']
+        self.databaseWarmup = config.get('search_database_warmup', 'none')
+        self.databaseCopyPath = config.get('search_database_copy_path', '')
+
+        # Columns of search results parsed by default.
+        self.searchColumns = SearchOutputColumns
        
         # Paths to files for tracking status of static database files.
         self.StatusFiles = dict()
         self.StatusFiles['status_file'] = os.path.join(self.dataFolderPath, 'staticdata.status')
         self.StatusFiles['cache_file'] = os.path.join(self.dataFolderPath, 'staticdata.cache')
+        self.StatusFiles['first_job_file'] = os.path.join(self.dataFolderPath, 'staticdata.firstjob')
+
+        # Entry in the static data cache used by this object (set on first use).
+        self.staticData = None
 
         # Paths to files with source data.
         self.DataFiles = dict()
@@ -62,14 +112,20 @@ class DataParser:
         self.DataFiles['complexes_roles_file'] = os.path.join(self.dataFolderPath, 'COMPLEXES_ROLES')
         self.DataFiles['reaction_complexes_file'] = os.path.join(self.dataFolderPath, 'REACTIONS_COMPLEXES')
         
-        # Paths to files for searching for proteins.
-        self.SearchFiles = dict()
-        if self.searchProgram == 'usearch':
-            self.SearchFiles['subsystem_udb_file'] = os.path.join(self.dataFolderPath, 'SUBSYSTEM.udb')
-        else:
-            self.SearchFiles['subsystem_otu_index_file'] = os.path.join(self.dataFolderPath, 'SUBSYSTEM_FASTA.pin')
-            self.SearchFiles['subsystem_otu_sequence_file'] = os.path.join(self.dataFolderPath, 'SUBSYSTEM_FASTA.psq')
-            self.SearchFiles['subsystem_otu_header_file'] = os.path.join(self.dataFolderPath, 'SUBSYSTEM_FASTA.phr')
+        # Paths to files for searching for proteins which depend on the search backend
+        # selected by the search_program variable.
+        self.searchBackend = getSearchBackend(config, self.dataFolderPath)
+        self.SearchFiles = self.searchBackend.databaseFiles()
+
+        # Search the copies of the search database files when all of them are current.
+        if self.databaseCopyPath != '' and len(self.SearchFiles) > 0 and self._searchDatabaseCopiesAreCurrent():
+            self.searchBackend.setDatabaseFolder(self.databaseCopyPath)
+
+        # Paths to optional files built with the source data files that make jobs faster.  A job
+        # works without the file when it is missing.
+        self.IndexFiles = dict()
+        self.IndexFiles['subsystem_exact_match_file'] = os.path.join(self.dataFolderPath, 'SUBSYSTEM_EXACT_MATCHES')
+        self.IndexFiles['reaction_modelseed_ids_file'] = os.path.join(self.dataFolderPath, 'REACTIONS_MODELSEED_IDS')
 
         # Create the data folder if it does not exist.
         if not os.path.exists(config["data_folder_path"]):
@@ -308,13 +364,21 @@ class DataParser:
     def readSubsystemFasta(self):
         ''' Read data from the subsystem FASTA file.
         
-            @note This function does not return data (not sure it is really needed except for symmetry).
-            @return Nothing
+            @return Dictionary mapping a feature ID to amino acid sequence
         '''
     
+        fidsToSeqs = dict()
         fid = open(self.DataFiles['subsystem_otu_fasta_file'], 'r')
+        featureId = None
+        for line in fid:
+            line = line.strip('\r\n')
+            if line.startswith('>'):
+                featureId = line[1:]
+                fidsToSeqs[featureId] = ''
+            elif featureId is not None:
+                fidsToSeqs[featureId] += line
         fid.close()
-        return
+        return fidsToSeqs
     
     def writeSubsystemFasta(self, fidsToSeqs):
         ''' Write data to the subsystem FASTA file.
@@ -331,20 +395,55 @@ class DataParser:
         fid.close()
         return
     
-    def buildSearchDatabase(self):
+    def buildSearchDatabase(self, kmerSize=0):
         ''' Build a search database for the configured search program.
 
             @note Make sure the subsystem FASTA file is available.
+            @param kmerSize Length of k-mers in the k-mer index used by the search prefilter or 0
+                to not build the k-mer index
             @return Nothing
         '''
 
-        # Build the command based on the configured search program.
-        if self.searchProgram == 'usearch':
-            args = [ self.searchProgramPath, '-makeudb_ublast', self.DataFiles['subsystem_otu_fasta_file'], '-output', self.SearchFiles['subsystem_udb_file'] ]
-        else:
-            args = [ "/usr/bin/makeblastdb", "-in", self.DataFiles['subsystem_otu_fasta_file'], "-dbtype", "prot" ]
-    
-        # Run the command to compile the database from the subsystem fasta file.
+        # Run the command to compile the database from the subsystem fasta file (some search
+        # backends search the subsystem fasta file directly).
+        args = self.searchBackend.databaseCommand()
+        if args is not None:
+            self._runDatabaseCommand(args)
+
+        # Build the k-mer index used to select candidate targets for the query proteins.
+        if kmerSize > 0:
+            self.buildKmerIndex(kmerSize)
+        return
+
+    def buildCandidateDatabase(self, candidateIds, fastaFile):
+        ''' Build a search database with a subset of the subsystem proteins.
+
+            @note The search backend must support candidate databases.
+
+            @param candidateIds List of feature IDs of the subsystem proteins in the database
+            @param fastaFile Path to FASTA file for the subset (the database files are created next to it)
+            @return Number of letters in all of the subsystem proteins
+            @raise MakeblastdbError
+        '''
+
+        fidsToSeqs = self.getSubsystemSequences()
+        fid = open(fastaFile, 'w')
+        for featureId in sorted(candidateIds):
+            fid.write('>%s\n%s\n' %(featureId, fidsToSeqs[featureId]))
+        fid.close()
+        args = self.searchBackend.databaseCommand(fastaFile)
+        if args is not None:
+            self._runDatabaseCommand(args)
+        return sum([ len(sequence) for sequence in fidsToSeqs.itervalues() ])
+
+    def _runDatabaseCommand(self, args):
+        ''' Run a command that builds a search database.
+
+            @param args List of arguments for the command
+            @return Nothing
+            @raise MakeblastdbError
+        '''
+
         try:
             proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
             (stdout, stderr) = proc.communicate()
@@ -361,37 +460,310 @@ class DataParser:
             cmd = ' '.join(args)
             raise MakeblastdbError("Failed to run '%s': %s" %(cmd, e.strerror))
         return
+
+    # The k-mer index is a compiled file that maps each k-mer in the subsystem proteins to the
+    # feature IDs of the proteins with the k-mer.  The search prefilter uses it to select the
+    # subsystem proteins that share k-mers with the query proteins as candidate targets.  The
+    # length of the k-mers is part of the file name so indexes for different lengths can coexist.
+
+    def kmerIndexPath(self, kmerSize):
+        ''' Get the path to the k-mer index for a k-mer length.
+
+            @param kmerSize Length of k-mers
+            @return Path to k-mer index file
+        '''
+
+        return '%s.%dmers' %(self.DataFiles['subsystem_otu_fasta_file'], kmerSize)
+
+    def buildKmerIndex(self, kmerSize):
+        ''' Build the k-mer index from the subsystem FASTA file.
+
+            @param kmerSize Length of k-mers
+            @return Number of unique k-mers in the index
+        '''
+
+        fidsToSeqs = self.readSubsystemFasta()
+        kmerToFids = dict()
+        for featureId in sorted(fidsToSeqs.keys()):
+            sequence = fidsToSeqs[featureId]
+            for kmer in set([ sequence[index:index+kmerSize] for index in xrange(len(sequence) - kmerSize + 1) ]):
+                if kmer in kmerToFids:
+                    kmerToFids[kmer].append(featureId)
+                else:
+                    kmerToFids[kmer] = [ featureId ]
+        writeCompiledMapping(self.kmerIndexPath(kmerSize), kmerToFids, self.DataFiles['subsystem_otu_fasta_file'])
+        return len(kmerToFids)
+
+    def readKmerIndex(self, kmerSize):
+        ''' Open the k-mer index for a k-mer length.
+
+            @param kmerSize Length of k-mers
+            @return CompiledMapping object or None if the k-mer index is missing, invalid, or not
+                current with the subsystem FASTA file
+        '''
+
+        path = self.kmerIndexPath(kmerSize)
+        if not os.path.exists(path):
+            return None
+        try:
+            kmerIndex = CompiledMapping(path)
+        except (IOError, CompiledFileError) as e:
+            sys.stderr.write('WARNING: k-mer index %s is not valid: %s\n' %(path, e))
+            return None
+        if not kmerIndex.isCurrent(self.DataFiles['subsystem_otu_fasta_file']):
+            kmerIndex.close()
+            return None
+        return kmerIndex
+
+    # The exact match index maps the checksum of each unique sequence in the subsystem FASTA file to
+    # the reference feature IDs with the sequence and the hits found by searching for the sequence.
+    # Query proteins that are identical to a reference protein get their hits from the index.
+
+    def buildExactMatchIndex(self, config):
+        ''' Build the exact match index by searching for the reference proteins in the search database.
+
+            @note Make sure the subsystem FASTA file and search database are available.
+            @param config Dictionary of configuration variables with the search parameters
+            @return Number of unique reference sequences in the index
+            @raise ReferenceSearchError
+        '''
+
+        # Find the unique sequences and the reference feature IDs with each sequence.
+        fidsToSeqs = self.readSubsystemFasta()
+        checksumToFids = dict()
+        for featureId in sorted(fidsToSeqs.keys()):
+            checksum = sequenceChecksum(fidsToSeqs[featureId])
+            if checksum in checksumToFids:
+                checksumToFids[checksum].append(featureId)
+            else:
+                checksumToFids[checksum] = [ featureId ]
+
+        # Search for the first reference feature with each sequence.
+        queryFile = self.IndexFiles['subsystem_exact_match_file'] + '.faa'
+        resultFile = self.IndexFiles['subsystem_exact_match_file'] + '.out'
+        numResidues = 0
+        fid = open(queryFile, 'w')
+        for checksum in checksumToFids:
+            featureId = checksumToFids[checksum][0]
+            fid.write('>%s\n%s\n' %(featureId, fidsToSeqs[featureId]))
+            numResidues += len(fidsToSeqs[featureId])
+        fid.close()
+        del fidsToSeqs
+        threads = search_thread_count(config, numResidues)
+
+        args = self.searchBackend.searchCommand(queryFile, resultFile, threads, SearchOutputColumns)
+        cmd = ' '.join(args)
+        try:
+            proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+            (stdout, stderr) = proc.communicate()
+            if proc.returncode < 0:
+                raise ReferenceSearchError("'%s' was terminated by signal %d" %(cmd, -proc.returncode))
+            if proc.returncode > 0:
+                details = "'%s' failed with return code %d:\nCommand: '%s'\nStdout: '%s'\nStderr: '%s'" \
+                    %(args[0], proc.returncode, cmd, stdout, stderr)
+                raise ReferenceSearchError(details)
+        except OSError as e:
+            raise ReferenceSearchError("Failed to run '%s': %s" %(cmd, e.strerror))
+
+        # Save the hits keyed by the checksum of the sequence.
+        idToTargetList = self.parseBlastOutput(resultFile)
+        checksumToHits = dict()
+        for checksum in checksumToFids:
+            checksumToHits[checksum] = idToTargetList.get(checksumToFids[checksum][0], [])
+        writeExactMatchIndex(self.IndexFiles['subsystem_exact_match_file'], checksumToFids, checksumToHits,
+                             self._fileChecksum(self.DataFiles['subsystem_otu_fasta_file']), reference_search_parameters(config))
+        os.remove(queryFile)
+        os.remove(resultFile)
+        return len(checksumToFids)
+
+    def getExactMatchIndexParameters(self):
+        ''' Get the search parameters of the exact match index from the static data cache.
+
+            @return Dictionary of search parameters the index was built with or None when the index
+                is missing, not valid, or was not built from the current subsystem FASTA file
+        '''
+
+        def build():
+            path = self.IndexFiles['subsystem_exact_match_file']
+            if not os.path.exists(path):
+                return None
+            try:
+                index = ExactMatchIndex(path)
+                try:
+                    params = index.parameters()
+                finally:
+                    index.close()
+            except (ExactMatchIndexError, sqlite3.Error) as e:
+                sys.stderr.write('WARNING: Exact match index %s is not valid: %s\n' %(path, e))
+                return None
+            if params.pop('fasta_checksum') != self._fileChecksum(self.DataFiles['subsystem_otu_fasta_file']):
+                sys.stderr.write('WARNING: Exact match index %s was not built from the current subsystem FASTA file\n' %(path))
+                return None
+            return params
+        return self._getCachedData('exact_match_index_parameters', build)
+
+    def _fileChecksum(self, path):
+        ''' Get the MD5 checksum of the contents of a file.
+
+            @param path Path to file
+            @return Checksum string
+        '''
+
+        md5 = hashlib.md5()
+        fid = open(path, 'rb')
+        for block in iter(lambda: fid.read(1024 * 1024), ''):
+            md5.update(block)
+        fid.close()
+        return md5.hexdigest()
     
-    def parseBlastOutput(self, blastResultsPath):
+    def searchColumnIndexes(self, columns=None):
+        ''' Get the positions of the columns used to score hits in search results.
+
+            @param columns List of column names or None for the default columns of search results
+            @return Tuple with positions of query ID, target ID, E-value, and bit score columns and number of columns
+            @raise ValueError
+        '''
+
+        if columns is None:
+            columns = self.searchColumns
+        missing = [ name for name in SearchOutputColumns if name not in columns ]
+        if len(missing) > 0:
+            raise ValueError('Search results columns %s do not include %s' %(' '.join(columns), ' '.join(missing)))
+        return tuple([ columns.index(name) for name in SearchOutputColumns ]) + ( len(columns), )
+
+    def parseBlastOutput(self, blastResultsPath, maxTargets=0, minRelativeScore=0.0, droppedHits=None, columns=None):
         ''' Read BLAST results file and store in a convenient structure.
 
             The results file is in BLAST output format 6 where each line describes an alignment
-            found by the search program.  A line has 12 tab delimited fields: (1) query label,
-            (2) target label, (3) percent identity, (4) alignment length, (5) number of
-            mismatches, (6) number of gap opens, (7) 1-based position of start in query,
-            (8) 1-based position of end in query, (9) 1-based position of start in target,
-            (10) 1-based position of end in target, (11) e-value, and (12) bit score.
+            found by the search program with tab delimited fields.  The search programs are
+            asked for four fields (see SearchOutputColumns): (1) query label, (2) target label,
+            (3) e-value, and (4) bit score.  Results with other columns, such as the 12 default
+            fields of format 6 (see Blast6Columns), are parsed by giving the list of columns.
+            The per-query cutoffs are applied to the hits for each query (see truncateHits()).
  
             @note Score is the negative log E-value
             @param blastResultsPath Path to BLAST results file
+            @param maxTargets Maximum number of targets for each query (0 for no limit)
+            @param minRelativeScore Minimum score as a fraction of the best score for each query (0 for no floor)
+            @param droppedHits Dictionary keyed by query ID of tuple with number of dropped hits and
+                sum of squared scores of dropped hits (updated) or None
+            @param columns List of column names or None for the default columns of search results
             @return Dictionary mapping query ID to tuple of target ID and score
+            @raise ValueError
         '''
     
         idToTargetList = dict()
-        for line in open(blastResultsPath, 'r'):
-            fields = line.strip('\r\n').split('\t')
-            queryid = fields[0]
-            targetid = fields[1]
-            if float(fields[11]) < 0.0: # Throw out alignments with a negative bit score
-                print 'throwing out %s' %(line)
-                continue
-            logeval = -1.0 * math.log10(float(fields[10]) + MIN_EVALUE)
-            tup = ( targetid, logeval )
-            if queryid in idToTargetList:
-                idToTargetList[queryid].append( tup )
-            else:
-                idToTargetList[queryid] = [ tup ]
+        fid = open(blastResultsPath, 'r')
+        try:
+            for query, hits in self.iterateBlastOutput(fid, columns):
+                if query in idToTargetList:
+                    idToTargetList[query].extend(hits)
+                else:
+                    idToTargetList[query] = hits
+        finally:
+            fid.close()
+
+        if maxTargets > 0 or minRelativeScore > 0.0:
+            for query in idToTargetList:
+                idToTargetList[query], numDropped, droppedScore = self.truncateHits(idToTargetList[query], maxTargets, minRelativeScore)
+                if droppedHits is not None and numDropped > 0:
+                    droppedHits[query] = ( numDropped, droppedScore )
         return idToTargetList
+
+    def iterateBlastOutput(self, blastResults, columns=None):
+        ''' Iterate over the hits for each query in BLAST results.
+
+            The search programs write all of the hits for a query together so only the hits
+            for one query are kept in memory.  When the hits for a query are not together in
+            the results, there is a group for each run of hits and the query is returned
+            more than once.
+
+            @note Score is the negative log E-value
+            @param blastResults Iterable of lines of BLAST results in output format 6 (e.g. an open file)
+            @param columns List of column names or None for the default columns of search results
+            @return Generator of tuples with query ID and list of tuples with target ID and score
+            @raise ValueError
+        '''
+
+        indexes = self.searchColumnIndexes(columns)
+        currentQuery = None
+        currentHits = list()
+        for line in blastResults:
+            hit = self._parseHit(line, indexes)
+            if hit is None:
+                continue
+            if hit[0] != currentQuery:
+                if currentQuery is not None:
+                    yield currentQuery, currentHits
+                currentQuery = hit[0]
+                currentHits = list()
+            currentHits.append( (hit[1], hit[2]) )
+        if currentQuery is not None:
+            yield currentQuery, currentHits
+        return
+
+    def truncateHits(self, hits, maxTargets, minRelativeScore):
+        ''' Apply the per-query cutoffs to the hits for a query.
+
+            Hits with a score less than minRelativeScore times the best score are dropped and
+            then only the maxTargets hits with the highest scores are kept.  The relative floor
+            is not applied when the best score is not positive since it would be above the best
+            score.  The kept hits are in the same order as the input hits.
+
+            @note Score is the negative log E-value
+            @param hits List of tuples with target ID and score
+            @param maxTargets Maximum number of targets (0 for no limit)
+            @param minRelativeScore Minimum score as a fraction of the best score (0 for no floor)
+            @return List of tuples with target ID and score of kept hits, number of dropped hits,
+                sum of squared scores of dropped hits
+        '''
+
+        if len(hits) == 0:
+            return hits, 0, 0.0
+        order = sorted(range(len(hits)), key=lambda index: float(hits[index][1]), reverse=True)
+        bestscore = float(hits[order[0]][1])
+        floor = bestscore * minRelativeScore
+        keep = [ False ] * len(hits)
+        numKept = 0
+        for index in order:
+            if (minRelativeScore > 0.0 and bestscore > 0.0 and float(hits[index][1]) < floor) or (maxTargets > 0 and numKept >= maxTargets):
+                break
+            keep[index] = True
+            numKept += 1
+        if numKept == len(hits):
+            return hits, 0, 0.0
+        droppedScore = sum([ float(hits[index][1]) ** 2 for index in range(len(hits)) if not keep[index] ])
+        return [ hits[index] for index in range(len(hits)) if keep[index] ], len(hits) - numKept, droppedScore
+
+    def parseBlastLine(self, line, columns=None):
+        ''' Parse one line of BLAST results in output format 6.
+
+            @note Score is the negative log E-value
+            @param line Line from BLAST results
+            @param columns List of column names or None for the default columns of search results
+            @return Tuple with query ID, target ID, and score or None when the line is thrown out
+            @raise ValueError
+        '''
+
+        return self._parseHit(line, self.searchColumnIndexes(columns))
+
+    def _parseHit(self, line, indexes):
+        ''' Parse one line of BLAST results with the positions of the columns used to score hits.
+
+            @note Score is the negative log E-value
+            @param line Line from BLAST results
+            @param indexes Tuple returned by searchColumnIndexes()
+            @return Tuple with query ID, target ID, and score or None when the line is thrown out
+        '''
+
+        queryIndex, targetIndex, evalueIndex, bitscoreIndex, numColumns = indexes
+        fields = line.strip('\r\n').split('\t')
+        if len(fields) < numColumns:
+            return None
+        if float(fields[bitscoreIndex]) < 0.0: # Throw out alignments with a negative bit score
+            return None
+        logeval = -1.0 * math.log10(float(fields[evalueIndex]) + MIN_EVALUE)
+        return ( fields[queryIndex], fields[targetIndex], logeval )
     
     # The complexes to roles file contains a mapping of complex IDs to functional roles.
     # Each line has these fields:
@@ -472,6 +844,38 @@ class DataParser:
             fid.write("%s\t%s\n" %(rxn, self.separator.join(rxnToComplexes[rxn])))
         fid.close()
         return
+
+    # The reaction ModelSEED ID file contains a mapping of reaction IDs to ModelSEED reaction IDs.
+    # Each line has these fields:
+    #   1. Reaction ID in KBase format (e.g. kb|rxn.5682)
+    #   2. Reaction ID in ModelSEED format (e.g. rxn00001)
+
+    def readReactionModelSeedIds(self):
+        ''' Read data from the reaction ModelSEED ID file.
+
+            @return Dictionary mapping a reaction ID in KBase format to reaction ID in ModelSEED format
+        '''
+
+        fid = open(self.IndexFiles['reaction_modelseed_ids_file'], 'r')
+        rxnToModelSeedId = dict()
+        for line in fid:
+            spl = line.strip("\r\n").split("\t")
+            rxnToModelSeedId[spl[0]] = spl[1]
+        fid.close()
+        return rxnToModelSeedId
+
+    def writeReactionModelSeedIds(self, rxnToModelSeedId):
+        ''' Write data to the reaction ModelSEED ID file.
+
+            @param rxnToModelSeedId Dictionary mapping a reaction ID in KBase format to reaction ID in ModelSEED format
+            @return Nothing
+        '''
+
+        fid = open(self.IndexFiles['reaction_modelseed_ids_file'], 'w')
+        for rxn in sorted(rxnToModelSeedId.keys()):
+            fid.write("%s\t%s\n" %(rxn, rxnToModelSeedId[rxn]))
+        fid.close()
+        return
     
     def readRolesetProbabilityFile(self, roleset_probability_file):
         ''' Read the roleset probability file.
@@ -488,7 +892,267 @@ class DataParser:
             else:
                 queryToTuplist[spl[0]] = [ (spl[1], float(spl[2])) ]
         return queryToTuplist
-    
+
+    # The static data cache keeps the data from the static database files in memory so each
+    # file is read at most once per process.  An entry in the cache is rebuilt when the checksum
+    # of the static database files changes (i.e. new files were loaded from Shock or generated).
+    # The checksum is only calculated again when the status file or cache file changes since
+    # pa-loaddata and pa-gendata update the status file when they finish.  A DataParser object
+    # keeps using the entry from its first call so a job sees one version of the data.  Callers
+    # must not modify the returned data since it is shared by all callers in the process.
+
+    def getStaticDataChecksum(self):
+        ''' Get a checksum that identifies the version of the static database files used by this object.
+
+            @return Checksum string
+        '''
+
+        return self._staticDataEntry()['checksum']
+
+    def _calculateStaticDataChecksum(self):
+        ''' Calculate a checksum that identifies the current version of the static database files.
+
+            The checksum of a file loaded from Shock is the MD5 checksum recorded in the cache
+            file and the checksum of a locally generated file is the MD5 checksum of its contents
+            so the same files have the same checksum on every system.
+
+            @return Checksum string
+        '''
+
+        shockChecksums = dict()
+        cacheFilename = self.StatusFiles['cache_file']
+        if os.path.exists(cacheFilename):
+            try:
+                fileCache = json.load(open(cacheFilename, 'r'))
+                for key in fileCache:
+                    shockChecksums[key] = fileCache[key]['file']['checksum']['md5']
+            except (ValueError, KeyError, TypeError):
+                # A damaged cache file means the checksums of the contents are used.
+                shockChecksums = dict()
+        checksums = list()
+        localFiles = dict(self.DataFiles.items() + self.IndexFiles.items())
+        for key in sorted(localFiles.keys()):
+            path = localFiles[key]
+            if key in shockChecksums:
+                checksums.append('%s=%s' %(key, shockChecksums[key]))
+            elif os.path.exists(path):
+                checksums.append('%s=%s' %(key, self._localFileChecksum(path)))
+        return hashlib.md5('\n'.join(checksums)).hexdigest()
+
+    def _localFileChecksum(self, path):
+        ''' Get the MD5 checksum of the contents of a file, reading the file only when it changed.
+
+            @param path Path to file
+            @return Checksum string
+        '''
+
+        info = os.stat(path)
+        with StaticDataCacheLock:
+            entry = LocalFileChecksums.get(path, None)
+            if entry is None or entry['size'] != info.st_size or entry['mtime'] != info.st_mtime:
+                entry = { 'size': info.st_size, 'mtime': info.st_mtime, 'checksum': self._fileChecksum(path) }
+                LocalFileChecksums[path] = entry
+            return entry['checksum']
+
+    def _statusStamp(self):
+        ''' Get the size and modification time of the status file and cache file.
+
+            @return Tuple of file information
+        '''
+
+        stamp = list()
+        for key in [ 'status_file', 'cache_file' ]:
+            try:
+                info = os.stat(self.StatusFiles[key])
+                stamp.append((info.st_size, info.st_mtime))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _staticDataEntry(self):
+        ''' Get the entry in the static data cache used by this object.
+
+            @return Dictionary with checksum of the static database files and dictionary of cached data
+        '''
+
+        with StaticDataCacheLock:
+            if self.staticData is None:
+                stamp = self._statusStamp()
+                entry = StaticDataCache.get(self.dataFolderPath, None)
+                if entry is None or entry['stamp'] != stamp:
+                    checksum = self._calculateStaticDataChecksum()
+                    if entry is None or entry['checksum'] != checksum:
+                        entry = { 'checksum': checksum, 'data': dict() }
+                        StaticDataCache[self.dataFolderPath] = entry
+                    entry['stamp'] = stamp
+                self.staticData = entry
+            return self.staticData
+
+    def _getCachedData(self, name, builder):
+        ''' Get data from the static data cache, building it if needed.
+
+            @param name Name of data in the cache
+            @param builder Function with no arguments that returns the data to cache
+            @return Cached data
+        '''
+
+        with StaticDataCacheLock:
+            entry = self._staticDataEntry()
+            if name not in entry['data']:
+                entry['data'][name] = builder()
+            return entry['data'][name]
+
+    def getFilteredOtuRoles(self):
+        ''' Get the filtered feature ID to roles mappings from the static data cache.
+
+            @return Dictionary mapping a feature ID to list of names of roles, dictionary mapping a role to feature ID
+        '''
+
+        return self._getCachedData('filtered_otu_roles', self.readFilteredOtuRoles)
+
+    def getTargetRolestrings(self):
+        ''' Get the rolestring for each target protein in the subsystem search database.
+
+            A rolestring is the sorted list of the roles of a protein joined by the separator
+            so that the order of the roles does not matter.
+
+            @return Dictionary mapping a feature ID to rolestring
+        '''
+
+        def build():
+            otu_fidsToRoles, otu_rolesToFids = self.getFilteredOtuRoles()
+            targetToRolestring = dict()
+            for target in otu_fidsToRoles:
+                targetToRolestring[target] = self.separator.join(sorted(otu_fidsToRoles[target]))
+            return targetToRolestring
+
+        return self._getCachedData('target_rolestrings', build)
+
+    def getSubsystemRoles(self):
+        ''' Get the set of all roles with representatives in the subsystem search database.
+
+            @return Set of names of roles
+        '''
+
+        def build():
+            otu_fidsToRoles, otu_rolesToFids = self.getFilteredOtuRoles()
+            return frozenset(otu_rolesToFids.keys())
+
+        return self._getCachedData('subsystem_roles', build)
+
+    def getSubsystemSequences(self):
+        ''' Get the amino acid sequences of the subsystem proteins from the static data cache.
+
+            @return Dictionary mapping a feature ID to amino acid sequence
+        '''
+
+        return self._getCachedData('subsystem_sequences', self.readSubsystemFasta)
+
+    def getComplexRoles(self):
+        ''' Get the complex to roles mapping from the static data cache.
+
+            @return Dictionary mapping a complex ID to list of names of functional roles
+        '''
+
+        return self._getCachedData('complex_roles', self.readComplexRoles)
+
+    def getRoleComplexes(self):
+        ''' Get the role to complexes mapping (the inverse of the complex to roles mapping).
+
+            @return Dictionary mapping a role to list of complex IDs
+        '''
+
+        def build():
+            roleToComplexes = dict()
+            complexToRoles = self.getComplexRoles()
+            for cplx in complexToRoles:
+                for role in complexToRoles[cplx]:
+                    if role in roleToComplexes:
+                        roleToComplexes[role].append(cplx)
+                    else:
+                        roleToComplexes[role] = [ cplx ]
+            return roleToComplexes
+
+        return self._getCachedData('role_complexes', build)
+
+    def getReactionComplexes(self):
+        ''' Get the reaction to complexes mapping from the static data cache.
+
+            @return Dictionary mapping a reaction ID to list of complex IDs
+        '''
+
+        return self._getCachedData('reaction_complexes', self.readReactionComplex)
+
+    def getComplexReactions(self):
+        ''' Get the complex to reactions mapping (the inverse of the reaction to complexes mapping).
+
+            @return Dictionary mapping a complex ID to list of reaction IDs
+        '''
+
+        def build():
+            complexToReactions = dict()
+            rxnToComplexes = self.getReactionComplexes()
+            for rxn in rxnToComplexes:
+                for cplx in rxnToComplexes[rxn]:
+                    if cplx in complexToReactions:
+                        complexToReactions[cplx].append(rxn)
+                    else:
+                        complexToReactions[cplx] = [ rxn ]
+            return complexToReactions
+
+        return self._getCachedData('complex_reactions', build)
+
+    def getReactionModelSeedIds(self):
+        ''' Get the reaction to ModelSEED ID mapping from the static data cache.
+
+            @return Dictionary mapping a reaction ID in KBase format to reaction ID in ModelSEED
+                format or None when the reaction ModelSEED ID file is not available
+        '''
+
+        def build():
+            if not os.path.exists(self.IndexFiles['reaction_modelseed_ids_file']):
+                return None
+            return self.readReactionModelSeedIds()
+
+        return self._getCachedData('reaction_modelseed_ids', build)
+
+    def getDerivedData(self, name, builder):
+        ''' Get data derived from the static database files from the static data cache.
+
+            The data is built once and is rebuilt when the static database files change.
+
+            @param name Name of data in the cache
+            @param builder Function with no arguments that returns the data to cache
+            @return Cached data
+        '''
+
+        return self._getCachedData(name, builder)
+
+    def clearStaticDataCache(self):
+        ''' Remove the data for this data folder from the static data cache.
+
+            @return Nothing
+        '''
+
+        with StaticDataCacheLock:
+            if self.dataFolderPath in StaticDataCache:
+                del StaticDataCache[self.dataFolderPath]
+            self.staticData = None
+        return
+
+    def refreshStaticData(self):
+        ''' Use the current version of the static database files for the next calls.
+
+            A long-lived object (e.g. the one used by the server) calls this at the start
+            of a request so each request sees one version of the data.
+
+            @return Nothing
+        '''
+
+        with StaticDataCacheLock:
+            self.staticData = None
+        return
+
     # The status file is used to track the status of setting up the static database files when
     # the server starts.  The first line of the file contains the status which is one of
     # these values:
@@ -561,12 +1225,15 @@ class DataParser:
         shockClient = ShockClient(self.shockURL)
 
         # See if the static database files on this system are up-to-date with files stored in Shock.
-        shockFiles = dict(self.DataFiles.items() + self.SearchFiles.items())
+        shockFiles = dict(self.DataFiles.items() + self.SearchFiles.items() + self.IndexFiles.items())
         for key in shockFiles:
             # Get info about the file stored in Shock.
             localPath = shockFiles[key]
             name = os.path.basename(localPath)
             nodelist = shockClient.query_node( { 'lookupname': 'ProbAnnoData/'+name } )
+            if len(nodelist) == 0 and key in self.IndexFiles:
+                mylog.log_message(log.NOTICE, 'Optional database file %s is not available from %s' %(name, self.shockURL))
+                continue
             if len(nodelist) == 0:
                 message = "Database file %s is not available from %s\n" %(name, self.shockURL)
                 mylog.log_message(log.ERR, message) # MBM
@@ -604,7 +1271,7 @@ class DataParser:
         
         # Upload all of the static database files to shock.
         fileCache = dict()
-        shockFiles = dict(self.DataFiles.items() + self.SearchFiles.items())
+        shockFiles = dict(self.DataFiles.items() + self.SearchFiles.items() + self.IndexFiles.items())
         for key in shockFiles:
             localPath = shockFiles[key]
             name = os.path.basename(localPath)
@@ -648,7 +1315,184 @@ class DataParser:
 
         return
 
-    def getDatabaseFiles(self, mylog, testDataPath):
+    def warmSearchDatabase(self, mylog):
+        ''' Warm up the search database files so the first jobs do not wait to read them from disk.
+
+            When the search_database_copy_path variable is set, the search database files
+            are copied to the directory (e.g. a tmpfs file system) and the copies are
+            searched.  The search_database_warmup variable selects how the files are warmed
+            up: "none" to leave them alone, "preload" to read them into the page cache, or
+            "lock" to also lock them in memory for as long as this process runs.  The time
+            to read the files cold and again from the page cache is logged and the next job
+            to finish logs its latency so cold and warm starts can be compared.
+
+            @param mylog Log object for messages
+            @return Nothing
+        '''
+
+        # Copy the search database files.  The original files are searched when the copies fail.
+        if self.databaseCopyPath != '' and len(self.SearchFiles) > 0:
+            try:
+                numCopied = self.copySearchDatabase()
+                self.searchBackend.setDatabaseFolder(self.databaseCopyPath)
+                mylog.log_message(log.INFO, 'Copied %d search database files to %s' %(numCopied, self.databaseCopyPath))
+            except (IOError, OSError) as e:
+                self.searchBackend.setDatabaseFolder(self.dataFolderPath)
+                mylog.log_message(log.NOTICE, 'Failed to copy search database files to %s: %s' %(self.databaseCopyPath, e))
+        paths = [ os.path.join(self.searchBackend.databaseFolderPath, os.path.basename(path)) for path in sorted(self.SearchFiles.values()) ]
+        paths = [ path for path in paths if os.path.exists(path) ]
+
+        # Read the files into the page cache.
+        if self.databaseWarmup in [ 'preload', 'lock' ]:
+            coldTime, numBytes = self._readFiles(paths)
+            warmTime, numBytes = self._readFiles(paths)
+            message = 'Preloaded %d search database files with %d bytes in %.3f seconds, read again in %.3f seconds' \
+                %(len(paths), numBytes, coldTime, warmTime)
+            sys.stderr.write(message+'\n')
+            mylog.log_message(log.INFO, message)
+
+        # Lock the files in memory.
+        if self.databaseWarmup == 'lock':
+            try:
+                for path in paths:
+                    self._lockFile(path)
+                mylog.log_message(log.INFO, 'Locked %d search database files in memory' %(len(paths)))
+            except OSError as e:
+                mylog.log_message(log.NOTICE, 'Failed to lock search database files in memory (check the memlock limit): %s' %(e))
+
+        # The next job to finish reports its latency with the warm-up that was done.
+        fid = open(self.StatusFiles['first_job_file'], 'w')
+        fid.write('search_database_warmup=%s, search_database_copy_path=%s\n' %(self.databaseWarmup, self.databaseCopyPath))
+        fid.close()
+        return
+
+    def copySearchDatabase(self):
+        ''' Copy the search database files to the directory in the search_database_copy_path variable.
+
+            A file is only copied when the copy is missing or not current.
+
+            @return Number of files copied
+        '''
+
+        if not os.path.exists(self.databaseCopyPath):
+            os.makedirs(self.databaseCopyPath, 0775)
+        numCopied = 0
+        for path in self.SearchFiles.values():
+            copyPath = os.path.join(self.databaseCopyPath, os.path.basename(path))
+            if self._isCurrentCopy(path, copyPath):
+                continue
+            # Copy to a temporary file so a job never searches a partial copy.
+            tempPath = copyPath + '.new'
+            shutil.copy2(path, tempPath)
+            os.rename(tempPath, copyPath)
+            numCopied += 1
+        return numCopied
+
+    def claimFirstJob(self):
+        ''' Claim the report of the first job to finish after the search database was warmed up.
+
+            @return Description of the warm-up or None when another job already claimed the report
+        '''
+
+        claimPath = '%s.%d' %(self.StatusFiles['first_job_file'], os.getpid())
+        try:
+            os.rename(self.StatusFiles['first_job_file'], claimPath)
+        except OSError:
+            return None
+        fid = open(claimPath, 'r')
+        warmup = fid.read().strip()
+        fid.close()
+        os.remove(claimPath)
+        return warmup
+
+    def _searchDatabaseCopiesAreCurrent(self):
+        ''' Check if all of the copies of the search database files are current.
+
+            @return True when all of the copies are current
+        '''
+
+        for path in self.SearchFiles.values():
+            if not self._isCurrentCopy(path, os.path.join(self.databaseCopyPath, os.path.basename(path))):
+                return False
+        return True
+
+    def _isCurrentCopy(self, path, copyPath):
+        ''' Check if a copy of a file is current.
+
+            The copy is current when it has the same size and modification time as the file.
+
+            @param path Path to file
+            @param copyPath Path to copy of file
+            @return True when the copy is current
+        '''
+
+        try:
+            original = os.stat(path)
+            copy = os.stat(copyPath)
+        except OSError:
+            return False
+        return original.st_size == copy.st_size and int(original.st_mtime) == int(copy.st_mtime)
+
+    def _readFiles(self, paths):
+        ''' Read files from start to end.
+
+            @param paths List of paths to files
+            @return Number of seconds to read the files, number of bytes read
+        '''
+
+        start = time.time()
+        numBytes = 0
+        for path in paths:
+            fid = open(path, 'rb')
+            try:
+                while True:
+                    data = fid.read(PreloadChunkSize)
+                    if len(data) == 0:
+                        break
+                    numBytes += len(data)
+            finally:
+                fid.close()
+        return time.time() - start, numBytes
+
+    def _lockFile(self, path):
+        ''' Map a file into memory and lock the pages so they stay in memory.
+
+            The file stays locked until this process exits.  A file that was already
+            locked is unlocked first so a file replaced by a new version is locked again.
+
+            @param path Path to file
+            @return Nothing
+            @raise OSError when the file cannot be mapped or locked
+        '''
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [ ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long ]
+        libc.mlock.argtypes = [ ctypes.c_void_p, ctypes.c_size_t ]
+        libc.munmap.argtypes = [ ctypes.c_void_p, ctypes.c_size_t ]
+
+        if path in LockedSearchFiles:
+            address, size = LockedSearchFiles.pop(path)
+            libc.munmap(address, size)
+        size = os.path.getsize(path)
+        if size == 0:
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            address = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+            if address is None or address == ctypes.c_void_p(-1).value:
+                error = ctypes.get_errno()
+                raise OSError(error, 'mmap of %s failed: %s' %(path, os.strerror(error)))
+            if libc.mlock(address, size) != 0:
+                error = ctypes.get_errno()
+                libc.munmap(address, size)
+                raise OSError(error, 'mlock of %s failed: %s' %(path, os.strerror(error)))
+        finally:
+            os.close(fd)
+        LockedSearchFiles[path] = ( address, size )
+        return
+
+    def getDatabaseFiles(self, mylog, testDataPath, kmerSize=0):
         ''' Get the static database files.
 
             The static database files come from one of three places: (1) Shock,
@@ -659,6 +1503,8 @@ class DataParser:
 
             @param mylog: Log object for messages
             @param testDataPath: Path to directory with test database files
+            @param kmerSize: Length of k-mers in the k-mer index used by the search prefilter or 0
+                when the search prefilter is turned off
             @return Current value of load data option which indicates which of the
                 three places is being used for the static database files
         '''
@@ -697,6 +1543,34 @@ class DataParser:
                 sys.stderr.write('WARNING: Static database files are missing. Switched to test database files in %s.\n' %(testDataPath))
                 mylog.log_message(log.NOTICE, 'Static database files are missing. Switched to test database files in %s' %(testDataPath))
 
+        # Build the k-mer index used by the search prefilter if it is missing or out of date.
+        # The full search database is searched when the k-mer index is not available.
+        if status == 'ready' and kmerSize > 0:
+            try:
+                kmerIndex = self.readKmerIndex(kmerSize)
+                if kmerIndex is None:
+                    numKmers = self.buildKmerIndex(kmerSize)
+                    mylog.log_message(log.INFO, 'Built k-mer index with %d %d-mers in %s' %(numKmers, kmerSize, self.dataFolderPath))
+                else:
+                    kmerIndex.close()
+            except:
+                traceback.print_exc(file=sys.stderr)
+                sys.stderr.write('WARNING: Failed to build k-mer index. The full search database will be searched instead.\n')
+                mylog.log_message(log.NOTICE, 'Failed to build k-mer index in %s' %(self.dataFolderPath))
+
+        # Warm up the search database files so the first jobs do not wait to read them from disk.
+        if status == 'ready':
+            try:
+                self.warmSearchDatabase(mylog)
+            except:
+                traceback.print_exc(file=sys.stderr)
+                sys.stderr.write('WARNING: Failed to warm up search database files.\n')
+                mylog.log_message(log.NOTICE, 'Failed to warm up search database files in %s' %(self.dataFolderPath))
+
+        # Remove the data from the old static database files from the static data cache.  Other
+        # processes rebuild their entries when they see the updated status file.
+        self.clearStaticDataCache()
+
         # Update the status file to indicate that the static database files updating is done.
         self.writeStatusFile(status)
         return self.loadDataOption
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+''' Index of the reference proteins keyed by sequence.
+
+    The exact match index is built with the static database files and maps the MD5
+    checksum of each unique sequence in the subsystem FASTA file to the list of
+    reference feature IDs with the sequence and to the hits found by searching for the
+    sequence in the search database.  A query protein that is identical to a reference
+    protein has the same hits as the reference protein so annotate jobs use the hits
+    from the index instead of searching for the protein.  The index records the checksum
+    of the subsystem FASTA file and the search parameters it was built with so it is
+    only used when it matches the current static database files and configuration.
+'''
+
+import os
+import sqlite3
+from biokbase.probabilistic_annotation.HitCache import encodeHits, decodeHits
+
+# Exception thrown when the exact match index is not valid
+class ExactMatchIndexError(Exception):
+    pass
+
+def writeExactMatchIndex(path, checksumToFids, checksumToHits, fastaChecksum, searchParams):
+    ''' Write an exact match index file.
+
+        @param path Path to index file
+        @param checksumToFids Dictionary keyed by sequence checksum of list of reference feature IDs
+        @param checksumToHits Dictionary keyed by sequence checksum of list of tuples with target ID and score
+        @param fastaChecksum Checksum of the subsystem FASTA file the index is built from
+        @param searchParams Dictionary of search parameters used to find the hits
+        @return Nothing
+    '''
+
+    # Build the index in a temporary file so a partial index is never used.
+    tempPath = path + '.new'
+    if os.path.exists(tempPath):
+        os.remove(tempPath)
+    db = sqlite3.connect(tempPath)
+    db.text_factory = str
+    db.execute('CREATE TABLE parameters (name TEXT PRIMARY KEY, value TEXT)')
+    db.execute('CREATE TABLE exact (checksum TEXT PRIMARY KEY, fids TEXT, hits TEXT)')
+    params = dict(searchParams)
+    params['fasta_checksum'] = fastaChecksum
+    db.executemany('INSERT INTO parameters (name, value) VALUES (?, ?)', [ (name, str(params[name])) for name in params ])
+    db.executemany('INSERT INTO exact (checksum, fids, hits) VALUES (?, ?, ?)',
+                   [ (checksum, '\n'.join(checksumToFids[checksum]), encodeHits(checksumToHits.get(checksum, []))) for checksum in checksumToFids ])
+    db.commit()
+    db.close()
+    os.rename(tempPath, path)
+    return
+
+class ExactMatchIndex:
+
+    def __init__(self, path):
+        ''' Open the index file.
+
+            @param path Path to index file
+            @raise ExactMatchIndexError when the index file does not exist
+        '''
+
+        if not os.path.exists(path):
+            raise ExactMatchIndexError('Exact match index %s does not exist' %(path))
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        return
+
+    def parameters(self):
+        ''' Get the parameters the index was built with.
+
+            @return Dictionary with checksum of the subsystem FASTA file and search parameters
+            @raise ExactMatchIndexError when the index file is not valid
+        '''
+
+        try:
+            params = dict(self.db.execute('SELECT name, value FROM parameters').fetchall())
+        except sqlite3.DatabaseError as e:
+            raise ExactMatchIndexError('Exact match index %s is not valid: %s' %(self.path, e))
+        if 'fasta_checksum' not in params:
+            raise ExactMatchIndexError('Exact match index %s is missing the subsystem FASTA checksum' %(self.path))
+        return params
+
+    def lookup(self, checksums):
+        ''' Get the hits for proteins that are identical to reference proteins.
+
+            @param checksums List of protein sequence checksums
+            @return Dictionary keyed by checksum of list of tuples with target ID and score for
+                the proteins found in the index
+        '''
+
+        found = dict()
+        for start in range(0, len(checksums), 500):
+            batch = checksums[start:start+500]
+            query = 'SELECT checksum, hits FROM exact WHERE checksum IN (%s)' %(','.join('?' * len(batch)))
+            for checksum, hits in self.db.execute(query, batch):
+                found[checksum] = decodeHits(hits)
+        return found
+
+    def referenceIds(self, checksum):
+        ''' Get the reference feature IDs with a sequence.
+
+            @param checksum Protein sequence checksum
+            @return List of reference feature IDs or an empty list when the sequence is not in the index
+        '''
+
+        row = self.db.execute('SELECT fids FROM exact WHERE checksum = ?', [ checksum ]).fetchone()
+        if row is None:
+            return list()
+        return row[0].split('\n')
+
+    def close(self):
+        ''' Close the index file.
+
+            @return Nothing
+        '''
+
+        self.db.close()
+        return
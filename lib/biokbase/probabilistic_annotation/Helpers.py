@@ -3,14 +3,23 @@
 import os
 import sys
 import time
+import errno
+import multiprocessing
 from biokbase.auth import kb_config
+from biokbase.workspace.client import Workspace
+from biokbase.probabilistic_annotation.LocalWorkspace import LocalWorkspace
+from biokbase.probabilistic_annotation.SearchBackend import getSearchBackend, searchBackendClass
 from ConfigParser import ConfigParser
 
 # Default URL for production server
 DefaultURL = 'https://kbase.us/services/probabilistic_annotation/'
 
 # Current version number of ProbAnno object
-ProbAnnoType = 'ProbabilisticAnnotation.ProbAnno-1.0'
+ProbAnnoType = 'ProbabilisticAnnotation.ProbAnno-2.0'
+
+# Versions of ProbAnno object that can be read (version 1.0 has a rolestring in every
+# roleset probability tuple).
+ProbAnnoTypes = [ 'ProbabilisticAnnotation.ProbAnno-1.0', ProbAnnoType ]
 
 # Current version number of RxnProbs object
 RxnProbsType = 'ProbabilisticAnnotation.RxnProbs-1.0'
@@ -18,6 +27,45 @@ RxnProbsType = 'ProbabilisticAnnotation.RxnProbs-1.0'
 # Current version of service.
 ServiceVersion = '1.1.0'
 
+# Maximum number of objects saved in one call to the workspace by the batch methods.
+SaveBatchSize = 50
+
+# Number of residues of query proteins that keep one search thread busy when the
+# number of search threads is selected automatically.
+ResiduesPerSearchThread = 50000
+
+# Maximum number of processes used by one calculate_batch() request when the number of
+# processes is selected automatically.  Every server process can run a request at the
+# same time so the limit keeps the total number of processes reasonable.
+MaxCalculateBatchProcesses = 4
+
+# Default values for optional configuration variables that are not in older configuration files.
+ConfigDefaults = {
+    'search_output_mode': 'file',
+    'search_input_mode': 'file',
+    'genome_fetch_mode': 'full',
+    'marble_engine': 'python',
+    'calculate_engine': 'python',
+    'calculate_batch_processes': 'auto',
+    'search_shards': '1',
+    'pool_size': '2',
+    'hit_cache_size': '0',
+    'hit_cache_path': '',
+    'search_prefilter': 'none',
+    'prefilter_kmer_size': '5',
+    'prefilter_min_kmers': '2',
+    'prefilter_max_candidates': '500',
+    'max_targets_per_query': '0',
+    'min_relative_score': '0',
+    'search_backend_modules': '',
+    'search_database_warmup': 'none',
+    'search_database_copy_path': ''
+}
+
+# Input parameters of annotate() and annotate_batch() that override the configuration variable
+# with the same name for a job.
+HitCutoffParameters = [ 'max_targets_per_query', 'min_relative_score' ]
+
 def read_config(filename=None):
     ''' Read a configuration file.
 
@@ -66,6 +114,257 @@ def get_config(filename=None):
         sectionConfig[nameval[0]] = nameval[1]
     return sectionConfig
 
+def set_config_defaults(config):
+    ''' Add default values for optional configuration variables that are not set.
+
+        @param config Dictionary mapping configuration variables to values
+        @return Dictionary mapping configuration variables to values
+    '''
+
+    for key in ConfigDefaults:
+        if key not in config:
+            config[key] = ConfigDefaults[key]
+    return config
+
+def search_parameters(config):
+    ''' Get the configuration variables that change the hits found by the search program.
+
+        @param config Dictionary mapping configuration variables to values
+        @return Dictionary of parameter names and values
+    '''
+
+    searchParams = reference_search_parameters(config)
+    if hit_cutoffs(config)[0] > 0:
+        searchParams['max_targets_per_query'] = config['max_targets_per_query']
+
+    # The search prefilter only searches the candidate targets selected for the query proteins
+    # so it can find fewer hits than searching the full database.
+    kmerSize = prefilter_kmer_size(config)
+    if kmerSize > 0:
+        searchParams['search_prefilter'] = config['search_prefilter']
+        searchParams['prefilter_kmer_size'] = str(kmerSize)
+        searchParams['prefilter_min_kmers'] = config.get('prefilter_min_kmers', ConfigDefaults['prefilter_min_kmers'])
+        searchParams['prefilter_max_candidates'] = config.get('prefilter_max_candidates', ConfigDefaults['prefilter_max_candidates'])
+    return searchParams
+
+def reference_search_parameters(config):
+    ''' Get the configuration variables that change the hits found by searching for the reference proteins.
+
+        The exact match index keeps all of the hits for the reference proteins since the
+        per-query cutoffs are applied when the hits are scored.
+
+        @param config Dictionary mapping configuration variables to values
+        @return Dictionary of parameter names and values
+    '''
+
+    return getSearchBackend(config).searchParameters()
+
+def hit_cutoffs(config):
+    ''' Get the per-query cutoffs applied to the hits before roleset probabilities are calculated.
+
+        @param config Dictionary mapping configuration variables to values
+        @return Maximum number of targets for each query protein (0 for no limit), minimum score
+            as a fraction of the best score for each query protein (0 for no floor)
+    '''
+
+    maxTargets = int(config.get('max_targets_per_query', ConfigDefaults['max_targets_per_query']))
+    minRelativeScore = float(config.get('min_relative_score', ConfigDefaults['min_relative_score']))
+    return maxTargets, minRelativeScore
+
+def prefilter_kmer_size(config):
+    ''' Get the length of k-mers in the k-mer index used by the search prefilter.
+
+        @param config Dictionary mapping configuration variables to values
+        @return Length of k-mers or 0 when the search prefilter is turned off
+    '''
+
+    if config.get('search_prefilter', 'none') != 'kmer' or not searchBackendClass(config).supportsCandidateDatabase:
+        return 0
+    return int(config.get('prefilter_kmer_size', ConfigDefaults['prefilter_kmer_size']))
+
+def make_running_job_directory(workDirectory):
+    ''' Make the directory that records the annotate jobs running on the local host.
+
+        @param workDirectory Path to base working directory
+        @returns Path to running job directory
+    '''
+
+    runningDirectory = os.path.join(workDirectory, 'active')
+    if not os.path.exists(runningDirectory):
+        try:
+            os.makedirs(runningDirectory, 0775)
+        except OSError as e:
+            # Another job may have created the directory at the same time.
+            if e.errno != errno.EEXIST:
+                raise
+    return runningDirectory
+
+def start_running_job(workDirectory, jobID):
+    ''' Record that a job is running on the local host.
+
+        The entry file has the process ID of the job so entries left behind by jobs
+        that were killed are not counted.
+
+        @param workDirectory Path to base working directory
+        @param jobID Job identifier
+        @returns Path to entry file for the job
+    '''
+
+    entryPath = os.path.join(make_running_job_directory(workDirectory), jobID)
+    fid = open(entryPath, 'w')
+    fid.write('%d\n' %(os.getpid()))
+    fid.close()
+    return entryPath
+
+def end_running_job(workDirectory, jobID):
+    ''' Remove the record that a job is running on the local host.
+
+        @param workDirectory Path to base working directory
+        @param jobID Job identifier
+        @returns Nothing
+    '''
+
+    try:
+        os.remove(os.path.join(workDirectory, 'active', jobID))
+    except OSError:
+        pass
+    return
+
+def count_running_jobs(workDirectory):
+    ''' Count the annotate jobs running on the local host.
+
+        Entries for jobs whose process no longer exists are removed.
+
+        @param workDirectory Path to base working directory
+        @returns Number of running jobs
+    '''
+
+    runningDirectory = os.path.join(workDirectory, 'active')
+    if not os.path.isdir(runningDirectory):
+        return 0
+    numJobs = 0
+    for entryName in os.listdir(runningDirectory):
+        entryPath = os.path.join(runningDirectory, entryName)
+        try:
+            pid = int(open(entryPath, 'r').readline())
+            os.kill(pid, 0)
+        except (IOError, ValueError):
+            # The entry was just removed or is still being written.
+            continue
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                end_running_job(workDirectory, entryName)
+                continue
+        numJobs += 1
+    return numJobs
+
+def search_thread_count(config, numResidues, numSearches=1):
+    ''' Get the number of threads for each search program run by a job.
+
+        When blast_threads is "auto", the CPUs of the local host are shared evenly by
+        the annotate jobs running on the host and a job only uses as many threads as
+        its query proteins can keep busy (one thread for every ResiduesPerSearchThread
+        residues).  The threads of a job are split across its concurrent searches.
+
+        @param config Dictionary mapping configuration variables to values
+        @param numResidues Total number of residues in the query proteins
+        @param numSearches Number of search programs run at the same time by the job
+        @return Number of threads as a string
+    '''
+
+    if config['blast_threads'] != 'auto':
+        return config['blast_threads']
+    try:
+        numCpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        numCpus = 1
+    numJobs = max(count_running_jobs(config['work_folder_path']), 1)
+    available = max(numCpus // numJobs, 1)
+    useful = max(int((numResidues + ResiduesPerSearchThread - 1) // ResiduesPerSearchThread), 1)
+    return str(max(min(available, useful) // max(numSearches, 1), 1))
+
+def calculate_process_count(config, numObjects):
+    ''' Get the number of processes used by calculate_batch() to calculate reaction probabilities.
+
+        When calculate_batch_processes is "auto", the CPUs of the local host are shared evenly
+        by the annotate jobs running on the host and the request, and a request uses at most
+        MaxCalculateBatchProcesses processes.
+
+        @param config Dictionary mapping configuration variables to values
+        @param numObjects Number of ProbAnno objects in the request
+        @return Number of processes
+    '''
+
+    if config['calculate_batch_processes'] != 'auto':
+        return max(min(numObjects, int(config['calculate_batch_processes'])), 1)
+    try:
+        numCpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        numCpus = 1
+    available = max(numCpus // (count_running_jobs(config['work_folder_path']) + 1), 1)
+    return max(min(numObjects, available, MaxCalculateBatchProcesses), 1)
+
+def compact_rolesets(queryToTuplist, separator):
+    ''' Encode roleset probabilities with a dictionary of rolesets.
+
+        Each distinct rolestring is split into roles once.  The roles and rolesets are
+        sorted so the same roleset probabilities always have the same encoding.
+
+        @param queryToTuplist Dictionary keyed by query gene of list of tuples with roleset and likelihood
+        @param separator String that separates the roles in a rolestring
+        @return Tuple with list of roles, list of lists of role indices for each roleset, and
+            dictionary keyed by query gene of list of tuples with roleset index and likelihood
+    '''
+
+    rolestrings = set()
+    for query in queryToTuplist:
+        for tup in queryToTuplist[query]:
+            rolestrings.add(tup[0])
+    rolestrings = sorted(rolestrings)
+    roles = sorted(set([ role for rolestring in rolestrings for role in rolestring.split(separator) ]))
+    roleIndex = dict([ (roles[index], index) for index in range(len(roles)) ])
+    rolesetIndex = dict()
+    rolesets = list()
+    for rolestring in rolestrings:
+        rolesetIndex[rolestring] = len(rolesets)
+        rolesets.append([ roleIndex[role] for role in rolestring.split(separator) ])
+    featureProbs = dict()
+    for query in queryToTuplist:
+        featureProbs[query] = [ (rolesetIndex[tup[0]], tup[1]) for tup in queryToTuplist[query] ]
+    return roles, rolesets, featureProbs
+
+def expand_rolesets(roles, rolesets, featureProbs, separator):
+    ''' Decode roleset probabilities encoded with a dictionary of rolesets.
+
+        @param roles List of roles
+        @param rolesets List of lists of role indices for each roleset
+        @param featureProbs Dictionary keyed by query gene of list of tuples with roleset index and likelihood
+        @param separator String that separates the roles in a rolestring
+        @return Dictionary keyed by query gene of list of tuples with roleset and likelihood
+    '''
+
+    rolestrings = [ separator.join([ roles[index] for index in roleset ]) for roleset in rolesets ]
+    queryToTuplist = dict()
+    for query in featureProbs:
+        queryToTuplist[query] = [ (rolestrings[tup[0]], tup[1]) for tup in featureProbs[query] ]
+    return queryToTuplist
+
+def probanno_rolesets(probannoObject, separator):
+    ''' Get the roleset probabilities encoded with a dictionary of rolesets from a ProbAnno object.
+
+        A version 1.0 object is encoded when it is read.
+
+        @param probannoObject ProbAnno object returned by get_objects()
+        @param separator String that separates the roles in a rolestring
+        @return Tuple with list of roles, list of lists of role indices for each roleset, and
+            dictionary keyed by query gene of list of tuples with roleset index and likelihood
+    '''
+
+    data = probannoObject['data']
+    if probannoObject['info'][2] == ProbAnnoType:
+        return data['roles'], data['rolesets'], data['feature_probabilities']
+    return compact_rolesets(data['roleset_probabilities'], separator)
+
 def get_url():
     ''' Get the current URL for the service.
 
@@ -172,6 +471,21 @@ def make_object_identity(workspace, object, ver=None):
         objectIdentity['ver'] = ver
     return objectIdentity
 
+def make_workspace_client(url, token=None):
+    ''' Make a client for the workspace service.
+
+        When the URL is a file URL, a local stand-in for the workspace service that
+        stores objects in the specified directory is used.
+
+        @param url URL of workspace service
+        @param token Authorization token of user
+        @return Workspace client object
+    '''
+
+    if url.startswith('file://'):
+        return LocalWorkspace(url[len('file://'):])
+    return Workspace(url, token=token)
+
 def make_job_directory(workDirectory, jobID):
     ''' Make working directory for a job.
 
@@ -184,3 +498,102 @@ def make_job_directory(workDirectory, jobID):
     if not os.path.exists(jobDirectory):
         os.makedirs(jobDirectory, 0775)
     return jobDirectory
+
+def make_job_queue_directory(workDirectory):
+    ''' Make the directories for the queue of jobs run by the worker pool.
+
+        A job is submitted by adding an entry file to the queue directory.  The worker
+        pool claims a job by moving its entry file to the running sub-directory.
+
+        @param workDirectory Path to base working directory
+        @returns Path to queue directory
+    '''
+
+    queueDirectory = os.path.join(workDirectory, 'queue')
+    runningDirectory = os.path.join(queueDirectory, 'running')
+    if not os.path.exists(runningDirectory):
+        os.makedirs(runningDirectory, 0775)
+    return queueDirectory
+
+def submit_queued_job(workDirectory, jobID):
+    ''' Submit a job to the queue of jobs run by the worker pool.
+
+        The entry file name starts with the submit time so jobs are run in the order
+        they were submitted.  The entry is written to a temporary file and renamed so
+        the worker pool never sees a partial entry.
+
+        @param workDirectory Path to base working directory
+        @param jobID Job identifier
+        @returns Path to entry file for the job
+    '''
+
+    queueDirectory = make_job_queue_directory(workDirectory)
+    entryName = '%017.6f-%s' %(time.time(), jobID)
+    tempPath = os.path.join(queueDirectory, '.'+entryName)
+    fid = open(tempPath, 'w')
+    fid.write('%s\n' %(jobID))
+    fid.close()
+    entryPath = os.path.join(queueDirectory, entryName)
+    os.rename(tempPath, entryPath)
+    return entryPath
+
+def claim_queued_jobs(workDirectory, maxJobs):
+    ''' Claim the oldest jobs in the queue of jobs run by the worker pool.
+
+        A job is claimed by moving its entry file to the running sub-directory.  Another
+        pool using the same queue may claim an entry first and the entry is skipped.
+
+        @param workDirectory Path to base working directory
+        @param maxJobs Maximum number of jobs to claim
+        @returns List of names of entry files for the claimed jobs
+    '''
+
+    queueDirectory = make_job_queue_directory(workDirectory)
+    runningDirectory = os.path.join(queueDirectory, 'running')
+    entryList = sorted([ name for name in os.listdir(queueDirectory) if not name.startswith('.') and name != 'running' ])
+    claimed = list()
+    for entryName in entryList:
+        if len(claimed) >= maxJobs:
+            break
+        try:
+            os.rename(os.path.join(queueDirectory, entryName), os.path.join(runningDirectory, entryName))
+        except OSError:
+            continue
+        claimed.append(entryName)
+    return claimed
+
+def finish_queued_job(workDirectory, entryName):
+    ''' Remove the entry file of a job claimed from the queue of jobs run by the worker pool.
+
+        @param workDirectory Path to base working directory
+        @param entryName Name of entry file for the job
+        @returns Nothing
+    '''
+
+    os.remove(os.path.join(make_job_queue_directory(workDirectory), 'running', entryName))
+    return
+
+def requeue_running_jobs(workDirectory):
+    ''' Submit the jobs that were running when the worker pool stopped to the queue again.
+
+        The entry files keep their names so the jobs run before jobs submitted later.
+
+        @param workDirectory Path to base working directory
+        @returns List of names of entry files for the jobs
+    '''
+
+    queueDirectory = make_job_queue_directory(workDirectory)
+    runningDirectory = os.path.join(queueDirectory, 'running')
+    entryList = sorted(os.listdir(runningDirectory))
+    for entryName in entryList:
+        os.rename(os.path.join(runningDirectory, entryName), os.path.join(queueDirectory, entryName))
+    return entryList
+
+def queued_job_id(entryName):
+    ''' Get the job ID from the name of an entry file in the queue of jobs run by the worker pool.
+
+        @param entryName Name of entry file
+        @returns Job ID
+    '''
+
+    return entryName.split('-', 1)[1]
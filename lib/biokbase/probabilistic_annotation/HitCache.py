@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+''' Cache of search results for query proteins shared by annotate jobs.
+
+    Many genomes have identical proteins (e.g. strains of the same species or genomes
+    that were uploaded again) so the parsed hits found by the search program for a
+    protein are saved in a SQLite database and used by later jobs instead of searching
+    for the protein again.  An entry is keyed by the MD5 checksum of the protein
+    sequence and a namespace built from the checksum of the contents of the static
+    database files and the search parameters, so entries from old static database files
+    or different search parameters are never used.  When the cache is larger than its size limit,
+    the least recently used entries are removed.
+'''
+
+import os
+import time
+import hashlib
+import sqlite3
+
+# Number of seconds to wait for another process that has the cache database locked.
+LockTimeout = 60
+
+# Fraction of the size limit the cache is reduced to when entries are removed.
+EvictFraction = 0.9
+
+def sequenceChecksum(sequence):
+    ''' Get the checksum of a protein sequence used as the key in the cache.
+
+        @param sequence Amino acid sequence string
+        @return MD5 checksum string
+    '''
+
+    return hashlib.md5(sequence).hexdigest()
+
+def searchNamespace(dbChecksum, searchParams):
+    ''' Build the namespace for entries created with a version of the static database and search parameters.
+
+        @param dbChecksum Checksum of the static database files
+        @param searchParams Dictionary of search parameters that change the search results
+        @return Namespace string
+    '''
+
+    params = [ '%s=%s' %(key, searchParams[key]) for key in sorted(searchParams.keys()) ]
+    return hashlib.md5('\n'.join([ dbChecksum ] + params)).hexdigest()
+
+def encodeHits(hits):
+    ''' Convert a list of hits to the string stored in the cache.
+
+        @param hits List of tuples with target ID and score
+        @return String with one hit per line
+    '''
+
+    return ''.join([ '%s\t%r\n' %(target, float(score)) for target, score in hits ])
+
+def decodeHits(hits):
+    ''' Convert the string stored in the cache to a list of hits.
+
+        @param hits String with one hit per line
+        @return List of tuples with target ID and score
+    '''
+
+    decoded = list()
+    for line in hits.splitlines():
+        target, score = line.split('\t')
+        decoded.append( (target, float(score)) )
+    return decoded
+
+class HitCache:
+
+    def __init__(self, path, maxSize, namespace):
+        ''' Open the cache database, creating it if needed.
+
+            @param path Path to cache database file
+            @param maxSize Maximum size of the cached hits in bytes
+            @param namespace Namespace of entries used by this object
+        '''
+
+        self.path = path
+        self.maxSize = maxSize
+        self.namespace = namespace
+        self.numHits = 0
+        self.numMisses = 0
+        self.numAdded = 0
+        self.numEvicted = 0
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, 0775)
+        self.db = sqlite3.connect(path, timeout=LockTimeout)
+        self.db.text_factory = str
+        self.db.execute('CREATE TABLE IF NOT EXISTS hits (namespace TEXT, checksum TEXT, hits TEXT, size INTEGER, used REAL, ' +
+                        'PRIMARY KEY (namespace, checksum))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS hits_used ON hits (used)')
+        self.db.commit()
+        return
+
+    def lookup(self, checksums):
+        ''' Get the cached hits for a list of proteins.
+
+            @param checksums List of protein sequence checksums
+            @return Dictionary keyed by checksum of list of tuples with target ID and score for
+                the proteins found in the cache
+        '''
+
+        found = dict()
+        for start in range(0, len(checksums), 500):
+            batch = checksums[start:start+500]
+            query = 'SELECT checksum, hits FROM hits WHERE namespace = ? AND checksum IN (%s)' %(','.join('?' * len(batch)))
+            for checksum, hits in self.db.execute(query, [ self.namespace ] + batch):
+                found[checksum] = decodeHits(hits)
+
+        # Mark the entries that were found as recently used.
+        now = time.time()
+        self.db.executemany('UPDATE hits SET used = ? WHERE namespace = ? AND checksum = ?',
+                            [ (now, self.namespace, checksum) for checksum in found ])
+        self.db.commit()
+        self.numHits += len(found)
+        self.numMisses += len(checksums) - len(found)
+        return found
+
+    def store(self, checksumToHits):
+        ''' Add the hits for a set of proteins to the cache and remove old entries when the cache is full.
+
+            @param checksumToHits Dictionary keyed by checksum of list of tuples with target ID and score
+                (an empty list means the protein has no hits)
+            @return Nothing
+        '''
+
+        now = time.time()
+        rows = list()
+        for checksum in checksumToHits:
+            hits = encodeHits(checksumToHits[checksum])
+            rows.append( (self.namespace, checksum, hits, len(hits) + len(checksum), now) )
+        self.db.executemany('INSERT OR REPLACE INTO hits (namespace, checksum, hits, size, used) VALUES (?, ?, ?, ?, ?)', rows)
+        self.db.commit()
+        self.numAdded += len(rows)
+        self.evict()
+        return
+
+    def evict(self):
+        ''' Remove the least recently used entries until the cache is smaller than the size limit.
+
+            @return Number of entries that were removed
+        '''
+
+        totalSize = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM hits').fetchone()[0]
+        if totalSize <= self.maxSize:
+            return 0
+
+        # Remove entries until the cache is a little smaller than the limit so that every
+        # job that adds entries does not need to remove entries.
+        excess = totalSize - int(self.maxSize * EvictFraction)
+        victims = list()
+        for namespace, checksum, size in self.db.execute('SELECT namespace, checksum, size FROM hits ORDER BY used'):
+            victims.append( (namespace, checksum) )
+            excess -= size
+            if excess <= 0:
+                break
+        self.db.executemany('DELETE FROM hits WHERE namespace = ? AND checksum = ?', victims)
+        self.db.commit()
+        self.numEvicted += len(victims)
+        return len(victims)
+
+    def statistics(self):
+        ''' Get the counters for the operations done with this object.
+
+            @return Dictionary with number of hits, misses, added entries, and evicted entries
+        '''
+
+        return { 'hits': self.numHits, 'misses': self.numMisses, 'added': self.numAdded, 'evicted': self.numEvicted }
+
+    def close(self):
+        ''' Close the cache database.
+
+            @return Nothing
+        '''
+
+        self.db.close()
+        return
@@ -5,14 +5,27 @@ import os
 import traceback
 import time
 import re
+import multiprocessing
 from biokbase.probabilistic_annotation.DataParser import DataParser, NotReadyError
-from biokbase.probabilistic_annotation.Helpers import timestamp, make_object_identity, make_job_directory, ProbAnnoType, RxnProbsType, ServiceVersion
-from biokbase.workspace.client import Workspace
+from biokbase.probabilistic_annotation.SearchBackend import SearchBackendError, searchBackendClass
+from biokbase.probabilistic_annotation.Helpers import timestamp, make_object_identity, make_job_directory, set_config_defaults, submit_queued_job, \
+    make_workspace_client, prefilter_kmer_size, expand_rolesets, calculate_process_count, \
+    probanno_rolesets, ProbAnnoType, ProbAnnoTypes, RxnProbsType, ServiceVersion, SaveBatchSize
 from biokbase.fbaModelServices.Client import *
 from biokbase.cdmi.client import CDMI_EntityAPI
 from biokbase.userandjobstate.client import UserAndJobState
 from biokbase.fbaModelServices.Client import fbaModelServices
 from biokbase import log
+from urllib2 import HTTPError
+
+# NumPy and SciPy are optional and only needed for the sparse matrix calculate engine.
+try:
+    from biokbase.probabilistic_annotation.LikelihoodMatrix import LikelihoodMatrix
+except ImportError:
+    LikelihoodMatrix = None
+
+# Types of protein complexes with zero likelihood because no roles are found in the organism.
+ZeroComplexTypes = frozenset([ 'CPLX_NOREPS', 'CPLX_NOTTHERE', 'CPLX_NOREPS_AND_NOTTHERE' ])
 
 # Exception thrown when static database file is missing from Shock.
 class MissingFileError(Exception):
@@ -25,6 +38,43 @@ class RoleNotFoundEror(Exception):
 # Exception thrown when object version is not valid
 class WrongVersionError(Exception):
     pass
+
+# Exception thrown when the ModelSEED IDs of reactions cannot be retrieved from the central data model
+class ReactionIdError(Exception):
+    pass
+
+# Number of times to try getting the ModelSEED IDs of reactions from the central data model.
+CdmiAttempts = 4
+
+# State used by the processes in the pool that calculates reaction probabilities for
+# calculate_batch().  It is set in each process when the process starts.
+CalculateBatchState = None
+
+def initCalculateBatchProcess(state):
+    ''' Initialize a process in the pool used by calculate_batch().
+
+        The processes are forked so the state and the static data cache are shared with
+        the server process without copying.
+
+        @param state Tuple with Impl object, context object, list of input dictionaries, list of
+            ProbAnno objects, complex to roles mapping, reaction to complexes mapping, and LikelihoodMatrix object
+        @return Nothing
+    '''
+
+    global CalculateBatchState
+    CalculateBatchState = state
+    return
+
+def calculateBatchGenome(index):
+    ''' Calculate the reaction probabilities for one ProbAnno object in a process in the pool used by calculate_batch().
+
+        @param index Index of ProbAnno object in the batch
+        @return List of lists with reaction ID, likelihood, reaction type, complex info, and
+            gene-protein-reaction relationship
+    '''
+
+    impl, ctx, inputs, probannoObjects, complexesToRoles, reactionsToComplexes, matrix = CalculateBatchState
+    return impl._genomeReactionProbabilities(ctx, inputs[index], probannoObjects[index], complexesToRoles, reactionsToComplexes, matrix)
 #END_HEADER
 
 
@@ -86,7 +136,73 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
 
         return input
 
-    def _rolesetProbabilitiesToRoleProbabilities(self, ctx, input, genome, queryToTuplist, workFolder):
+    def _validRelativeScore(self, value):
+        ''' Check if a value is a valid minimum relative score.
+
+            @param value Value to check
+            @return True when value is a number from 0 to 1
+        '''
+
+        try:
+            return 0.0 <= float(value) <= 1.0
+        except ValueError:
+            return False
+
+    def _checkHitCutoffs(self, ctx, input):
+        ''' Check the per-query hit cutoff input arguments.
+
+            @param ctx Current context object
+            @param input Dictionary with input parameters for function
+            @return Nothing
+            @raise ValueError when max_targets_per_query or min_relative_score input argument is not valid
+        '''
+
+        if input['max_targets_per_query'] is not None and int(input['max_targets_per_query']) < 0:
+            message = "Input argument max_targets_per_query must be at least 0"
+            ctx.log_err(message)
+            raise ValueError(message)
+        if input['min_relative_score'] is not None and not self._validRelativeScore(input['min_relative_score']):
+            message = "Input argument min_relative_score must be between 0 and 1"
+            ctx.log_err(message)
+            raise ValueError(message)
+        return
+
+    def _submitJob(self, ctx, jobid, method, input):
+        ''' Save the data for a job and start a worker to run the job.
+
+            @param ctx Current context object
+            @param jobid Job ID from user and job state service
+            @param method Name of method that created the job
+            @param input Dictionary with input parameters for method
+            @return Nothing
+        '''
+
+        # Create working directory for job and build file names.
+        jobDirectory = make_job_directory(self.config['work_folder_path'], jobid)
+        jobDataFilename = os.path.join(jobDirectory, 'jobdata.json')
+        outputFilename = os.path.join(jobDirectory, 'stdout.log')
+        errorFilename = os.path.join(jobDirectory, 'stderr.log')
+
+        # Save data required for running the job.
+        jobData = { 'id': jobid, 'method': method, 'input': input, 'context': ctx, 'config': self.config }
+        json.dump(jobData, open(jobDataFilename, "w"), indent=4)
+
+        # Run the job on the local machine.
+        if self.config["job_queue"] == "local":
+            # Start worker to run the job.
+            jobScript = os.path.join(os.environ['KB_TOP'], 'bin/pa-runjob')
+            cmdline = "nohup %s %s >%s 2>%s &" %(jobScript, jobDirectory, outputFilename, errorFilename)
+            status = os.system(cmdline)
+            ctx.log_info('Job %s is running on local host, status %d' %(jobid, status))
+
+        # Submit the job to the worker pool on the local machine.
+        elif self.config['job_queue'] == 'pool':
+            entryPath = submit_queued_job(self.config['work_folder_path'], jobid)
+            ctx.log_info('Job %s is queued for worker pool in %s' %(jobid, entryPath))
+
+        return
+
+    def _rolesetProbabilitiesToRoleProbabilities(self, ctx, input, genome, roles, rolesets, featureProbs, workFolder):
         ''' Compute probability of each role from the rolesets for each query protein.
 
             At the moment the strategy is to take any set of rolestrings containing
@@ -102,7 +218,9 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
             @param ctx: Current context object
             @param input: Dictionary of input parameters to calculate() function
             @param genome: Genome ID string
-            @param queryToTuplist: Dictionary keyed by query gene of list of tuples with roleset and likelihood
+            @param roles: List of roles
+            @param rolesets: List of lists of role indices for each roleset
+            @param featureProbs: Dictionary keyed by query gene of list of tuples with roleset index and likelihood
             @param workFolder: Path to directory in which to store temporary files
             @return List of tuples with query gene, role, and likelihood
         '''
@@ -113,23 +231,22 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
         roleProbs = list()
 
         # Iterate over all of the query genes in the dictionary.
-        # querygene -> [ (roleset1, likelihood_1), (roleset2, likelihood_2), ...]
-        for query in queryToTuplist:
+        # querygene -> [ (rolesetindex1, likelihood_1), (rolesetindex2, likelihood_2), ...]
+        for query in featureProbs:
             # This section actually does the conversion of likelihoods.
             # See equation 3 in the paper ("Calculating reaction likelihoods" section).
             queryRolesToProbs = dict()
-            for tup in queryToTuplist[query]:
-                rolelist = tup[0].split(self.config["separator"])
+            for tup in featureProbs[query]:
                 # Add up all the instances of each particular role on the list.
-                for role in rolelist:
-                    if role in queryRolesToProbs:
-                        queryRolesToProbs[role] += tup[1]
+                for roleIndex in rolesets[tup[0]]:
+                    if roleIndex in queryRolesToProbs:
+                        queryRolesToProbs[roleIndex] += tup[1]
                     else:
-                        queryRolesToProbs[role] = tup[1]
+                        queryRolesToProbs[roleIndex] = tup[1]
     
             # Add them to the array.
-            for role in queryRolesToProbs:
-                roleProbs.append( (query, role, queryRolesToProbs[role]) )
+            for roleIndex in queryRolesToProbs:
+                roleProbs.append( (query, roles[roleIndex], queryRolesToProbs[roleIndex]) )
     
         # Save the generated data when debug is turned on.
         if ctx.get_log_level() >= log.DEBUG2:
@@ -198,7 +315,8 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
         # Build the array of total role probabilities.     
         totalRoleProbs = list()
         for role in roleToTotalProb:
-            gpr = " or ".join(list(set(roleToGeneList[role])))
+            # The genes are sorted so the relationship is the same in every run.
+            gpr = " or ".join(sorted(set(roleToGeneList[role])))
             # We only need to group these if there is more than one of them (avoids extra parenthesis when computing complexes)
             if len(list(set(roleToGeneList[role]))) > 1:
                 gpr = "(" + gpr + ")"
@@ -256,16 +374,8 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
     
         ctx.log_debug('Started computing complex probabilities for '+genome)
     
-        # Get the mapping from complexes to roles if it isn't already provided.
-        if complexesToRequiredRoles is None:
-            complexesToRequiredRoles = self.dataParser.readComplexRoles()
-        
         # Get the subsystem roles (used to distinguish between NOTTHERE and NOREPS).
-        otu_fidsToRoles, otu_rolesToFids = self.dataParser.readFilteredOtuRoles()
-        allroles = set()
-        for fid in otu_fidsToRoles:
-            for role in otu_fidsToRoles[fid]:
-                allroles.add(role)
+        allroles = self.dataParser.getSubsystemRoles()
     
         # Build two dictionaries, both keyed by role, one mapping the role to its
         # likelihood and one mapping to the gene list.
@@ -275,61 +385,29 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
             rolesToProbabilities[tuple[0]] = float(tuple[1]) # can skip the float()?
             rolesToGeneList[tuple[0]] = tuple[2]
     
-        # Iterate over complexes and compute complex probabilities from role probabilities.
-        # Separate out cases where no genes seem to exist in the organism for the reaction
-        # from cases where there is a database deficiency.
-        # See equation 5 in the paper ("Calculating reaction likelihoods" section).
-        SEPARATOR = self.config["separator"]
-        complexProbs = list()
-        for cplx in complexesToRequiredRoles:
-            allCplxRoles = complexesToRequiredRoles[cplx]
-            availRoles = list() # Roles that may have representatives in the query organism
-            unavailRoles = list() # Roles that have representatives but that are not apparently in the query organism
-            noexistRoles = list() # Roles with no representatives in the subsystems
-            for role in complexesToRequiredRoles[cplx]:
-                if role not in allroles:
-                    noexistRoles.append(role)
-                elif role not in rolesToProbabilities:
-                    unavailRoles.append(role)
-                else:
-                    availRoles.append(role)
-            TYPE = ""
-            GPR = ""
-            if len(noexistRoles) == len(allCplxRoles):
-                TYPE = "CPLX_NOREPS"
-                complexProbs.append( (cplx, 0.0, TYPE, self.config["separator"].join(unavailRoles), self.config["separator"].join(noexistRoles), GPR) )
-                continue
-            if len(unavailRoles) == len(allCplxRoles):
-                TYPE = "CPLX_NOTTHERE"
-                complexProbs.append( (cplx, 0.0, TYPE, self.config["separator"].join(unavailRoles), self.config["separator"].join(noexistRoles), GPR) )
-                continue
-            # Some had no representatives and the rest were not found in the cell
-            if len(unavailRoles) + len(noexistRoles) == len(allCplxRoles):
-                TYPE = "CPLX_NOREPS_AND_NOTTHERE"
-                complexProbs.append( (cplx, 0.0, TYPE, self.config["separator"].join(unavailRoles), self.config["separator"].join(noexistRoles), GPR) )
-                continue
-            # Otherwise at least one of them is available
-            if len(availRoles) == len(allCplxRoles):
-                TYPE = "CPLX_FULL"
-            elif len(availRoles) < len(allCplxRoles):
-                TYPE = "CPLX_PARTIAL_%d_of_%d" %(len(availRoles), len(allCplxRoles))
-
-            # Link individual functions in complex with an AND relationship to form a
-            # Boolean Gene-Protein relationship.
-#            partialGprList = [ "(" + s + ")" for s in [ rolesToGeneList[f] for f in availRoles ] ]
-            partialGprList = [ rolesToGeneList[f] for f in availRoles ]
-            GPR = " and ".join( list(set(partialGprList)) )
-
-            if GPR != "" and len(list(set(partialGprList))) > 1:
-                GPR = "(" + GPR + ")"
-
-            # Find the minimum probability of the different available roles (ignoring ones
-            # that are apparently missing) and call that the complex likelihood.
-            minp = 1000
-            for role in availRoles:
-                if rolesToProbabilities[role] < minp:
-                    minp = rolesToProbabilities[role]
-            complexProbs.append( (cplx, minp, TYPE, self.config["separator"].join(unavailRoles), self.config["separator"].join(noexistRoles), GPR) )
+        # When the mapping from complexes to roles isn't provided, start from the cached
+        # likelihoods of the complexes when no roles are found in the organism and only
+        # compute the complexes with a role found in the organism.  Otherwise compute every
+        # complex in the provided mapping.
+        if complexesToRequiredRoles is None:
+            complexesToRequiredRoles = self.dataParser.getComplexRoles()
+            zeroComplexProbs, complexToIndex = self._zeroComplexProbabilities()
+            complexProbs = list(zeroComplexProbs)
+            rolesToComplexes = self.dataParser.getRoleComplexes()
+            complexList = set()
+            for role in rolesToProbabilities:
+                if role in allroles and role in rolesToComplexes:
+                    complexList.update(rolesToComplexes[role])
+        else:
+            complexProbs = list()
+            complexToIndex = dict()
+            for cplx in complexesToRequiredRoles:
+                complexToIndex[cplx] = len(complexProbs)
+                complexProbs.append(None)
+            complexList = complexesToRequiredRoles.keys()
+
+        for cplx in complexList:
+            complexProbs[complexToIndex[cplx]] = self._complexProbability(cplx, complexesToRequiredRoles[cplx], allroles, rolesToProbabilities, rolesToGeneList)
 
         # Save the generated data when debug is turned on.
         if ctx.get_log_level() >= log.DEBUG2:
@@ -342,6 +420,91 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
         ctx.log_debug('Finished computing complex probabilities for '+genome)
         return complexProbs
     
+    def _complexProbability(self, cplx, allCplxRoles, allroles, rolesToProbabilities, rolesToGeneList):
+        ''' Compute the likelihood of a protein complex from the likelihood of each role.
+
+            See _complexProbabilities() for a description of the types of complexes.
+
+            @param cplx: Complex ID string
+            @param allCplxRoles: List of roles involved in forming the complex
+            @param allroles: Set of roles with representatives in the subsystems
+            @param rolesToProbabilities: Dictionary keyed by role of likelihood of role
+            @param rolesToGeneList: Dictionary keyed by role of genes that perform the role
+            @return Tuple with complex ID, likelihood, type, list of roles not in organism,
+                list of roles not in subsystems, and boolean Gene-Protein relationship
+        '''
+
+        # Separate out cases where no genes seem to exist in the organism for the reaction
+        # from cases where there is a database deficiency.
+        # See equation 5 in the paper ("Calculating reaction likelihoods" section).
+        availRoles = list() # Roles that may have representatives in the query organism
+        unavailRoles = list() # Roles that have representatives but that are not apparently in the query organism
+        noexistRoles = list() # Roles with no representatives in the subsystems
+        for role in allCplxRoles:
+            if role not in allroles:
+                noexistRoles.append(role)
+            elif role not in rolesToProbabilities:
+                unavailRoles.append(role)
+            else:
+                availRoles.append(role)
+        TYPE = ""
+        GPR = ""
+        if len(noexistRoles) == len(allCplxRoles):
+            TYPE = "CPLX_NOREPS"
+            return (cplx, 0.0, TYPE, self.config["separator"].join(unavailRoles), self.config["separator"].join(noexistRoles), GPR)
+        if len(unavailRoles) == len(allCplxRoles):
+            TYPE = "CPLX_NOTTHERE"
+            return (cplx, 0.0, TYPE, self.config["separator"].join(unavailRoles), self.config["separator"].join(noexistRoles), GPR)
+        # Some had no representatives and the rest were not found in the cell
+        if len(unavailRoles) + len(noexistRoles) == len(allCplxRoles):
+            TYPE = "CPLX_NOREPS_AND_NOTTHERE"
+            return (cplx, 0.0, TYPE, self.config["separator"].join(unavailRoles), self.config["separator"].join(noexistRoles), GPR)
+        # Otherwise at least one of them is available
+        if len(availRoles) == len(allCplxRoles):
+            TYPE = "CPLX_FULL"
+        elif len(availRoles) < len(allCplxRoles):
+            TYPE = "CPLX_PARTIAL_%d_of_%d" %(len(availRoles), len(allCplxRoles))
+
+        # Link individual functions in complex with an AND relationship to form a
+        # Boolean Gene-Protein relationship.
+#        partialGprList = [ "(" + s + ")" for s in [ rolesToGeneList[f] for f in availRoles ] ]
+        partialGprList = [ rolesToGeneList[f] for f in availRoles ]
+        GPR = " and ".join( sorted(set(partialGprList)) )
+
+        if GPR != "" and len(list(set(partialGprList))) > 1:
+            GPR = "(" + GPR + ")"
+
+        # Find the minimum probability of the different available roles (ignoring ones
+        # that are apparently missing) and call that the complex likelihood.
+        minp = 1000
+        for role in availRoles:
+            if rolesToProbabilities[role] < minp:
+                minp = rolesToProbabilities[role]
+        return (cplx, minp, TYPE, self.config["separator"].join(unavailRoles), self.config["separator"].join(noexistRoles), GPR)
+
+    def _zeroComplexProbabilities(self):
+        ''' Get the likelihood of each protein complex when no roles are found in the organism.
+
+            The likelihoods are computed once from the static database files and kept in
+            the static data cache.
+
+            @return List of tuples with complex ID, likelihood, type, list of roles not in
+                organism, list of roles not in subsystems, and boolean Gene-Protein
+                relationship, dictionary keyed by complex ID of index in list
+        '''
+
+        def build():
+            complexesToRequiredRoles = self.dataParser.getComplexRoles()
+            allroles = self.dataParser.getSubsystemRoles()
+            zeroComplexProbs = list()
+            complexToIndex = dict()
+            for cplx in complexesToRequiredRoles:
+                complexToIndex[cplx] = len(zeroComplexProbs)
+                zeroComplexProbs.append(self._complexProbability(cplx, complexesToRequiredRoles[cplx], allroles, dict(), dict()))
+            return zeroComplexProbs, complexToIndex
+
+        return self.dataParser.getDerivedData('zero_complex_probabilities', build)
+
     def _reactionProbabilities(self, ctx, input, genome, complexProbs, workFolder, rxnsToComplexes = None):
         ''' Estimate the likelihood of reactions from the likelihood of complexes.
 
@@ -378,48 +541,31 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
         for tuple in complexProbs:
             cplxToTuple[tuple[0]] = ( tuple[1], tuple[2], tuple[5] )
         
-        # Get the mapping from reactions to complexes if it isn't already provided.
+        # When the mapping from reactions to complexes isn't provided, start from the cached
+        # likelihoods of the reactions when no roles are found in the organism and only
+        # compute the reactions catalyzed by a complex with a role found in the organism.
+        # Otherwise compute every reaction in the provided mapping.
+        dilution = float(self.config["dilution_percent"])
         if rxnsToComplexes is None:
-            rxnsToComplexes = self.dataParser.readReactionComplex()
-
-        # Take the MAXIMUM likelihood of complexes catalyzing a particular reaction
-        # and call that the reaction likelihood.
-        # See equation 6 in the paper ("Calculating reaction likelihoods" section).
-        reactionProbs = list()
-        for rxn in rxnsToComplexes:
-            TYPE = "NOCOMPLEXES"
-            rxnComplexes = rxnsToComplexes[rxn]
-            maxProb = 0
-            GPR = ""
-            complexList = list()
-            for cplx in rxnComplexes:
-                if cplx in cplxToTuple:
-                    # Complex1 (P1; TYPE1) ///Complex2 (P2; TYPE2) ...
-                    complexList.append( [ cplx, cplxToTuple[cplx][0], cplxToTuple[cplx][1] ])
-                    TYPE = 'HASCOMPLEXES'
-            complexString = ''
-            if len(complexList) > 0:
-                complexList.sort(key=lambda tup: tup[1], reverse=True)
-                maxProb = complexList[0][1]
-                for complex in complexList:
-                    complexString += '%s (%1.4f; %s)%s' %(complex[0], complex[1], complex[2], self.config['separator'])
-                complexString = complexString[:-len(self.config['separator'])] # Remove the final separator
-
-            # Iterate separately to get a GPR. We want to apply a cutoff here too to avoid
-            # a complex with 80% probability being linked by OR to another with a 5%
-            # probability.  For now I've implemented using the same cutoff as we used for
-            # which genes go with a role.
-            cplxGprs = []
-            for cplx in rxnComplexes:
-                if cplx in cplxToTuple:
-                    if cplxToTuple[cplx][0] < maxProb * float(self.config["dilution_percent"])/100.0:
-                        continue
-                    cplxGprs.append(cplxToTuple[cplx][2])
-            if len(cplxGprs) > 0:
-                GPR = " or ".join( list(set(cplxGprs)) )
-
-            # Use a list so that we can modify the reaction IDs if needed to translate to ModelSEED IDs
-            reactionProbs.append( [rxn, maxProb, TYPE, complexString, GPR] )
+            rxnsToComplexes = self.dataParser.getReactionComplexes()
+            zeroReactionProbs, reactionToIndex = self._zeroReactionProbabilities()
+            # Use lists so that we can modify the reaction IDs if needed to translate to ModelSEED IDs
+            reactionProbs = map(list, zeroReactionProbs)
+            complexesToRxns = self.dataParser.getComplexReactions()
+            rxnList = set()
+            for tuple in complexProbs:
+                if tuple[2] not in ZeroComplexTypes and tuple[0] in complexesToRxns:
+                    rxnList.update(complexesToRxns[tuple[0]])
+        else:
+            reactionProbs = list()
+            reactionToIndex = dict()
+            for rxn in rxnsToComplexes:
+                reactionToIndex[rxn] = len(reactionProbs)
+                reactionProbs.append(None)
+            rxnList = rxnsToComplexes.keys()
+
+        for rxn in rxnList:
+            reactionProbs[reactionToIndex[rxn]] = self._reactionProbability(rxn, rxnsToComplexes[rxn], cplxToTuple, dilution)
     
         # Save the generated data when debug is turned on.
         if ctx.get_log_level() >= log.DEBUG2:
@@ -432,6 +578,349 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
         ctx.log_debug('Finished computing reaction probabilities for '+genome)
         return reactionProbs
     
+    def _reactionProbability(self, rxn, rxnComplexes, cplxToTuple, dilution):
+        ''' Estimate the likelihood of a reaction from the likelihood of its complexes.
+
+            @param rxn: Reaction ID string
+            @param rxnComplexes: List of complexes catalyzing the reaction
+            @param cplxToTuple: Dictionary keyed by complex ID of tuple with likelihood, type, and GPR
+            @param dilution: Percent of maximum likelihood of a complex needed to be included in GPR
+            @return List with reaction ID, likelihood, reaction type, complex info, and
+                gene-protein-reaction relationship
+        '''
+
+        # Take the MAXIMUM likelihood of complexes catalyzing a particular reaction
+        # and call that the reaction likelihood.
+        # See equation 6 in the paper ("Calculating reaction likelihoods" section).
+        TYPE = "NOCOMPLEXES"
+        maxProb = 0
+        GPR = ""
+        complexList = list()
+        for cplx in rxnComplexes:
+            if cplx in cplxToTuple:
+                # Complex1 (P1; TYPE1) ///Complex2 (P2; TYPE2) ...
+                complexList.append( [ cplx, cplxToTuple[cplx][0], cplxToTuple[cplx][1] ])
+                TYPE = 'HASCOMPLEXES'
+        complexString = ''
+        if len(complexList) > 0:
+            complexList.sort(key=lambda tup: tup[1], reverse=True)
+            maxProb = complexList[0][1]
+            for complex in complexList:
+                complexString += '%s (%1.4f; %s)%s' %(complex[0], complex[1], complex[2], self.config['separator'])
+            complexString = complexString[:-len(self.config['separator'])] # Remove the final separator
+
+        # Iterate separately to get a GPR. We want to apply a cutoff here too to avoid
+        # a complex with 80% probability being linked by OR to another with a 5%
+        # probability.  For now I've implemented using the same cutoff as we used for
+        # which genes go with a role.
+        cplxGprs = []
+        for cplx in rxnComplexes:
+            if cplx in cplxToTuple:
+                if cplxToTuple[cplx][0] < maxProb * dilution/100.0:
+                    continue
+                cplxGprs.append(cplxToTuple[cplx][2])
+        if len(cplxGprs) > 0:
+            GPR = " or ".join( sorted(set(cplxGprs)) )
+
+        # Use a list so that we can modify the reaction IDs if needed to translate to ModelSEED IDs
+        return [rxn, maxProb, TYPE, complexString, GPR]
+
+    def _zeroReactionProbabilities(self):
+        ''' Get the likelihood of each reaction when no roles are found in the organism.
+
+            The likelihoods are computed once from the static database files and kept in
+            the static data cache.  The likelihood of a reaction does not depend on the
+            dilution percent when all of its complexes have zero likelihood.
+
+            @return List of tuples with reaction ID, likelihood, reaction type, complex info,
+                and gene-protein-reaction relationship, dictionary keyed by reaction ID of
+                index in list
+        '''
+
+        def build():
+            cplxToTuple = dict()
+            for cplxTuple in self._zeroComplexProbabilities()[0]:
+                cplxToTuple[cplxTuple[0]] = ( cplxTuple[1], cplxTuple[2], cplxTuple[5] )
+            rxnsToComplexes = self.dataParser.getReactionComplexes()
+            zeroReactionProbs = list()
+            reactionToIndex = dict()
+            for rxn in rxnsToComplexes:
+                reactionToIndex[rxn] = len(zeroReactionProbs)
+                zeroReactionProbs.append(tuple(self._reactionProbability(rxn, rxnsToComplexes[rxn], cplxToTuple, 100.0)))
+            return zeroReactionProbs, reactionToIndex
+
+        return self.dataParser.getDerivedData('zero_reaction_probabilities', build)
+
+    def _matrixReactionProbabilities(self, ctx, input, genome, roles, rolesets, featureProbs, workFolder, complexesToRequiredRoles = None, rxnsToComplexes = None, matrix = None):
+        ''' Compute the likelihood of each reaction with the sparse matrix engine.
+
+            The results are identical to the results of _rolesetProbabilitiesToRoleProbabilities(),
+            _totalRoleProbabilities(), _complexProbabilities(), and _reactionProbabilities().
+            The LikelihoodMatrix object for the mappings from the static database files is
+            built once and kept in the static data cache.
+
+            @param ctx: Current context object
+            @param input: Dictionary of input parameters to calculate() function
+            @param genome: Genome ID string
+            @param roles: List of roles
+            @param rolesets: List of lists of role indices for each roleset
+            @param featureProbs: Dictionary keyed by query gene of list of tuples with roleset index and likelihood
+            @param workFolder: Path to directory in which to store temporary files
+            @param complexesToRequiredRoles: Dictionary keyed by complex ID to the roles
+                involved in forming that complex or None to use the static database files
+            @param rxnsToComplexes: Dictionary keyed by reaction ID to a list of catalyzing
+                complexes or None to use the static database files
+            @param matrix: LikelihoodMatrix object built from the mappings or None to get it with _likelihoodMatrix()
+            @return List of tuples with complex ID, likelihood, type, list of roles not in
+                organism, list of roles not in subsystems, and boolean Gene-Protein
+                relationship, list of lists with reaction ID, likelihood, reaction type,
+                complex info, and gene-protein-reaction relationship
+        '''
+
+        ctx.log_debug('Started computing reaction probabilities with sparse matrices for '+genome)
+
+        if matrix is None:
+            matrix = self._likelihoodMatrix(complexesToRequiredRoles, rxnsToComplexes)
+        totalRoleProbs, complexProbs, reactionProbs = matrix.reactionProbabilities(roles, rolesets, featureProbs, self.config['dilution_percent'])
+
+        # Save the generated data when debug is turned on.
+        if ctx.get_log_level() >= log.DEBUG2:
+            fid = open(os.path.join(workFolder, "%s.cellroleprob" %(genome)), "w")
+            for tuple in totalRoleProbs:
+                fid.write("%s\t%s\t%s\n" %(tuple[0], tuple[1], tuple[2]))
+            fid.close()
+            fid = open(os.path.join(workFolder, "%s.complexprob" %(genome)), "w")
+            for tuple in complexProbs:
+                fid.write("%s\t%1.4f\t%s\t%s\t%s\t%s\n" %(tuple[0], tuple[1], tuple[2], tuple[3], tuple[4], tuple[5]))
+            fid.close()
+            fid = open(os.path.join(workFolder, "%s.rxnprobs" %(genome)), "w")
+            for tuple in reactionProbs:
+                fid.write("%s\t%1.4f\t%s\t%s\t%s\n" %(tuple[0], tuple[1], tuple[2], tuple[3], tuple[4]))
+            fid.close()
+
+        ctx.log_debug('Finished computing reaction probabilities with sparse matrices for '+genome)
+        return complexProbs, reactionProbs
+
+    def _likelihoodMatrix(self, complexesToRequiredRoles = None, rxnsToComplexes = None):
+        ''' Get the LikelihoodMatrix object for the sparse matrix engine.
+
+            The object for the mappings from the static database files is built once and
+            kept in the static data cache.
+
+            @param complexesToRequiredRoles: Dictionary keyed by complex ID to the roles
+                involved in forming that complex or None to use the static database files
+            @param rxnsToComplexes: Dictionary keyed by reaction ID to a list of catalyzing
+                complexes or None to use the static database files
+            @return LikelihoodMatrix object
+        '''
+
+        if complexesToRequiredRoles is None and rxnsToComplexes is None:
+            return self.dataParser.getDerivedData('likelihood_matrix',
+                lambda: LikelihoodMatrix(self.dataParser.getComplexRoles(), self.dataParser.getReactionComplexes(),
+                                         self.dataParser.getSubsystemRoles(), self.config['separator']))
+        if complexesToRequiredRoles is None:
+            complexesToRequiredRoles = self.dataParser.getComplexRoles()
+        if rxnsToComplexes is None:
+            rxnsToComplexes = self.dataParser.getReactionComplexes()
+        return LikelihoodMatrix(complexesToRequiredRoles, rxnsToComplexes, self.dataParser.getSubsystemRoles(), self.config['separator'])
+
+    def _templateMappings(self, ctx, input):
+        ''' Get the complex to roles and reaction to complexes mappings for a template model.
+
+            @param ctx: Current context object
+            @param input: Dictionary of input parameters to calculate() or calculate_batch() function
+            @return Dictionary keyed by complex ID to the roles involved in forming that complex and
+                dictionary keyed by reaction ID to a list of catalyzing complexes or None and None
+                when no template model is specified
+            @raise ValueError when template_workspace input argument is not specified
+        '''
+
+        # When a template model is specified, use it to build dictionaries for roles,
+        # complexes, and reactions instead of retrieving from static database files.
+        if input["template_model"] is None and input["template_workspace"] is None:
+            return None, None
+        if not(input["template_model"] is not None and input["template_workspace"] is not None) :
+            message = "Template model workspace is required if template model ID is provided"
+            ctx.log_err(message)
+            raise ValueError(message)
+
+        # Create a dictionary to map a complex to a list of roles and a dictionary
+        # to map a reaction to a list of complexes.  The dictionaries are specific to
+        # the specified template model instead of covering everything in the central
+        # data model.
+        complexesToRoles = dict()
+        reactionsToComplexes = dict()
+
+        # Get the list of RoleComplexReactions for the template model from the
+        # fba modeling service.  The RoleComplexReactions structure has a list
+        # of ComplexReactions structures for the given role.  And each ComplexReactions
+        # structure has a list of reactions for the given complex.
+        fbaClient = fbaModelServices(self.config['fbamodeling_url'], token=ctx['token'])
+        roleComplexReactionsList = fbaClient.role_to_reactions( { 'templateModel': input['template_model'], 'workspace': input['template_workspace'] } )
+
+        # Build the two dictionaries from the returned list.
+        for rcr in roleComplexReactionsList:
+            for complex in rcr['complexes']:
+                complexId = re.sub(r'cpx0*(\d+)', r'kb|cpx.\1', complex['name']) # Convert ModelSEED format to KBase format
+                if complexId in complexesToRoles:
+                    complexesToRoles[complexId].append(rcr['name'])
+                else:
+                    complexesToRoles[complexId] = [ rcr['name'] ]
+                for reaction in complex['reactions']:
+                    reactionId = reaction['reaction']
+                    if reactionId in reactionsToComplexes:
+                        reactionsToComplexes[reactionId].append(complexId)
+                    else:
+                        reactionsToComplexes[reactionId] = [ complexId ]
+        return complexesToRoles, reactionsToComplexes
+
+    def _checkProbannoObject(self, ctx, probannoObject):
+        ''' Check that the type of a ProbAnno object can be read.
+
+            @param ctx: Current context object
+            @param probannoObject: ProbAnno object returned by get_objects()
+            @return Nothing
+            @raise WrongVersionError when ProbAnno object version number is invalid
+        '''
+
+        if probannoObject['info'][2] not in ProbAnnoTypes:
+            message = "ProbAnno object type %s is not one of %s for object %s" %(probannoObject['info'][2], ', '.join(ProbAnnoTypes), probannoObject['info'][1])
+            ctx.log_err(message)
+            raise WrongVersionError(message)
+        return
+
+    def _genomeReactionProbabilities(self, ctx, input, probannoObject, complexesToRoles, reactionsToComplexes, matrix = None):
+        ''' Calculate the reaction probabilities for a ProbAnno object.
+
+            @param ctx: Current context object
+            @param input: Dictionary of input parameters to calculate() function
+            @param probannoObject: ProbAnno object returned by get_objects()
+            @param complexesToRoles: Dictionary keyed by complex ID to the roles involved in
+                forming that complex or None to use the static database files
+            @param reactionsToComplexes: Dictionary keyed by reaction ID to a list of catalyzing
+                complexes or None to use the static database files
+            @param matrix: LikelihoodMatrix object built from the mappings for the sparse matrix
+                engine or None to get it with _likelihoodMatrix()
+            @return List of lists with reaction ID, likelihood, reaction type, complex info, and
+                gene-protein-reaction relationship
+        '''
+
+        genome = probannoObject["data"]["genome"]
+
+        # Create a temporary directory for storing intermediate files when debug is turned on.
+        if ctx.get_log_level() >= log.DEBUG2:
+            workFolder = tempfile.mkdtemp("", "calculate-%s-" %(genome), self.config["work_folder_path"])
+            ctx.log_debug('Intermediate files saved in '+workFolder)
+        else:
+            workFolder = None
+
+        roles, rolesets, featureProbs = probanno_rolesets(probannoObject, self.config["separator"])
+        if self.config['calculate_engine'] == 'numpy':
+            # Calculate complex and reaction probabilities with sparse matrices.
+            complexProbs, reactionProbs = self._matrixReactionProbabilities(ctx, input, genome, roles, rolesets, featureProbs, workFolder,
+                                                                            complexesToRequiredRoles = complexesToRoles, rxnsToComplexes = reactionsToComplexes, matrix = matrix)
+        else:
+            # Calculate per-gene role probabilities.
+            roleProbs = self._rolesetProbabilitiesToRoleProbabilities(ctx, input, genome, roles, rolesets, featureProbs, workFolder)
+
+            # Calculate whole cell role probabilities.
+            # Note - eventually workFolder will be replaced with a rolesToReactions call
+            totalRoleProbs = self._totalRoleProbabilities(ctx, input, genome, roleProbs, workFolder)
+
+            # Calculate complex probabilities.
+            complexProbs = self._complexProbabilities(ctx, input, genome, totalRoleProbs, workFolder, complexesToRequiredRoles = complexesToRoles)
+
+            # Calculate reaction probabilities.
+            reactionProbs = self._reactionProbabilities(ctx, input, genome, complexProbs, workFolder, rxnsToComplexes = reactionsToComplexes)
+        return reactionProbs
+
+    def _modelSeedReactionIds(self, ctx, reactionList):
+        ''' Get the ModelSEED IDs of reactions.
+
+            The IDs are looked up in the reaction ModelSEED ID file from the static database
+            files.  The file is built from all of the reactions in the central data model so
+            it is only queried when the file is not available.  A reaction without a ModelSEED
+            ID keeps its KBase ID.
+
+            @param ctx: Current context object
+            @param reactionList: List of reaction IDs in KBase format
+            @return Dictionary keyed by KBase reaction ID of ModelSEED reaction ID
+            @raise ReactionIdError when the central data model cannot be queried
+        '''
+
+        rxnToModelSeedId = self.dataParser.getReactionModelSeedIds()
+        if rxnToModelSeedId is None:
+            ctx.log_debug('Getting ModelSEED IDs of %d reactions from central data model' %(len(reactionList)))
+            rxnToModelSeedId = dict()
+            EntityAPI = CDMI_EntityAPI(self.config["cdmi_url"])
+            for attempt in range(CdmiAttempts):
+                try:
+                    reactionData = EntityAPI.get_entity_Reaction( reactionList, [ "source_id" ] )
+                    break
+                except HTTPError as e:
+                    if attempt == CdmiAttempts - 1:
+                        raise ReactionIdError('Failed to get ModelSEED IDs of reactions from central data model after %d attempts: %s' %(CdmiAttempts, e))
+                    ctx.log_info('Retrying query for ModelSEED IDs of reactions after error: %s' %(e))
+                    time.sleep(2 ** attempt)
+            for rxnId in reactionData:
+                rxnToModelSeedId[rxnId] = reactionData[rxnId]['source_id']
+
+        reactionIds = dict()
+        numUnmapped = 0
+        for rxnId in reactionList:
+            if rxnId in rxnToModelSeedId:
+                reactionIds[rxnId] = rxnToModelSeedId[rxnId]
+            else:
+                reactionIds[rxnId] = rxnId
+                numUnmapped += 1
+        if numUnmapped > 0:
+            ctx.log_info('%d reactions without a ModelSEED ID keep their KBase ID' %(numUnmapped))
+        return reactionIds
+
+    def _rxnprobsSaveData(self, input, probannoObject, reactionProbs, method):
+        ''' Build the save data for a RxnProbs object.
+
+            @param input: Dictionary of input parameters to calculate() function
+            @param probannoObject: ProbAnno object returned by get_objects()
+            @param reactionProbs: List of lists with reaction ID, likelihood, reaction type,
+                complex info, and gene-protein-reaction relationship
+            @param method: Name of method recorded in the provenance of the object
+            @return Dictionary with object save data for save_objects()
+        '''
+
+        # Create a reaction probability object
+        objectData = dict()
+        objectData["genome"] = probannoObject["data"]["genome"]
+        objectData['genome_workspace'] = probannoObject['data']['genome_workspace']
+        if input["template_model"] is None:
+            objectData['template_model'] = 'None'
+        else:
+            objectData["template_model"] = input["template_model"]
+        if input["template_workspace"] is None:
+            objectData['template_workspace'] = 'None'
+        else:
+            objectData["template_workspace"] = input["template_workspace"]
+        objectData["probanno"] = input['probanno']
+        objectData['probanno_workspace'] = input['probanno_workspace']
+        objectData["id"] = input["rxnprobs"]
+        objectData["reaction_probabilities"] = reactionProbs
+
+        objectMetaData = { "num_reaction_probs": len(objectData["reaction_probabilities"]) }
+        objectProvData = dict()
+        objectProvData['time'] = timestamp(0)
+        objectProvData['service'] = os.environ['KB_SERVICE_NAME']
+        objectProvData['service_ver'] = ServiceVersion
+        objectProvData['method'] = method
+        objectProvData['method_params'] = input.items()
+        objectProvData['input_ws_objects'] = [ '%s/%s/%d' %(probannoObject['info'][7], probannoObject['info'][1], probannoObject['info'][4]) ]
+        objectSaveData = dict();
+        objectSaveData['type'] = RxnProbsType
+        objectSaveData['name'] = input["rxnprobs"]
+        objectSaveData['data'] = objectData
+        objectSaveData['meta'] = objectMetaData
+        objectSaveData['provenance'] = [ objectProvData ]
+        return objectSaveData
+
     def _metaboliteWeights(input, model):
         '''Given a model object, computes an S-matrix.
      
@@ -550,7 +1039,7 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
             # There needs to be a config for the server to work.
             raise ValueError("__init__: A valid configuration was not provided.  Check KB_DEPLOYMENT_CONFIG and KB_SERVICE_NAME environment variables.")
         else:
-            self.config = config
+            self.config = set_config_defaults(config)
         
         submod = os.environ.get('KB_SERVICE_NAME', 'probabilistic_annotation')
         self.mylog = log.log(submod, ip_address=True, authuser=True, module=True, method=True,
@@ -569,22 +1058,128 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
         configValues += ', job_queue='+self.config['job_queue']
         configValues += ', search_program='+self.config['search_program']
         configValues += ', search_program_path='+self.config['search_program_path']
+        configValues += ', search_backend_modules='+self.config['search_backend_modules']
+        configValues += ', search_database_warmup='+self.config['search_database_warmup']
+        configValues += ', search_database_copy_path='+self.config['search_database_copy_path']
         configValues += ', blast_threads='+self.config['blast_threads']
         configValues += ', usearch_accel='+self.config['usearch_accel']
+        configValues += ', search_output_mode='+self.config['search_output_mode']
+        configValues += ', search_input_mode='+self.config['search_input_mode']
+        configValues += ', genome_fetch_mode='+self.config['genome_fetch_mode']
+        configValues += ', marble_engine='+self.config['marble_engine']
+        configValues += ', calculate_engine='+self.config['calculate_engine']
+        configValues += ', calculate_batch_processes='+self.config['calculate_batch_processes']
+        configValues += ', search_shards='+self.config['search_shards']
+        configValues += ', pool_size='+self.config['pool_size']
+        configValues += ', hit_cache_size='+self.config['hit_cache_size']
+        configValues += ', hit_cache_path='+self.config['hit_cache_path']
+        configValues += ', search_prefilter='+self.config['search_prefilter']
+        configValues += ', prefilter_kmer_size='+self.config['prefilter_kmer_size']
+        configValues += ', prefilter_min_kmers='+self.config['prefilter_min_kmers']
+        configValues += ', prefilter_max_candidates='+self.config['prefilter_max_candidates']
+        configValues += ', max_targets_per_query='+self.config['max_targets_per_query']
+        configValues += ', min_relative_score='+self.config['min_relative_score']
         self.mylog.log_message(log.NOTICE, configValues)
 
+        # Validate the value of the search_program variable before creating the DataParser
+        # object since the search database files depend on the search backend.
+        try:
+            searchBackendClass(self.config)
+        except SearchBackendError as e:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable search_program='+self.config['search_program']+' switched to blastp: '+str(e))
+            self.config['search_program'] = 'blastp'
+            self.config['search_backend_modules'] = ''
+
+        # Validate the value of the search_database_warmup variable before creating the
+        # DataParser object since the search database files are warmed up after they are loaded.
+        if self.config['search_database_warmup'] not in [ 'none', 'preload', 'lock' ]:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable search_database_warmup='+self.config['search_database_warmup']+' switched to none')
+            self.config['search_database_warmup'] = 'none'
+
+        # Validate the value of the hit_cache_size variable.  The hit cache must be on a local
+        # disk since the work folder is usually on a network file system where SQLite locking
+        # is slow and unreliable so the cache is turned off when hit_cache_path is not set.
+        try:
+            hitCacheSize = int(self.config['hit_cache_size'])
+        except ValueError:
+            hitCacheSize = -1
+        if hitCacheSize < 0:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable hit_cache_size='+self.config['hit_cache_size']+' switched to 0')
+            self.config['hit_cache_size'] = '0'
+        elif hitCacheSize > 0 and self.config['hit_cache_path'] == '':
+            self.mylog.log_message(log.NOTICE, 'Configuration variable hit_cache_size switched to 0 because hit_cache_path is not set')
+            self.config['hit_cache_size'] = '0'
+
         # Create a DataParser object for working with the static database files (the
         # data folder is created if it does not exist).
         self.dataParser = DataParser(self.config)
 
+        # Validate the value of the search_prefilter variable before getting the static database
+        # files since the k-mer index is built with them.  The prefilter only works with search
+        # backends that support candidate databases.
+        if self.config['search_prefilter'] not in [ 'none', 'kmer' ]:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable search_prefilter='+self.config['search_prefilter']+' switched to none')
+            self.config['search_prefilter'] = 'none'
+        if self.config['search_prefilter'] == 'kmer' and not searchBackendClass(self.config).supportsCandidateDatabase:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable search_prefilter switched to none because search_program is '+self.config['search_program'])
+            self.config['search_prefilter'] = 'none'
+        kmerSize = prefilter_kmer_size(self.config)
+
         # Get the static database files.  If the files do not exist and they are downloaded
         # from Shock, it can take a few minutes before the server is ready.
         testDataPath = os.path.join(os.environ['KB_SERVICE_DIR'], 'testdata')
-        self.config['load_data_option'] = self.dataParser.getDatabaseFiles(self.mylog, testDataPath)
-
-        # Validate the value of the job_queue variable.  Currently the only supported value is 'local'.
-        # Force it to a valid value to avoid an error trying to submit a job later.
-        if self.config['job_queue'] != 'local':
+        self.config['load_data_option'] = self.dataParser.getDatabaseFiles(self.mylog, testDataPath, kmerSize)
+
+        # Validate the value of the search_output_mode variable.  Force it to a valid value to
+        # avoid an error when running a job later.
+        if self.config['search_output_mode'] not in [ 'file', 'stream' ]:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable search_output_mode='+self.config['search_output_mode']+' switched to file')
+            self.config['search_output_mode'] = 'file'
+
+        # Validate the value of the search_input_mode variable.
+        if self.config['search_input_mode'] not in [ 'file', 'stdin' ]:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable search_input_mode='+self.config['search_input_mode']+' switched to file')
+            self.config['search_input_mode'] = 'file'
+
+        # Validate the value of the genome_fetch_mode variable.
+        if self.config['genome_fetch_mode'] not in [ 'full', 'subset' ]:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable genome_fetch_mode='+self.config['genome_fetch_mode']+' switched to full')
+            self.config['genome_fetch_mode'] = 'full'
+
+        # Validate the value of the marble_engine variable.
+        if self.config['marble_engine'] not in [ 'python', 'numpy' ]:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable marble_engine='+self.config['marble_engine']+' switched to python')
+            self.config['marble_engine'] = 'python'
+
+        # Validate the value of the calculate_engine variable.  The numpy engine needs NumPy and SciPy.
+        if self.config['calculate_engine'] not in [ 'python', 'numpy' ]:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable calculate_engine='+self.config['calculate_engine']+' switched to python')
+            self.config['calculate_engine'] = 'python'
+        if self.config['calculate_engine'] == 'numpy' and LikelihoodMatrix is None:
+            self.mylog.log_message(log.NOTICE, 'Configuration variable calculate_engine switched to python because NumPy or SciPy is not available')
+            self.config['calculate_engine'] = 'python'
+
+        # Validate the value of the calculate_batch_processes variable.
+        if self.config['calculate_batch_processes'] != 'auto' and (not self.config['calculate_batch_processes'].isdigit() or int(self.config['calculate_batch_processes']) < 1):
+            self.mylog.log_message(log.NOTICE, 'Configuration variable calculate_batch_processes='+self.config['calculate_batch_processes']+' switched to 1')
+            self.config['calculate_batch_processes'] = '1'
+
+        # Validate the value of the blast_threads variable.
+        if self.config['blast_threads'] != 'auto' and (not self.config['blast_threads'].isdigit() or int(self.config['blast_threads']) < 1):
+            self.mylog.log_message(log.NOTICE, 'Configuration variable blast_threads='+self.config['blast_threads']+' switched to 1')
+            self.config['blast_threads'] = '1'
+
+        # Validate the values of the per-query hit cutoff variables.
+        if not self.config['max_targets_per_query'].isdigit():
+            self.mylog.log_message(log.NOTICE, 'Configuration variable max_targets_per_query='+self.config['max_targets_per_query']+' switched to 0')
+            self.config['max_targets_per_query'] = '0'
+        if not self._validRelativeScore(self.config['min_relative_score']):
+            self.mylog.log_message(log.NOTICE, 'Configuration variable min_relative_score='+self.config['min_relative_score']+' switched to 0')
+            self.config['min_relative_score'] = '0'
+
+        # Validate the value of the job_queue variable.  Force it to a valid value to avoid an
+        # error trying to submit a job later.
+        if self.config['job_queue'] not in [ 'local', 'pool' ]:
             self.mylog.log_message(log.NOTICE, 'Configuration variable job_queue='+self.config['job_queue']+' switched to local')
             self.config['job_queue'] = 'local'
         #END_CONSTRUCTOR
@@ -624,16 +1219,30 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
 
             The following keys are optional:
             verbose: Print lots of messages on the progress of the algorithm
+            search_shards: Number of concurrent searches to split the query proteins across
+            incremental: Only search for proteins that changed since the previous version of the ProbAnno object
+            max_targets_per_query: Maximum number of hits kept for each query protein (0 for no limit)
+            min_relative_score: Minimum score of a hit as a fraction of the best score for the query protein
 
             @param ctx Current context object
             @param input Dictionary with input parameters for function
             @return Job ID of job started to compute annotation likelihoods
+            @raise ValueError when search_shards, max_targets_per_query, or min_relative_score input argument is not valid
         '''
 
         input = self._checkInputArguments(ctx, input, 
                                           [ "genome", "genome_workspace", "probanno", "probanno_workspace"],
-                                          { "verbose" : False }
+                                          { "verbose" : False,
+                                            "search_shards" : None,
+                                            "incremental" : False,
+                                            "max_targets_per_query" : None,
+                                            "min_relative_score" : None }
                                           )
+        if input['search_shards'] is not None and int(input['search_shards']) < 1:
+            message = "Input argument search_shards must be at least 1"
+            ctx.log_err(message)
+            raise ValueError(message)
+        self._checkHitCutoffs(ctx, input)
         
         # Make sure the static database files are ready.
         self._checkDatabaseFiles(ctx)
@@ -643,7 +1252,7 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
             ctx.set_log_level(log.DEBUG)
 
         # Make sure the Genome object is available.
-        wsClient = Workspace(self.config["workspace_url"], token=ctx['token'])
+        wsClient = make_workspace_client(self.config["workspace_url"], token=ctx['token'])
         genomeIdentity = make_object_identity(input['genome_workspace'], input['genome'])
         wsClient.get_object_info( [ genomeIdentity ], 0 )
 
@@ -656,24 +1265,8 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
         jobid = ujsClient.create_and_start_job(ctx['token'], 'initializing', description, progress, timestamp(3600))
         ctx.log_info('Job '+jobid+' started for genome '+input['genome']+' to probanno '+input['probanno'])
 
-        # Run the job on the local machine.
-        if self.config["job_queue"] == "local":
-            # Create working directory for job and build file names.
-            jobDirectory = make_job_directory(self.config['work_folder_path'], jobid)
-            jobDataFilename = os.path.join(jobDirectory, 'jobdata.json')
-            outputFilename = os.path.join(jobDirectory, 'stdout.log')
-            errorFilename = os.path.join(jobDirectory, 'stderr.log')
-    
-            # Save data required for running the job.
-            jobData = { 'id': jobid, 'input': input, 'context': ctx, 'config': self.config }
-            json.dump(jobData, open(jobDataFilename, "w"), indent=4)
-    
-            # Start worker to run the job.
-            jobScript = os.path.join(os.environ['KB_TOP'], 'bin/pa-runjob')
-            cmdline = "nohup %s %s >%s 2>%s &" %(jobScript, jobDirectory, outputFilename, errorFilename)
-            status = os.system(cmdline)
-            ctx.log_info('Job %s is running on local host, status %d' %(jobid, status))
-
+        # Start the job.
+        self._submitJob(ctx, jobid, 'annotate', input)
         #END annotate
 
         # At some point might do deeper type checking...
@@ -683,6 +1276,80 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
         # return the results
         return [jobid]
 
+    def annotate_batch(self, ctx, input):
+        # ctx is the context object
+        # return variables are: jobid
+        #BEGIN annotate_batch
+        ''' Compute probabilistic annotations for a batch of genome objects in one job.
+
+            The input dictionary must contain the following keys:
+            genomes: List of dictionaries with genome, genome_workspace, probanno, and
+                probanno_workspace keys for each Genome object in the batch
+
+            The following keys are optional:
+            verbose: Print lots of messages on the progress of the algorithm
+            search_shards: Number of concurrent searches to split the query proteins across
+            max_targets_per_query: Maximum number of hits kept for each query protein (0 for no limit)
+            min_relative_score: Minimum score of a hit as a fraction of the best score for the query protein
+
+            @param ctx Current context object
+            @param input Dictionary with input parameters for function
+            @return Job ID of job started to compute annotation likelihoods
+            @raise ValueError when genomes, search_shards, max_targets_per_query, or min_relative_score input argument is not valid
+        '''
+
+        input = self._checkInputArguments(ctx, input,
+                                          [ "genomes" ],
+                                          { "verbose" : False,
+                                            "search_shards" : None,
+                                            "max_targets_per_query" : None,
+                                            "min_relative_score" : None }
+                                          )
+        if len(input['genomes']) == 0:
+            message = "Input argument genomes must have at least one entry"
+            ctx.log_err(message)
+            raise ValueError(message)
+        for entry in input['genomes']:
+            self._checkInputArguments(ctx, entry, [ "genome", "genome_workspace", "probanno", "probanno_workspace"], None)
+        if input['search_shards'] is not None and int(input['search_shards']) < 1:
+            message = "Input argument search_shards must be at least 1"
+            ctx.log_err(message)
+            raise ValueError(message)
+        self._checkHitCutoffs(ctx, input)
+
+        # Make sure the static database files are ready.
+        self._checkDatabaseFiles(ctx)
+
+        # Set log level to INFO when verbose parameter is enabled.
+        if input['verbose']:
+            ctx.set_log_level(log.DEBUG)
+
+        # Make sure the Genome objects are available.
+        wsClient = make_workspace_client(self.config["workspace_url"], token=ctx['token'])
+        genomeIdentities = [ make_object_identity(entry['genome_workspace'], entry['genome']) for entry in input['genomes'] ]
+        wsClient.get_object_info(genomeIdentities, 0)
+
+        # Create a user and job state client and authenticate as the user.
+        ujsClient = UserAndJobState(self.config['userandjobstate_url'], token=ctx['token'])
+
+        # Create a job to track running probabilistic annotation.  There is a progress step
+        # for building the ProbAnno object for each genome.
+        description = 'pa-annotate for batch of %d genomes for user %s' %(len(input['genomes']), ctx['user_id'])
+        progress = { 'ptype': 'task', 'max': 5 + len(input['genomes']) }
+        jobid = ujsClient.create_and_start_job(ctx['token'], 'initializing', description, progress, timestamp(3600))
+        ctx.log_info('Job %s started for batch of %d genomes' %(jobid, len(input['genomes'])))
+
+        # Start the job.
+        self._submitJob(ctx, jobid, 'annotate_batch', input)
+        #END annotate_batch
+
+        # At some point might do deeper type checking...
+        if not isinstance(jobid, basestring):
+            raise ValueError('Method annotate_batch return value ' +
+                             'jobid is not type basestring as required.')
+        # return the results
+        return [jobid]
+
     def calculate(self, ctx, input):
         # ctx is the context object
         # return variables are: output
@@ -716,136 +1383,39 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
                                           }
                                          )
 
-        # Make sure the static database files are ready.
+        # Make sure the static database files are ready and use one version of them for the request.
         self._checkDatabaseFiles(ctx)
+        self.dataParser.refreshStaticData()
 
         # Set log level to INFO when verbose parameter is enabled.
         if input['verbose']:
             ctx.set_log_level(log.DEBUG)
         
         # Create a workspace client.
-        wsClient = Workspace(self.config["workspace_url"], token=ctx['token'])
+        wsClient = make_workspace_client(self.config["workspace_url"], token=ctx['token'])
         
         # Get the ProbAnno object from the specified workspace.
         probannoObjectId = make_object_identity(input["probanno_workspace"], input["probanno"])
         objectList = wsClient.get_objects( [ probannoObjectId ] )
         probannoObject = objectList[0]
-        if probannoObject['info'][2] != ProbAnnoType:
-            message = "ProbAnno object type %s is not %s for object %s" %(probannoObject['info'][2], ProbAnnoType, probannoObject['info'][1])
-            ctx.log_err(message)
-            raise WrongVersionError(message)
-        genome = probannoObject["data"]["genome"]
-        
-        # Create a temporary directory for storing intermediate files when debug is turned on.
-        if ctx.get_log_level() >= log.DEBUG2:
-            workFolder = tempfile.mkdtemp("", "calculate-%s-" %(genome), self.config["work_folder_path"])
-            ctx.log_debug('Intermediate files saved in '+workFolder)
-        else:
-            workFolder = None
+        self._checkProbannoObject(ctx, probannoObject)
 
         # When a template model is specified, use it to build dictionaries for roles,
         # complexes, and reactions instead of retrieving from static database files.
-        complexesToRoles = None
-        reactionsToComplexes = None
-        if input["template_model"] is not None or input["template_workspace"] is not None:
-            if not(input["template_model"] is not None and input["template_workspace"] is not None) :
-                message = "Template model workspace is required if template model ID is provided"
-                ctx.log_err(message)
-                raise ValueError(message)
-
-            # Create a dictionary to map a complex to a list of roles and a dictionary
-            # to map a reaction to a list of complexes.  The dictionaries are specific to
-            # the specified template model instead of covering everything in the central
-            # data model.
-            complexesToRoles = dict()
-            reactionsToComplexes = dict()
-
-            # Get the list of RoleComplexReactions for the template model from the
-            # fba modeling service.  The RoleComplexReactions structure has a list
-            # of ComplexReactions structures for the given role.  And each ComplexReactions
-            # structure has a list of reactions for the given complex.
-            fbaClient = fbaModelServices(self.config['fbamodeling_url'], token=ctx['token'])
-            roleComplexReactionsList = fbaClient.role_to_reactions( { 'templateModel': input['template_model'], 'workspace': input['template_workspace'] } )
-
-            # Build the two dictionaries from the returned list.
-            for rcr in roleComplexReactionsList:
-                for complex in rcr['complexes']:
-                    complexId = re.sub(r'cpx0*(\d+)', r'kb|cpx.\1', complex['name']) # Convert ModelSEED format to KBase format
-                    if complexId in complexesToRoles:
-                        complexesToRoles[complexId].append(rcr['name'])
-                    else:
-                        complexesToRoles[complexId] = [ rcr['name'] ]
-                    for reaction in complex['reactions']:
-                        reactionId = reaction['reaction']
-                        if reactionId in reactionsToComplexes:
-                            reactionsToComplexes[reactionId].append(complexId)
-                        else:
-                            reactionsToComplexes[reactionId] = [ complexId ]
-
-        # Calculate per-gene role probabilities.
-        roleProbs = self._rolesetProbabilitiesToRoleProbabilities(ctx, input, genome, probannoObject["data"]["roleset_probabilities"], workFolder)
-
-        # Calculate whole cell role probabilities.
-        # Note - eventually workFolder will be replaced with a rolesToReactions call
-        totalRoleProbs = self._totalRoleProbabilities(ctx, input, genome, roleProbs, workFolder)
-
-        # Calculate complex probabilities.
-        complexProbs = self._complexProbabilities(ctx, input, genome, totalRoleProbs, workFolder, complexesToRequiredRoles = complexesToRoles)
+        complexesToRoles, reactionsToComplexes = self._templateMappings(ctx, input)
 
         # Calculate reaction probabilities.
-        reactionProbs = self._reactionProbabilities(ctx, input, genome, complexProbs, workFolder, rxnsToComplexes = reactionsToComplexes)
+        reactionProbs = self._genomeReactionProbabilities(ctx, input, probannoObject, complexesToRoles, reactionsToComplexes)
 
         # If the reaction probabilities were not calculated using the data from the fba modeling service
         # via the template model, we need to convert from the KBase ID format to the ModelSEED format.
         if input["template_model"] is None:
-            reactionList = list()
+            reactionIds = self._modelSeedReactionIds(ctx, [ rxnProb[0] for rxnProb in reactionProbs ])
             for index in range(len(reactionProbs)):
-                reactionList.append(reactionProbs[index][0])
-            EntityAPI = CDMI_EntityAPI(self.config["cdmi_url"])
-            numAttempts = 4
-            while numAttempts > 0:
-                try:
-                    numAttempts -= 1
-                    reactionData = EntityAPI.get_entity_Reaction( reactionList, [ "source_id" ] )
-                    if len(reactionList) == len(reactionData):
-                        numAttempts = 0
-                except HTTPError as e:
-                    pass
-            for index in range(len(reactionProbs)):
-                rxnId = reactionProbs[index][0]
-                reactionProbs[index][0] = reactionData[rxnId]['source_id']
- 
-        # Create a reaction probability object
-        objectData = dict()
-        objectData["genome"] = probannoObject["data"]["genome"]
-        objectData['genome_workspace'] = probannoObject['data']['genome_workspace']
-        if input["template_model"] is None:
-            objectData['template_model'] = 'None'
-        else:
-            objectData["template_model"] = input["template_model"]
-        if input["template_workspace"] is None:
-            objectData['template_workspace'] = 'None'
-        else:
-            objectData["template_workspace"] = input["template_workspace"]
-        objectData["probanno"] = input['probanno']
-        objectData['probanno_workspace'] = input['probanno_workspace']
-        objectData["id"] = input["rxnprobs"]
-        objectData["reaction_probabilities"] = reactionProbs
+                reactionProbs[index][0] = reactionIds[reactionProbs[index][0]]
 
-        objectMetaData = { "num_reaction_probs": len(objectData["reaction_probabilities"]) }
-        objectProvData = dict()
-        objectProvData['time'] = timestamp(0)
-        objectProvData['service'] = os.environ['KB_SERVICE_NAME']
-        objectProvData['service_ver'] = ServiceVersion
-        objectProvData['method'] = 'calculate'
-        objectProvData['method_params'] = input.items()
-        objectProvData['input_ws_objects'] = [ '%s/%s/%d' %(probannoObject['info'][7], probannoObject['info'][1], probannoObject['info'][4]) ]
-        objectSaveData = dict();
-        objectSaveData['type'] = RxnProbsType
-        objectSaveData['name'] = input["rxnprobs"]
-        objectSaveData['data'] = objectData
-        objectSaveData['meta'] = objectMetaData
-        objectSaveData['provenance'] = [ objectProvData ]
+        # Save the reaction probability object.
+        objectSaveData = self._rxnprobsSaveData(input, probannoObject, reactionProbs, 'calculate')
         objectInfo = wsClient.save_objects( { 'workspace': input["rxnprobs_workspace"], 'objects': [ objectSaveData ] } )
         output = objectInfo[0]
         
@@ -858,6 +1428,137 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
         # return the results
         return [output]
 
+    def calculate_batch(self, ctx, input):
+        # ctx is the context object
+        # return variables are: output
+        #BEGIN calculate_batch
+        ''' Compute reaction probabilities from a batch of probabilistic annotations.
+
+            The ProbAnno objects are fetched with one get_objects() call, the complex and
+            reaction mappings are loaded once, and the reaction IDs are translated to the
+            ModelSEED format once for the batch.  The reaction probabilities for the
+            ProbAnno objects are calculated in parallel in a pool of processes and the
+            RxnProbs objects are saved with one save_objects() call for each workspace
+            and group of SaveBatchSize objects.
+
+            The input dictionary must contain the following keys:
+            probannos: List of dictionaries with probanno, probanno_workspace, rxnprobs, and
+                rxnprobs_workspace keys for each ProbAnno object in the batch
+
+            The following keys are optional:
+            verbose: Print lots of messages on the progress of the algorithm
+            template_model: Name of TemplateModel object
+            template_workspace: Workspace from which to grab TemplateModel object
+
+            @param ctx Current context object
+            @param input Dictionary with input parameters for function
+            @return List of object info for RxnProbs objects in the same order as the input list
+            @raise WrongVersionError when ProbAnno object version number is invalid
+            @raise ValueError when probannos or template_workspace input argument is not valid
+        '''
+
+        # Sanity check on input arguments
+        input = self._checkInputArguments(ctx, input,
+                                          [ "probannos" ],
+                                          { "verbose" : False,
+                                            "template_model" : None,
+                                            "template_workspace" : None }
+                                          )
+        if len(input['probannos']) == 0:
+            message = "Input argument probannos must have at least one entry"
+            ctx.log_err(message)
+            raise ValueError(message)
+        for entry in input['probannos']:
+            self._checkInputArguments(ctx, entry, [ "probanno", "probanno_workspace", "rxnprobs", "rxnprobs_workspace" ], None)
+
+        # Make sure the static database files are ready and use one version of them for the request.
+        self._checkDatabaseFiles(ctx)
+        self.dataParser.refreshStaticData()
+
+        # Set log level to INFO when verbose parameter is enabled.
+        if input['verbose']:
+            ctx.set_log_level(log.DEBUG)
+
+        # Create a workspace client.
+        wsClient = make_workspace_client(self.config["workspace_url"], token=ctx['token'])
+
+        # Get all of the ProbAnno objects with one call.
+        probannoObjectIds = [ make_object_identity(entry['probanno_workspace'], entry['probanno']) for entry in input['probannos'] ]
+        probannoObjects = wsClient.get_objects(probannoObjectIds)
+        for probannoObject in probannoObjects:
+            self._checkProbannoObject(ctx, probannoObject)
+
+        # When a template model is specified, use it to build dictionaries for roles,
+        # complexes, and reactions instead of retrieving from static database files.
+        complexesToRoles, reactionsToComplexes = self._templateMappings(ctx, input)
+
+        # Build the input parameters for each ProbAnno object the same as for calculate().
+        inputs = list()
+        for entry in input['probannos']:
+            objectInput = dict(entry)
+            for key in [ 'verbose', 'template_model', 'template_workspace' ]:
+                objectInput[key] = input[key]
+            inputs.append(objectInput)
+
+        # Load the data used to calculate reaction probabilities before starting the pool
+        # so the processes share it instead of each building it.
+        matrix = None
+        if self.config['calculate_engine'] == 'numpy':
+            matrix = self._likelihoodMatrix(complexesToRoles, reactionsToComplexes)
+        elif complexesToRoles is None and reactionsToComplexes is None:
+            self._zeroReactionProbabilities()
+            self.dataParser.getRoleComplexes()
+            self.dataParser.getComplexReactions()
+
+        # Calculate the reaction probabilities for the ProbAnno objects.
+        numProcesses = calculate_process_count(self.config, len(inputs))
+        ctx.log_debug('Calculating reaction probabilities for %d ProbAnno objects with %d processes' %(len(inputs), numProcesses))
+        if numProcesses > 1:
+            state = (self, ctx, inputs, probannoObjects, complexesToRoles, reactionsToComplexes, matrix)
+            pool = multiprocessing.Pool(numProcesses, initCalculateBatchProcess, (state,))
+            try:
+                reactionProbsList = pool.map(calculateBatchGenome, range(len(inputs)))
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            reactionProbsList = [ self._genomeReactionProbabilities(ctx, inputs[index], probannoObjects[index], complexesToRoles, reactionsToComplexes, matrix)
+                                  for index in range(len(inputs)) ]
+
+        # If the reaction probabilities were not calculated using the data from the fba modeling service
+        # via the template model, convert the reactions of every ProbAnno object from the KBase ID format
+        # to the ModelSEED format with one translation.
+        if input["template_model"] is None:
+            reactionList = set()
+            for reactionProbs in reactionProbsList:
+                reactionList.update([ rxnProb[0] for rxnProb in reactionProbs ])
+            reactionIds = self._modelSeedReactionIds(ctx, list(reactionList))
+            for reactionProbs in reactionProbsList:
+                for index in range(len(reactionProbs)):
+                    reactionProbs[index][0] = reactionIds[reactionProbs[index][0]]
+
+        # Save the reaction probability objects with one call for each workspace and group of objects.
+        workspaceIndexes = dict()
+        for index in range(len(inputs)):
+            workspaceIndexes.setdefault(inputs[index]['rxnprobs_workspace'], list()).append(index)
+        output = [ None ] * len(inputs)
+        for workspace in sorted(workspaceIndexes.keys()):
+            indexes = workspaceIndexes[workspace]
+            for start in range(0, len(indexes), SaveBatchSize):
+                batch = indexes[start:start+SaveBatchSize]
+                objects = [ self._rxnprobsSaveData(inputs[index], probannoObjects[index], reactionProbsList[index], 'calculate_batch') for index in batch ]
+                objectInfo = wsClient.save_objects( { 'workspace': workspace, 'objects': objects } )
+                for position in range(len(batch)):
+                    output[batch[position]] = objectInfo[position]
+        #END calculate_batch
+
+        # At some point might do deeper type checking...
+        if not isinstance(output, list):
+            raise ValueError('Method calculate_batch return value ' +
+                             'output is not type list as required.')
+        # return the results
+        return [output]
+
     def get_rxnprobs(self, ctx, input):
         # ctx is the context object
         # return variables are: output
@@ -876,7 +1577,7 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
                                           { 'rxnprobs_version': None, 'sort_field': 'rxnid' }
                                           )
 
-        wsClient = Workspace(self.config["workspace_url"], token=ctx['token'])
+        wsClient = make_workspace_client(self.config["workspace_url"], token=ctx['token'])
         rxnProbsObjectId = make_object_identity(input["rxnprobs_workspace"], input["rxnprobs"], input['rxnprobs_version'])
         objectList = wsClient.get_objects( [ rxnProbsObjectId ] )
         rxnProbsObject = objectList[0]
@@ -915,15 +1616,22 @@ reactions in metabolic models.  With the Probabilistic Annotation service:
                                           { 'probanno_version': None }
                                           )
 
-        wsClient = Workspace(self.config["workspace_url"], token=ctx['token'])
+        wsClient = make_workspace_client(self.config["workspace_url"], token=ctx['token'])
         probAnnoObjectId = make_object_identity(input["probanno_workspace"], input["probanno"], input['probanno_version'])
         objectList = wsClient.get_objects( [ probAnnoObjectId ] )
         probAnnoObject = objectList[0]
-        if probAnnoObject['info'][2] != ProbAnnoType:
-            message = 'ProbAnno object type %s is not %s for object %s' %(probAnnoObject['info'][2], ProbAnnoType, probAnnoObject['info'][1])
+        if probAnnoObject['info'][2] not in ProbAnnoTypes:
+            message = 'ProbAnno object type %s is not one of %s for object %s' %(probAnnoObject['info'][2], ', '.join(ProbAnnoTypes), probAnnoObject['info'][1])
             ctx.log_err(message)
             raise WrongVersionError(message)
-        output = probAnnoObject["data"]["roleset_probabilities"]
+
+        # Rolesets are stored in a dictionary of rolesets in the current version of the object
+        # so convert back to a rolestring in every tuple.
+        if probAnnoObject['info'][2] == ProbAnnoType:
+            data = probAnnoObject["data"]
+            output = expand_rolesets(data["roles"], data["rolesets"], data["feature_probabilities"], self.config["separator"])
+        else:
+            output = probAnnoObject["data"]["roleset_probabilities"]
 
         #END get_probanno
 
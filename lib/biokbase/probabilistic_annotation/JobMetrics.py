@@ -0,0 +1,201 @@
+#!/usr/bin/python
+
+''' Resource usage of the stages of a job.
+
+    A JobMetrics object records the wall time, CPU time, and peak resident set size of
+    each stage of a job along with the resource usage of each search program run by the
+    job and the hits dropped by the per-query cutoffs.  CPU times of the job process
+    include all of its threads and the CPU times of child processes include the search
+    programs that finished during the stage.  Peak resident set size is the largest
+    size of the job process since it started so it only grows from stage to stage.  The
+    metrics are saved to a file in the job directory and added to the results of the
+    job in the user and job state service.
+'''
+
+import os
+import time
+import json
+import resource
+import threading
+
+# Name of the file with the metrics in the job directory.
+MetricsFileName = 'metrics.json'
+
+# Number of digits after the decimal point kept for times.
+TimeDigits = 3
+
+class JobMetrics:
+
+    def __init__(self):
+        ''' Initialize the object and start measuring the job.
+
+            @return Nothing
+        '''
+
+        self.stages = list()
+        self.searches = list()
+        self.current = None
+        self.startTime = time.time()
+        self.startTimes = os.times()
+        self.total = None
+        self.cutoffs = { 'queries': 0, 'truncated_queries': 0, 'kept_hits': 0, 'dropped_hits': 0, 'dropped_mass': 0.0 }
+        self.lock = threading.Lock()
+        return
+
+    def startStage(self, name):
+        ''' Start measuring a stage of the job and end the current stage.
+
+            @param name Name of stage
+            @return Nothing
+        '''
+
+        self.endStage()
+        self.current = { 'name': name, 'start': time.time(), 'times': os.times() }
+        return
+
+    def endStage(self):
+        ''' End the current stage of the job.
+
+            @return Nothing
+        '''
+
+        if self.current is None:
+            return
+        stage = self._usage(self.current['start'], self.current['times'])
+        stage['name'] = self.current['name']
+        self.stages.append(stage)
+        self.current = None
+        return
+
+    def addSearch(self, args, wallTime, rusage):
+        ''' Add the resource usage of a search program that finished.
+
+            @param args List of arguments for the command that ran the search program
+            @param wallTime Number of seconds the search program ran
+            @param rusage Resource usage of the search program returned by os.wait4()
+            @return Nothing
+        '''
+
+        search = dict()
+        if self.current is not None:
+            search['stage'] = self.current['name']
+        search['program'] = os.path.basename(args[0])
+        search['wall_time'] = round(wallTime, TimeDigits)
+        search['user_time'] = round(rusage.ru_utime, TimeDigits)
+        search['system_time'] = round(rusage.ru_stime, TimeDigits)
+        search['peak_rss_kb'] = rusage.ru_maxrss
+        search['major_page_faults'] = rusage.ru_majflt
+        search['block_input_ops'] = rusage.ru_inblock
+        search['block_output_ops'] = rusage.ru_oublock
+        self.searches.append(search)
+        return
+
+    def addHitCutoffs(self, numQueries, numTruncated, numKept, numDropped, droppedMass):
+        ''' Add the hits dropped by the per-query cutoffs for query proteins that were scored.
+
+            The probability mass of the dropped hits for a query protein is the sum of the
+            likelihoods the dropped hits would have contributed without the cutoffs.
+
+            @param numQueries Number of query proteins
+            @param numTruncated Number of query proteins with dropped hits
+            @param numKept Number of hits that were kept
+            @param numDropped Number of hits that were dropped
+            @param droppedMass Sum of the probability mass of the dropped hits for the query proteins
+            @return Nothing
+        '''
+
+        # Query proteins can be scored by more than one thread.
+        self.lock.acquire()
+        try:
+            self.cutoffs['queries'] += numQueries
+            self.cutoffs['truncated_queries'] += numTruncated
+            self.cutoffs['kept_hits'] += numKept
+            self.cutoffs['dropped_hits'] += numDropped
+            self.cutoffs['dropped_mass'] += droppedMass
+        finally:
+            self.lock.release()
+        return
+
+    def finish(self):
+        ''' End the current stage and measure the whole job.
+
+            @return Nothing
+        '''
+
+        self.endStage()
+        self.total = self._usage(self.startTime, self.startTimes)
+        return
+
+    def toDict(self):
+        ''' Get the metrics.
+
+            @return Dictionary with list of stages, list of searches, hit cutoffs, and total for the job
+        '''
+
+        cutoffs = dict(self.cutoffs)
+        cutoffs['mean_dropped_mass'] = 0.0
+        if cutoffs['queries'] > 0:
+            cutoffs['mean_dropped_mass'] = cutoffs['dropped_mass'] / cutoffs['queries']
+        return { 'stages': self.stages, 'searches': self.searches, 'hit_cutoffs': cutoffs, 'total': self.total }
+
+    def write(self, path):
+        ''' Write the metrics to a file as JSON.
+
+            @param path Path to metrics file
+            @return Nothing
+        '''
+
+        fid = open(path, 'w')
+        json.dump(self.toDict(), fid, indent=4, sort_keys=True)
+        fid.close()
+        return
+
+    def jobResults(self, path):
+        ''' Build the results of the job for the user and job state service.
+
+            There is one result for each stage, each search, the hit cutoffs, and the total
+            for the job.  The ID of a result is the kind and name of the metrics (e.g.
+            stage:search) and the description has the metrics as JSON.
+
+            @param path Path to metrics file
+            @return Results structure for complete_job()
+        '''
+
+        results = list()
+        for stage in self.stages:
+            results.append(self._result(path, 'stage:'+stage['name'], stage))
+        for index in range(len(self.searches)):
+            results.append(self._result(path, 'search:%d' %(index), self.searches[index]))
+        results.append(self._result(path, 'job:hit_cutoffs', self.toDict()['hit_cutoffs']))
+        if self.total is not None:
+            results.append(self._result(path, 'job:total', self.total))
+        return { 'results': results }
+
+    def _usage(self, start, startTimes):
+        ''' Measure the resource usage of the job process since a starting point.
+
+            @param start Wall clock time at the starting point
+            @param startTimes Value returned by os.times() at the starting point
+            @return Dictionary with wall time, CPU times, and peak resident set size
+        '''
+
+        times = os.times()
+        usage = dict()
+        usage['wall_time'] = round(time.time() - start, TimeDigits)
+        usage['user_time'] = round(times[0] - startTimes[0], TimeDigits)
+        usage['system_time'] = round(times[1] - startTimes[1], TimeDigits)
+        usage['children_user_time'] = round(times[2] - startTimes[2], TimeDigits)
+        usage['children_system_time'] = round(times[3] - startTimes[3], TimeDigits)
+        usage['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage
+
+    def _result(self, path, id, metrics):
+        ''' Build a Result structure for the user and job state service.
+
+            @param path Path to metrics file
+            @param id Identifier of the metrics
+            @param metrics Dictionary of metrics
+            @return Result structure
+        '''
+
+        return { 'server_type': 'metrics', 'url': 'file://'+path, 'id': id, 'description': json.dumps(metrics, sort_keys=True) }
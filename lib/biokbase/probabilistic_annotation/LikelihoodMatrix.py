@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+''' Reaction likelihoods computed with sparse matrices.
+
+    A LikelihoodMatrix object interns the roles, complexes, and reactions in the
+    complex to roles and reaction to complexes mappings as integer indexes and keeps
+    the mappings as sparse incidence matrices.  The likelihood of each reaction for a
+    genome is computed from the roleset likelihoods of the query proteins with array
+    operations: a sum over rolesets for each query protein and role, a maximum over
+    query proteins for each role, a minimum over the required roles for each complex,
+    and a maximum over the complexes for each reaction.  Only the complexes and
+    reactions reached from a role found in the organism are converted back to
+    tuples, the rest come from the results when no roles are found in the organism.
+
+    The results are identical to the results from the python implementation in the
+    calculate() method, including the order of the complexes and reactions and the
+    Boolean Gene-Protein-Reaction relationships (both implementations sort the genes
+    and the parts of each relationship).  Sums are accumulated in the same order so
+    the likelihoods are the same to the last bit.
+'''
+
+import numpy
+from scipy import sparse
+
+class LikelihoodMatrix:
+
+    def __init__(self, complexesToRequiredRoles, rxnsToComplexes, allroles, separator):
+        ''' Initialize the object.
+
+            @param complexesToRequiredRoles Dictionary keyed by complex ID of list of roles involved in forming the complex
+            @param rxnsToComplexes Dictionary keyed by reaction ID of list of catalyzing complexes
+            @param allroles Set of roles with representatives in the subsystems
+            @param separator Character string used as separator between elements in lists
+        '''
+
+        self.separator = separator
+
+        # Intern the complexes and reactions in the order of the mappings so the results
+        # are in the same order as the python implementation.
+        self.complexes = list(complexesToRequiredRoles)
+        self.complexRoles = [ complexesToRequiredRoles[cplx] for cplx in self.complexes ]
+        self.complexToIndex = dict()
+        for index in range(len(self.complexes)):
+            self.complexToIndex[self.complexes[index]] = index
+        self.reactions = list(rxnsToComplexes)
+        self.reactionComplexes = [ rxnsToComplexes[rxn] for rxn in self.reactions ]
+
+        # Intern the roles with representatives in the subsystems (other roles never have
+        # a likelihood) and build the complex to roles matrix.  A role listed twice for a
+        # complex is counted twice the same as the python implementation.
+        self.roleToIndex = dict()
+        complexColumn = list()
+        roleColumn = list()
+        for index in range(len(self.complexes)):
+            for role in self.complexRoles[index]:
+                if role not in allroles:
+                    continue
+                if role not in self.roleToIndex:
+                    self.roleToIndex[role] = len(self.roleToIndex)
+                complexColumn.append(index)
+                roleColumn.append(self.roleToIndex[role])
+        self.entryComplex = numpy.array(complexColumn, dtype=numpy.int64)
+        self.entryRole = numpy.array(roleColumn, dtype=numpy.int64)
+        self.complexRoleMatrix = sparse.csr_matrix((numpy.ones(len(complexColumn)), (self.entryComplex, self.entryRole)),
+                                                   shape=(len(self.complexes), len(self.roleToIndex)))
+
+        # Build the reaction to complexes matrix with the complexes in the complex to roles mapping.
+        reactionColumn = list()
+        complexColumn = list()
+        for index in range(len(self.reactions)):
+            for cplx in self.reactionComplexes[index]:
+                if cplx in self.complexToIndex:
+                    reactionColumn.append(index)
+                    complexColumn.append(self.complexToIndex[cplx])
+        self.entryReaction = numpy.array(reactionColumn, dtype=numpy.int64)
+        self.entryReactionComplex = numpy.array(complexColumn, dtype=numpy.int64)
+        self.reactionComplexMatrix = sparse.csr_matrix((numpy.ones(len(reactionColumn)), (self.entryReaction, self.entryReactionComplex)),
+                                                       shape=(len(self.reactions), len(self.complexes)))
+
+        # Build the results when no roles are found in the organism.
+        self.zeroComplexProbs = [ self._complexProbability(index, dict(), 0.0) for index in range(len(self.complexes)) ]
+        self.zeroReactionProbs = [ tuple(self._reactionProbability(index, self.zeroComplexProbs, 0.0, 100.0)) for index in range(len(self.reactions)) ]
+        return
+
+    def reactionProbabilities(self, roles, rolesets, featureProbs, dilutionPercent):
+        ''' Compute the likelihood of each reaction from the roleset likelihoods of the query proteins.
+
+            @param roles List of roles
+            @param rolesets List of lists of role indices for each roleset
+            @param featureProbs Dictionary keyed by query gene of list of tuples with roleset index and likelihood
+            @param dilutionPercent Percentage of the maximum likelihood for other genes to be included in a relationship
+            @return List of tuples with role, likelihood, and estimated set of genes that perform the role,
+                list of tuples with complex ID, likelihood, type, list of roles not in organism, list of roles
+                not in subsystems, and boolean Gene-Protein relationship, list of lists with reaction ID,
+                likelihood, reaction type, complex info, and gene-protein-reaction relationship
+        '''
+
+        dilution = float(dilutionPercent)
+
+        # Flatten the roleset likelihoods of the query proteins into columns.
+        queries = list(featureProbs)
+        queryColumn = list()
+        rolesetColumn = list()
+        likelihoodColumn = list()
+        for index in range(len(queries)):
+            for tup in featureProbs[queries[index]]:
+                queryColumn.append(index)
+                rolesetColumn.append(tup[0])
+                likelihoodColumn.append(tup[1])
+        rolesetColumn = numpy.array(rolesetColumn, dtype=numpy.int64)
+
+        # Expand each roleset likelihood into an entry for each role in the roleset.  The
+        # entries are in the same order as the python implementation adds them up.
+        rolesetLengths = numpy.array([ len(roleset) for roleset in rolesets ], dtype=numpy.int64)
+        rolesetStarts = numpy.cumsum(rolesetLengths) - rolesetLengths
+        rolesetRoles = numpy.array([ roleIndex for roleset in rolesets for roleIndex in roleset ], dtype=numpy.int64)
+        counts = rolesetLengths[rolesetColumn]
+        entryStarts = numpy.cumsum(counts) - counts
+        offsets = numpy.arange(int(counts.sum()), dtype=numpy.int64) - numpy.repeat(entryStarts, counts)
+        entryRole = rolesetRoles[numpy.repeat(rolesetStarts[rolesetColumn], counts) + offsets]
+        entryQuery = numpy.repeat(numpy.array(queryColumn, dtype=numpy.int64), counts)
+        entryLikelihood = numpy.repeat(numpy.array(likelihoodColumn, dtype=float), counts)
+
+        # Sum the likelihoods for each query protein and role.
+        # See equation 3 in the paper ("Calculating reaction likelihoods" section).
+        numRoles = max(len(roles), 1)
+        pairs, pairInverse = numpy.unique(entryQuery * numRoles + entryRole, return_inverse=True)
+        pairLikelihood = numpy.bincount(pairInverse, weights=entryLikelihood, minlength=len(pairs))
+        pairQuery = pairs // numRoles
+        pairRole = pairs % numRoles
+
+        # Take the maximum likelihood over the query proteins for each role and keep the
+        # query proteins within the dilution percent of the maximum.
+        # See equation 4 in the paper ("Calculating reaction likelihoods" section).
+        roleLikelihood = numpy.empty(len(roles))
+        roleLikelihood.fill(-numpy.inf)
+        numpy.maximum.at(roleLikelihood, pairRole, pairLikelihood)
+        keep = pairLikelihood >= dilution/100.0 * roleLikelihood[pairRole]
+        order = numpy.lexsort((pairQuery[keep], pairRole[keep]))
+        keptRole = pairRole[keep][order].tolist()
+        keptQuery = pairQuery[keep][order].tolist()
+
+        # Build the relationship for each role with the genes in the same order as the python implementation.
+        totalRoleProbs = list()
+        rolesToGeneList = dict()
+        rolePresent = numpy.zeros(len(self.roleToIndex))
+        roleMinimum = numpy.empty(len(self.roleToIndex))
+        roleMinimum.fill(numpy.inf)
+        likelihoods = roleLikelihood.tolist()
+        start = 0
+        while start < len(keptRole):
+            end = start
+            while end < len(keptRole) and keptRole[end] == keptRole[start]:
+                end += 1
+            role = roles[keptRole[start]]
+            geneSet = set([ queries[keptQuery[index]] for index in range(start, end) ])
+            gpr = " or ".join(sorted(geneSet))
+            if len(geneSet) > 1:
+                gpr = "(" + gpr + ")"
+            totalRoleProbs.append( (role, likelihoods[keptRole[start]], gpr) )
+            if role in self.roleToIndex:
+                rolesToGeneList[role] = gpr
+                rolePresent[self.roleToIndex[role]] = 1.0
+                roleMinimum[self.roleToIndex[role]] = likelihoods[keptRole[start]]
+            start = end
+
+        # Take the minimum likelihood over the required roles found in the organism for each complex.
+        # See equation 5 in the paper ("Calculating reaction likelihoods" section).
+        complexLikelihood = numpy.empty(len(self.complexes))
+        complexLikelihood.fill(1000.0)
+        numpy.minimum.at(complexLikelihood, self.entryComplex, roleMinimum[self.entryRole])
+        complexFound = (self.complexRoleMatrix.dot(rolePresent) > 0).astype(float)
+        complexLikelihood = numpy.where(complexFound > 0, complexLikelihood, 0.0)
+        complexProbs = list(self.zeroComplexProbs)
+        for index in numpy.flatnonzero(complexFound).tolist():
+            complexProbs[index] = self._complexProbability(index, rolesToGeneList, float(complexLikelihood[index]))
+
+        # Take the maximum likelihood over the complexes for each reaction.
+        # See equation 6 in the paper ("Calculating reaction likelihoods" section).
+        reactionLikelihood = numpy.zeros(len(self.reactions))
+        numpy.maximum.at(reactionLikelihood, self.entryReaction, complexLikelihood[self.entryReactionComplex])
+        reactionFound = self.reactionComplexMatrix.dot(complexFound) > 0
+        # Use lists so that we can modify the reaction IDs if needed to translate to ModelSEED IDs
+        reactionProbs = map(list, self.zeroReactionProbs)
+        for index in numpy.flatnonzero(reactionFound).tolist():
+            reactionProbs[index] = self._reactionProbability(index, complexProbs, float(reactionLikelihood[index]), dilution)
+
+        return totalRoleProbs, complexProbs, reactionProbs
+
+    def _complexProbability(self, index, rolesToGeneList, likelihood):
+        ''' Build the tuple for a complex.
+
+            @param index Index of complex
+            @param rolesToGeneList Dictionary keyed by role found in organism of relationship for role
+            @param likelihood Likelihood of complex when a role is found in the organism
+            @return Tuple with complex ID, likelihood, type, list of roles not in organism,
+                list of roles not in subsystems, and boolean Gene-Protein relationship
+        '''
+
+        allCplxRoles = self.complexRoles[index]
+        availRoles = list()
+        unavailRoles = list()
+        noexistRoles = list()
+        for role in allCplxRoles:
+            if role not in self.roleToIndex:
+                noexistRoles.append(role)
+            elif role not in rolesToGeneList:
+                unavailRoles.append(role)
+            else:
+                availRoles.append(role)
+        unavail = self.separator.join(unavailRoles)
+        noexist = self.separator.join(noexistRoles)
+        if len(noexistRoles) == len(allCplxRoles):
+            return (self.complexes[index], 0.0, "CPLX_NOREPS", unavail, noexist, "")
+        if len(unavailRoles) == len(allCplxRoles):
+            return (self.complexes[index], 0.0, "CPLX_NOTTHERE", unavail, noexist, "")
+        if len(unavailRoles) + len(noexistRoles) == len(allCplxRoles):
+            return (self.complexes[index], 0.0, "CPLX_NOREPS_AND_NOTTHERE", unavail, noexist, "")
+        if len(availRoles) == len(allCplxRoles):
+            TYPE = "CPLX_FULL"
+        else:
+            TYPE = "CPLX_PARTIAL_%d_of_%d" %(len(availRoles), len(allCplxRoles))
+        gprSet = set([ rolesToGeneList[role] for role in availRoles ])
+        GPR = " and ".join(sorted(gprSet))
+        if GPR != "" and len(gprSet) > 1:
+            GPR = "(" + GPR + ")"
+        return (self.complexes[index], likelihood, TYPE, unavail, noexist, GPR)
+
+    def _reactionProbability(self, index, complexProbs, likelihood, dilution):
+        ''' Build the list for a reaction.
+
+            @param index Index of reaction
+            @param complexProbs List of tuples for complexes
+            @param likelihood Maximum likelihood of the complexes catalyzing the reaction
+            @param dilution Percentage of the maximum likelihood for a complex to be included in the relationship
+            @return List with reaction ID, likelihood, reaction type, complex info, and
+                gene-protein-reaction relationship
+        '''
+
+        complexList = list()
+        for cplx in self.reactionComplexes[index]:
+            if cplx in self.complexToIndex:
+                complexList.append(complexProbs[self.complexToIndex[cplx]])
+        if len(complexList) == 0:
+            return [ self.reactions[index], 0, "NOCOMPLEXES", '', "" ]
+
+        # Complex1 (P1; TYPE1) ///Complex2 (P2; TYPE2) ...
+        sortedList = sorted(complexList, key=lambda tup: tup[1], reverse=True)
+        complexString = self.separator.join([ '%s (%1.4f; %s)' %(cplx[0], cplx[1], cplx[2]) for cplx in sortedList ])
+        cplxGprs = [ cplx[5] for cplx in complexList if not cplx[1] < likelihood * dilution/100.0 ]
+        GPR = ""
+        if len(cplxGprs) > 0:
+            GPR = " or ".join( sorted(set(cplxGprs)) )
+        return [ self.reactions[index], likelihood, 'HASCOMPLEXES', complexString, GPR ]
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+
+''' Local stand-in for the workspace service.
+
+    A LocalWorkspace object implements the subset of the workspace client methods used
+    by the probabilistic annotation service with objects stored as JSON files in a local
+    directory.  It is used when the workspace_url configuration variable is a file URL
+    (e.g. file:///data/workspaces) so jobs can be run and tested without a workspace
+    server.  Each workspace is a sub-directory and each version of an object is a file
+    named <object name>.<version>.json with the data, info, and provenance of the object.
+'''
+
+import os
+import json
+import time
+import hashlib
+
+# Exception thrown when an object is not found
+class ObjectNotFoundError(Exception):
+    pass
+
+class LocalWorkspace:
+
+    def __init__(self, path):
+        ''' Initialize the object.
+
+            @param path Path to directory with workspace sub-directories
+        '''
+
+        self.path = path
+        return
+
+    def get_objects(self, objectIds):
+        ''' Get objects.
+
+            @param objectIds List of object identity dictionaries
+            @return List of object data dictionaries
+            @raise ObjectNotFoundError when an object does not exist
+        '''
+
+        return [ self._readObject(objectId) for objectId in objectIds ]
+
+    def get_object_subset(self, subObjectIds):
+        ''' Get the selected parts of objects.
+
+            Paths in the included list are separated by "/" and "[*]" selects every
+            element of a list (e.g. features/[*]/id).
+
+            @param subObjectIds List of object identity dictionaries with an included list of paths
+            @return List of object data dictionaries
+            @raise ObjectNotFoundError when an object does not exist
+        '''
+
+        objectList = list()
+        for subObjectId in subObjectIds:
+            objectData = self._readObject(subObjectId)
+            if 'included' in subObjectId:
+                tree = dict()
+                for path in subObjectId['included']:
+                    node = tree
+                    for part in path.strip('/').split('/'):
+                        node = node.setdefault(part, dict())
+                objectData['data'] = self._project(objectData['data'], tree)
+            objectList.append(objectData)
+        return objectList
+
+    def get_object_info(self, objectIds, includeMetadata):
+        ''' Get information about objects.
+
+            @param objectIds List of object identity dictionaries
+            @param includeMetadata 1 to include the user metadata of the objects
+            @return List of object info tuples
+            @raise ObjectNotFoundError when an object does not exist
+        '''
+
+        infoList = list()
+        for objectId in objectIds:
+            info = list(self._readObject(objectId)['info'])
+            if not includeMetadata:
+                info[10] = None
+            infoList.append(info)
+        return infoList
+
+    def save_objects(self, params):
+        ''' Save objects to a workspace.
+
+            @param params Dictionary with workspace name and list of object save data
+            @return List of object info tuples
+        '''
+
+        workspace = params['workspace']
+        folder = os.path.join(self.path, workspace)
+        if not os.path.exists(folder):
+            os.makedirs(folder, 0775)
+        infoList = list()
+        for objectSaveData in params['objects']:
+            name = objectSaveData['name']
+            version = self._latestVersion(workspace, name) + 1
+            text = json.dumps(objectSaveData['data'])
+            info = [ 0, name, objectSaveData['type'], time.strftime('%Y-%m-%dT%H:%M:%S+0000', time.gmtime()), version,
+                     'local', 0, workspace, hashlib.md5(text).hexdigest(), len(text), objectSaveData.get('meta', dict()) ]
+            objectData = { 'data': objectSaveData['data'], 'info': info, 'provenance': objectSaveData.get('provenance', list()) }
+            json.dump(objectData, open(os.path.join(folder, '%s.%d.json' %(name, version)), 'w'))
+            infoList.append(info)
+        return infoList
+
+    def _readObject(self, objectId):
+        ''' Read an object from its file.
+
+            @param objectId Object identity dictionary with a ref or workspace, name, and optional version
+            @return Object data dictionary
+            @raise ObjectNotFoundError when the object does not exist
+        '''
+
+        if 'ref' in objectId:
+            parts = objectId['ref'].split('/')
+            workspace = parts[0]
+            name = parts[1]
+            version = None
+            if len(parts) > 2:
+                version = int(parts[2])
+        else:
+            workspace = objectId['workspace']
+            name = objectId['name']
+            version = objectId.get('ver', None)
+        if version is None:
+            version = self._latestVersion(workspace, name)
+        path = os.path.join(self.path, workspace, '%s.%d.json' %(name, version))
+        if not os.path.exists(path):
+            raise ObjectNotFoundError('Object %s/%s/%d does not exist' %(workspace, name, version))
+        return json.load(open(path, 'r'))
+
+    def _latestVersion(self, workspace, name):
+        ''' Get the latest version number of an object.
+
+            @param workspace Name of workspace
+            @param name Name of object
+            @return Version number or 0 when the object does not exist
+        '''
+
+        folder = os.path.join(self.path, workspace)
+        if not os.path.exists(folder):
+            return 0
+        latest = 0
+        prefix = name + '.'
+        for filename in os.listdir(folder):
+            if filename.startswith(prefix) and filename.endswith('.json'):
+                version = filename[len(prefix):-5]
+                if version.isdigit():
+                    latest = max(latest, int(version))
+        return latest
+
+    def _project(self, value, tree):
+        ''' Select the parts of a value in a tree of included paths.
+
+            @param value Value from an object
+            @param tree Dictionary keyed by path element of the included paths below the element
+            @return Selected parts of the value
+        '''
+
+        if len(tree) == 0:
+            return value
+        if isinstance(value, list) and '[*]' in tree:
+            return [ self._project(element, tree['[*]']) for element in value ]
+        if isinstance(value, dict):
+            selected = dict()
+            for key in tree:
+                if key in value:
+                    selected[key] = self._project(value[key], tree[key])
+            return selected
+        return value
@@ -0,0 +1,294 @@
+#!/usr/bin/python
+
+''' Search programs used to find the hits for query proteins.
+
+    A search backend knows how to build the search database from the subsystem FASTA
+    file, which files make up the search database, how to run the search program, and
+    how to ask the search program for the columns of the search results.  The backend
+    is selected by name with the search_program configuration variable.  The blastp,
+    usearch, and stub backends are always available.  Other backends are added by
+    listing the Python modules that define them in the search_backend_modules
+    configuration variable.  A module registers a backend by calling
+    registerSearchBackend() with a subclass of SearchBackend when it is imported.
+'''
+
+import os
+import sys
+
+# Names of usearch user fields for BLAST output format 6 field names.
+UsearchFieldNames = { 'qseqid': 'query', 'sseqid': 'target', 'pident': 'id', 'length': 'alnlen', 'mismatch': 'mism', 'gapopen': 'opens',
+                      'qstart': 'qlo', 'qend': 'qhi', 'sstart': 'tlo', 'send': 'thi', 'evalue': 'evalue', 'bitscore': 'bits' }
+
+# Name of the subsystem FASTA file in the data folder.
+SubsystemFastaName = 'SUBSYSTEM_FASTA'
+
+# Dictionary keyed by name of search backend classes.
+SearchBackends = dict()
+
+# Exception thrown when a search backend is not available
+class SearchBackendError(Exception):
+    pass
+
+def registerSearchBackend(backendClass):
+    ''' Register a search backend so it can be selected with the search_program configuration variable.
+
+        @param backendClass Subclass of SearchBackend with the name of the backend in the name attribute
+        @return Nothing
+    '''
+
+    SearchBackends[backendClass.name] = backendClass
+    return
+
+def loadSearchBackendModules(config):
+    ''' Import the modules that register additional search backends.
+
+        @param config Dictionary mapping configuration variables to values
+        @return Nothing
+        @raise SearchBackendError when a module cannot be imported
+    '''
+
+    for moduleName in config.get('search_backend_modules', '').split(','):
+        moduleName = moduleName.strip()
+        if moduleName == '' or moduleName in sys.modules:
+            continue
+        try:
+            __import__(moduleName)
+        except ImportError as e:
+            raise SearchBackendError('Search backend module %s cannot be imported: %s' %(moduleName, e))
+    return
+
+def searchBackendClass(config):
+    ''' Get the class of the search backend selected by the configuration.
+
+        @param config Dictionary mapping configuration variables to values
+        @return Subclass of SearchBackend
+        @raise SearchBackendError when the search backend is not registered
+    '''
+
+    loadSearchBackendModules(config)
+    name = config['search_program']
+    if name not in SearchBackends:
+        raise SearchBackendError('Search program %s is not a registered search backend (available backends are %s)' \
+            %(name, ', '.join(sorted(SearchBackends.keys()))))
+    return SearchBackends[name]
+
+def getSearchBackend(config, dataFolderPath=None):
+    ''' Create the search backend selected by the configuration.
+
+        @param config Dictionary mapping configuration variables to values
+        @param dataFolderPath Path to directory with static database files or None to use the data_folder_path variable
+        @return SearchBackend object
+        @raise SearchBackendError when the search backend is not registered
+    '''
+
+    return searchBackendClass(config)(config, dataFolderPath)
+
+class SearchBackend:
+
+    # Name of the backend used as the value of the search_program configuration variable.
+    name = None
+
+    # True when the backend can search a database with a subset of the subsystem proteins
+    # and report the same E-values as searching the full database (needed by the search
+    # prefilter).
+    supportsCandidateDatabase = False
+
+    def __init__(self, config, dataFolderPath=None):
+        ''' Initialize the object.
+
+            @param config Dictionary mapping configuration variables to values
+            @param dataFolderPath Path to directory with static database files or None to use the data_folder_path variable
+        '''
+
+        if dataFolderPath is None:
+            dataFolderPath = config['data_folder_path']
+        self.dataFolderPath = dataFolderPath
+        self.databaseFolderPath = dataFolderPath
+        self.fastaFile = os.path.join(dataFolderPath, SubsystemFastaName)
+        self.programPath = config['search_program_path']
+        self.evalue = config['search_program_evalue']
+        return
+
+    def databaseFiles(self):
+        ''' Get the files that make up the search database built from the subsystem FASTA file.
+
+            @return Dictionary keyed by name of path to file
+        '''
+
+        return dict()
+
+    def setDatabaseFolder(self, databaseFolderPath):
+        ''' Search copies of the search database files in another directory.
+
+            @param databaseFolderPath Path to directory with copies of the files returned by databaseFiles()
+            @return Nothing
+        '''
+
+        self.databaseFolderPath = databaseFolderPath
+        return
+
+    def databaseCommand(self, fastaFile=None):
+        ''' Build the command to make a search database.
+
+            @param fastaFile Path to FASTA file with a subset of the subsystem proteins (the database
+                files are created next to it) or None for the subsystem FASTA file
+            @return List of arguments for the command or None when no database needs to be built
+        '''
+
+        return None
+
+    def searchCommand(self, queryFile, outputFile, threads, columns, maxTargets=0, database=None):
+        ''' Build the command to search for query proteins.
+
+            @param queryFile Path to fasta file with query proteins or None to read the query proteins from stdin
+            @param outputFile Path to output file or None to write the results to stdout
+            @param threads Number of threads used by the search program
+            @param columns List of BLAST output format 6 field names of the columns in the search results
+            @param maxTargets Maximum number of targets for each query protein (0 for no limit)
+            @param database Dictionary with path to FASTA file of a candidate database and number of
+                letters in the full database or None to search the full database
+            @return List of arguments for the command
+        '''
+
+        raise NotImplementedError('Search backend %s does not implement searchCommand()' %(self.name))
+
+    def searchParameters(self):
+        ''' Get the parameters that change the hits found by the search program.
+
+            @return Dictionary of parameter names and values
+        '''
+
+        return { 'search_program': self.name, 'search_program_evalue': self.evalue }
+
+class BlastpSearchBackend(SearchBackend):
+
+    name = 'blastp'
+    supportsCandidateDatabase = True
+
+    def __init__(self, config, dataFolderPath=None):
+        ''' Initialize the object.
+
+            The makeblastdb program must be in the same directory as the blastp program.
+
+            @param config Dictionary mapping configuration variables to values
+            @param dataFolderPath Path to directory with static database files or None to use the data_folder_path variable
+        '''
+
+        SearchBackend.__init__(self, config, dataFolderPath)
+        self.makeblastdbPath = os.path.join(os.path.dirname(self.programPath), 'makeblastdb')
+        return
+
+    def databaseFiles(self):
+        files = dict()
+        files['subsystem_otu_index_file'] = self.fastaFile + '.pin'
+        files['subsystem_otu_sequence_file'] = self.fastaFile + '.psq'
+        files['subsystem_otu_header_file'] = self.fastaFile + '.phr'
+        return files
+
+    def databaseCommand(self, fastaFile=None):
+        if fastaFile is None:
+            fastaFile = self.fastaFile
+        return [ self.makeblastdbPath, '-in', fastaFile, '-dbtype', 'prot' ]
+
+    def searchCommand(self, queryFile, outputFile, threads, columns, maxTargets=0, database=None):
+        if queryFile is None:
+            queryFile = '-'
+        databaseFile = os.path.join(self.databaseFolderPath, SubsystemFastaName)
+        if database is not None:
+            databaseFile = database['path']
+        args = [ self.programPath, '-query', queryFile, '-db', databaseFile,
+                 '-outfmt', '6 ' + ' '.join(columns), '-evalue', self.evalue,
+                 '-num_threads', threads ]
+        if maxTargets > 0:
+            args += [ '-max_target_seqs', str(maxTargets) ]
+        if database is not None:
+            # Use the size of the full database so E-values are the same as searching the full database.
+            args += [ '-dbsize', str(database['size']) ]
+        if outputFile is not None:
+            args += [ '-out', outputFile ]
+        return args
+
+class UsearchSearchBackend(SearchBackend):
+
+    name = 'usearch'
+
+    def __init__(self, config, dataFolderPath=None):
+        ''' Initialize the object.
+
+            @param config Dictionary mapping configuration variables to values
+            @param dataFolderPath Path to directory with static database files or None to use the data_folder_path variable
+        '''
+
+        SearchBackend.__init__(self, config, dataFolderPath)
+        self.accel = config['usearch_accel']
+        self.udbFile = os.path.join(self.dataFolderPath, 'SUBSYSTEM.udb')
+        return
+
+    def databaseFiles(self):
+        return { 'subsystem_udb_file': self.udbFile }
+
+    def databaseCommand(self, fastaFile=None):
+        if fastaFile is not None:
+            raise SearchBackendError('Search backend %s does not support candidate databases' %(self.name))
+        return [ self.programPath, '-makeudb_ublast', self.fastaFile, '-output', self.udbFile ]
+
+    def searchCommand(self, queryFile, outputFile, threads, columns, maxTargets=0, database=None):
+        if queryFile is None:
+            queryFile = '/dev/stdin'
+        if outputFile is None:
+            outputFile = '/dev/stdout'
+        args = [ self.programPath, '-ublast', queryFile,
+                 '-db', os.path.join(self.databaseFolderPath, os.path.basename(self.udbFile)),
+                 '-evalue', self.evalue,
+                 '-accel', self.accel,
+                 '-threads', threads,
+                 '-userout', outputFile,
+                 '-userfields', '+'.join([ UsearchFieldNames[name] for name in columns ]) ]
+        if maxTargets > 0:
+            args += [ '-maxhits', str(maxTargets) ]
+        return args
+
+    def searchParameters(self):
+        searchParams = SearchBackend.searchParameters(self)
+        searchParams['usearch_accel'] = self.accel
+        return searchParams
+
+class StubSearchBackend(BlastpSearchBackend):
+
+    ''' Search backend for testing that runs the StubSearch program.
+
+        The stub search program takes the same arguments as blastp and scores hits by the
+        number of shared 3-mers so the service can be tested without a search program
+        installed.  It searches the subsystem FASTA file directly so there are no search
+        database files to build.  The search_program_path variable is not used.
+    '''
+
+    name = 'stub'
+
+    def __init__(self, config, dataFolderPath=None):
+        ''' Initialize the object.
+
+            @param config Dictionary mapping configuration variables to values
+            @param dataFolderPath Path to directory with static database files or None to use the data_folder_path variable
+        '''
+
+        BlastpSearchBackend.__init__(self, config, dataFolderPath)
+        self.programPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'StubSearch.py')
+        return
+
+    def databaseFiles(self):
+        return dict()
+
+    def setDatabaseFolder(self, databaseFolderPath):
+        # The subsystem FASTA file is searched directly and it is not copied.
+        return
+
+    def databaseCommand(self, fastaFile=None):
+        return None
+
+    def searchCommand(self, queryFile, outputFile, threads, columns, maxTargets=0, database=None):
+        return [ sys.executable ] + BlastpSearchBackend.searchCommand(self, queryFile, outputFile, threads, columns, maxTargets, database)
+
+registerSearchBackend(BlastpSearchBackend)
+registerSearchBackend(UsearchSearchBackend)
+registerSearchBackend(StubSearchBackend)
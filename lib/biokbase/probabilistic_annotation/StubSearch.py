@@ -0,0 +1,119 @@
+#!/usr/bin/python
+
+''' Stub search program for testing.
+
+    The stub search program takes the same arguments as blastp and writes results in
+    BLAST output format 6 so the service can be tested without a search program
+    installed.  The database is a FASTA file that is read directly.  The bit score of a
+    hit is two times the number of distinct 3-mers shared by the query and the target
+    and the E-value is computed from the bit score, the length of the query, and the
+    number of letters in the database the same way as BLAST.  The results are not
+    biologically meaningful.
+'''
+
+import sys
+import argparse
+
+# Length of k-mers shared by a query and a target.
+KmerSize = 3
+
+# Bits of score for each shared k-mer.
+BitsPerKmer = 2.0
+
+def readFasta(fid):
+    ''' Read the sequences from a FASTA file.
+
+        @param fid File object of FASTA file
+        @return List of tuples with sequence ID and sequence
+    '''
+
+    sequences = list()
+    for line in fid:
+        line = line.strip('\r\n')
+        if line.startswith('>'):
+            sequences.append( [ line[1:].split()[0], list() ] )
+        elif len(sequences) > 0:
+            sequences[-1][1].append(line.strip())
+    return [ (seqId, ''.join(parts)) for seqId, parts in sequences ]
+
+def kmers(sequence):
+    ''' Get the distinct k-mers in a sequence.
+
+        @param sequence Protein sequence
+        @return Set of k-mers
+    '''
+
+    return set([ sequence[index:index+KmerSize] for index in range(len(sequence)-KmerSize+1) ])
+
+def hitFields(query, querySequence, target, targetSequence, numShared, evalue, bitscore):
+    ''' Get the values of the BLAST output format 6 fields for a hit.
+
+        @param query Query sequence ID
+        @param querySequence Query sequence
+        @param target Target sequence ID
+        @param targetSequence Target sequence
+        @param numShared Number of shared k-mers
+        @param evalue E-value of hit
+        @param bitscore Bit score of hit
+        @return Dictionary keyed by field name of field value
+    '''
+
+    length = min(len(querySequence), len(targetSequence))
+    return { 'qseqid': query, 'sseqid': target, 'pident': '%.2f' %(100.0 * numShared / max(len(kmers(querySequence)), 1)),
+             'length': str(length), 'mismatch': '0', 'gapopen': '0', 'qstart': '1', 'qend': str(length),
+             'sstart': '1', 'send': str(length), 'evalue': '%.2g' %(evalue), 'bitscore': '%.1f' %(bitscore) }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='StubSearch.py', description='Stub search program for testing with the same arguments as blastp.')
+    parser.add_argument('-query', help='path to FASTA file with query proteins or - for stdin', action='store', dest='query', required=True)
+    parser.add_argument('-db', help='path to FASTA file with target proteins', action='store', dest='db', required=True)
+    parser.add_argument('-outfmt', help='output format 6 and optional list of fields', action='store', dest='outfmt', default='6')
+    parser.add_argument('-evalue', help='maximum E-value of hits', action='store', type=float, dest='evalue', default=10.0)
+    parser.add_argument('-num_threads', help='number of threads (ignored)', action='store', dest='numThreads', default='1')
+    parser.add_argument('-max_target_seqs', help='maximum number of targets for each query', action='store', type=int, dest='maxTargets', default=0)
+    parser.add_argument('-dbsize', help='number of letters in database used to compute E-values', action='store', type=int, dest='dbSize', default=0)
+    parser.add_argument('-out', help='path to output file', action='store', dest='out', default=None)
+    args = parser.parse_args()
+
+    fields = args.outfmt.split()
+    if len(fields) == 0 or fields[0] != '6':
+        sys.stderr.write('Only output format 6 is supported\n')
+        exit(1)
+    columns = fields[1:]
+    if len(columns) == 0:
+        columns = [ 'qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore' ]
+
+    if args.query == '-':
+        queries = readFasta(sys.stdin)
+    else:
+        queries = readFasta(open(args.query, 'r'))
+    targets = readFasta(open(args.db, 'r'))
+    targetKmers = [ kmers(sequence) for targetId, sequence in targets ]
+    dbSize = args.dbSize
+    if dbSize <= 0:
+        dbSize = sum([ len(sequence) for targetId, sequence in targets ])
+
+    if args.out is None:
+        output = sys.stdout
+    else:
+        output = open(args.out, 'w')
+    for query, querySequence in queries:
+        queryKmers = kmers(querySequence)
+        hits = list()
+        for index in range(len(targets)):
+            numShared = len(queryKmers & targetKmers[index])
+            if numShared == 0:
+                continue
+            bitscore = BitsPerKmer * numShared
+            evalue = float(len(querySequence)) * dbSize * 2.0 ** (-bitscore)
+            if evalue <= args.evalue:
+                hits.append( (-bitscore, index, numShared, evalue) )
+        hits.sort()
+        if args.maxTargets > 0:
+            hits = hits[:args.maxTargets]
+        for negBitscore, index, numShared, evalue in hits:
+            target, targetSequence = targets[index]
+            values = hitFields(query, querySequence, target, targetSequence, numShared, evalue, -negBitscore)
+            output.write('\t'.join([ values[name] for name in columns ]) + '\n')
+    output.close()
+    exit(0)
@@ -1,8 +1,12 @@
 
-from biokbase.probabilistic_annotation.Helpers import make_object_identity, make_job_directory, timestamp, ProbAnnoType, ServiceVersion
-from biokbase.probabilistic_annotation.DataParser import DataParser
+from biokbase.probabilistic_annotation.Helpers import make_object_identity, make_job_directory, make_workspace_client, search_parameters, reference_search_parameters, prefilter_kmer_size, \
+    search_thread_count, hit_cutoffs, start_running_job, end_running_job, timestamp, HitCutoffParameters, \
+    compact_rolesets, expand_rolesets, probanno_rolesets, ProbAnnoType, ProbAnnoTypes, ServiceVersion, SaveBatchSize
+from biokbase.probabilistic_annotation.DataParser import DataParser, MakeblastdbError, MIN_EVALUE, SearchOutputColumns
+from biokbase.probabilistic_annotation.HitCache import HitCache, sequenceChecksum, searchNamespace
+from biokbase.probabilistic_annotation.ExactMatchIndex import ExactMatchIndex, ExactMatchIndexError
+from biokbase.probabilistic_annotation.JobMetrics import JobMetrics, MetricsFileName
 from biokbase.userandjobstate.client import UserAndJobState
-from biokbase.workspace.client import Workspace
 from biokbase import log
 from urllib2 import HTTPError
 import subprocess
@@ -12,6 +16,23 @@ import shutil
 import traceback
 import time
 import math
+import heapq
+import threading
+import sqlite3
+import tempfile
+from collections import OrderedDict
+
+# NumPy is optional and only needed for the vectorized marble-picking engine.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Minimum number of query proteins in each shard when the search is sharded.
+MinProteinsPerShard = 250
+
+# Paths to the parts of a Genome object used by annotate jobs.
+GenomeIncludedPaths = [ 'id', 'features/[*]/id', 'features/[*]/protein_translation' ]
 
 # Exception thrown when no features are found in Genome object
 class NoFeaturesError(Exception):
@@ -37,6 +58,28 @@ class NoGeneIdsError(Exception):
 
 class ProbabilisticAnnotationWorker:
 
+    def runJob(self, job):
+
+        ''' Run a job using the method that created the job.
+
+            The job is recorded as running on the local host while it runs so jobs that
+            select the number of search threads automatically share the CPUs.
+
+            @param job Job dictionary created by server's annotate() or annotate_batch() function
+            @return Nothing (although job is marked as complete)
+        '''
+
+        workDirectory = job['config']['work_folder_path']
+        start_running_job(workDirectory, job['id'])
+        try:
+            if job.get('method', 'annotate') == 'annotate_batch':
+                self.runAnnotateBatch(job)
+            else:
+                self.runAnnotate(job)
+        finally:
+            end_running_job(workDirectory, job['id'])
+        return
+
     def runAnnotate(self, job):
 
         ''' Run an annotate job to create a ProbAnno typed object.
@@ -62,6 +105,8 @@ class ProbabilisticAnnotationWorker:
             self.logger.set_log_level(log.DEBUG)
         self.ctx = job["context"]
         self.config = job['config']
+        self._applyInputParameters(input)
+        self.metrics = JobMetrics()
 
         # Create a DataParser object for working with the static database files.
         self.dataParser = DataParser(self.config)
@@ -83,9 +128,10 @@ class ProbabilisticAnnotationWorker:
                 ujsClient.update_job_progress(job['id'], self.ctx['token'], 'getting genome object', 1, timestamp(3600))
             except:
                 pass
-            wsClient = Workspace(self.config["workspace_url"], token=self.ctx['token'])
+            self.metrics.startStage('get_genome')
+            wsClient = make_workspace_client(self.config["workspace_url"], token=self.ctx['token'])
             genomeObjectId = make_object_identity(input["genome_workspace"], input["genome"])
-            objectList = wsClient.get_objects( [ genomeObjectId ] )
+            objectList = self._getGenomeObjects( [ genomeObjectId ], wsClient)
             genomeObject = objectList[0]
             
             # Convert Genome object to fasta file.
@@ -93,28 +139,25 @@ class ProbabilisticAnnotationWorker:
                 ujsClient.update_job_progress(job['id'], self.ctx['token'], 'converting Genome object to fasta file', 1, timestamp(3600))
             except:
                 pass
-            fastaFile = self._genomeToFasta(input, genomeObject, workFolder)
-            
-            # Run blast using the fasta file.
-            try:
-                ujsClient.update_job_progress(job['id'], self.ctx['token'], 'running blast', 1, timestamp(3600))
-            except:
-                pass
-            blastResultFile = self._runBlast(input, fastaFile, workFolder)
-            
-            # Calculate roleset probabilities.
-            try:
-                ujsClient.update_job_progress(job['id'], self.ctx['token'], 'calculating roleset probabilities', 1, timestamp(300))
-            except:
-                pass
-            rolestringTuples = self._rolesetProbabilitiesMarble(input, blastResultFile, workFolder)
-            
+            self.metrics.startStage('convert_genome')
+            proteins = self._genomeProteins(input, genomeObject)
+
+            # Reuse the roleset probabilities from the previous version of the ProbAnno object
+            # for the features that did not change.
+            previousTuples = dict()
+            if input.get('incremental', False):
+                self.metrics.startStage('get_previous_probanno')
+                previousTuples = self._previousRolesetProbabilities(input, genomeObject, proteins, wsClient)
+            rolestringTuples = self._rolesetProbabilities(input, proteins, workFolder, ujsClient, job['id'])
+            rolestringTuples.update(previousTuples)
+
             # Build ProbAnno object and store in the specified workspace.
             try:
                 ujsClient.update_job_progress(job['id'], self.ctx['token'], 'building ProbAnno object', 1, timestamp(120))
             except:
                 pass
-            output = self._buildProbAnnoObject(input, genomeObject, blastResultFile, rolestringTuples, workFolder, wsClient)
+            self.metrics.startStage('build_object')
+            output = self._buildProbAnnoObject(input, genomeObject, rolestringTuples, workFolder, wsClient)
 
             # Mark the job as done.
             status = "done"
@@ -127,107 +170,1036 @@ class ProbabilisticAnnotationWorker:
             status = "failed"
             self._log(log.ERR, 'Job '+job['id']+' failed for genome '+input['genome']+' to probanno '+input['probanno'])
         
-        # Mark the job as complete with the given status.
-        ujsClient.complete_job(job['id'], self.ctx['token'], status, tb, { })
+        # Mark the job as complete with the given status and the metrics of the job.
+        results = self._saveMetrics(job)
+        ujsClient.complete_job(job['id'], self.ctx['token'], status, tb, results)
 
-        # Remove the temporary work directory.
+        # Remove the temporary files from the work directory.
         if self.logger.get_log_level() < log.DEBUG2 and status == 'done':
             try:
-                shutil.rmtree(workFolder)
+                self._cleanWorkFolder(workFolder)
             except OSError:
                 # For some reason deleting the directory was failing in production. Rather than have all jobs look like they failed
                 # I catch and log the exception here (since the user still gets the same result if the directory remains intact)
-                msg = 'Unable to delete temporary directory %s\n' %(workFolder)
+                msg = 'Unable to delete temporary files in %s\n' %(workFolder)
                 sys.stderr.write('WARNING: '+msg)
                 self._log(log.WARNING, msg)
 
         return
         
-    def _genomeToFasta(self, input, genomeObject, workFolder):
+    def runAnnotateBatch(self, job):
+
+        ''' Run an annotate_batch job to create a ProbAnno typed object for each genome in a batch.
+
+            The steps are the same as for an annotate job but the query proteins from all
+            of the Genome objects are searched for in one search so the fixed costs of a
+            job (e.g. loading the subsystem BLAST database) are paid once for the batch.
+            The search results are split back to the genomes using the genome index that
+            prefixes each query protein ID and the ProbAnno objects are saved with one
+            save_objects() call for each workspace and group of SaveBatchSize objects.
+
+            @param job Job dictionary created by server's annotate_batch() function
+            @return Nothing (although job is marked as complete)
+        '''
+
+        # The input parameters and user context for annotate_batch() were stored in the job data for the job.
+        input = job["input"]
+        if input['verbose']:
+            self.logger.set_log_level(log.DEBUG)
+        self.ctx = job["context"]
+        self.config = job['config']
+        self._applyInputParameters(input)
+        self.metrics = JobMetrics()
+        genomes = input['genomes']
+
+        # Create a DataParser object for working with the static database files.
+        self.dataParser = DataParser(self.config)
+
+        status = None
+
+        try:
+            # Make sure the database files are available.
+            self.dataParser.checkIfDatabaseFilesExist()
 
-        ''' Convert a Genome object into an amino-acid FASTA file (for BLAST purposes).
+            # Make sure the job directory exists.
+            workFolder = make_job_directory(self.config['work_folder_path'], job['id'])
+
+            # Create a user and job state client and authenticate as the user.
+            ujsClient = UserAndJobState(self.config['userandjobstate_url'], token=self.ctx['token'])
+
+            # Get the Genome objects from the specified workspaces.
+            try:
+                ujsClient.update_job_progress(job['id'], self.ctx['token'], 'getting %d genome objects' %(len(genomes)), 1, timestamp(3600))
+            except:
+                pass
+            self.metrics.startStage('get_genome')
+            wsClient = make_workspace_client(self.config["workspace_url"], token=self.ctx['token'])
+            genomeObjectIds = [ make_object_identity(entry["genome_workspace"], entry["genome"]) for entry in genomes ]
+            genomeObjects = self._getGenomeObjects(genomeObjectIds, wsClient)
+
+            # Combine the proteins from all of the Genome objects.  Identical proteins in
+            # different genomes are only searched for once.
+            try:
+                ujsClient.update_job_progress(job['id'], self.ctx['token'], 'converting Genome objects to fasta file', 1, timestamp(3600))
+            except:
+                pass
+            self.metrics.startStage('convert_genome')
+            proteins = OrderedDict()
+            for index in range(len(genomes)):
+                for checksum, protein in self._genomeProteins(genomes[index], genomeObjects[index], '%d.' %(index)).iteritems():
+                    if checksum in proteins:
+                        proteins[checksum][1].extend(protein[1])
+                    else:
+                        proteins[checksum] = protein
+            searchInput = { 'genome': 'batch', 'search_shards': input.get('search_shards', None) }
+            rolestringTuples = self._rolesetProbabilities(searchInput, proteins, workFolder, ujsClient, job['id'])
+
+            # Split the roleset probabilities back to the genomes.
+            genomeRolestringTuples = [ dict() for index in range(len(genomes)) ]
+            for query in rolestringTuples:
+                index, featureId = query.split('.', 1)
+                genomeRolestringTuples[int(index)][featureId] = rolestringTuples[query]
+
+            # Build the ProbAnno objects.
+            self.metrics.startStage('build_object')
+            saveData = dict()
+            for index in range(len(genomes)):
+                try:
+                    ujsClient.update_job_progress(job['id'], self.ctx['token'],
+                        'building ProbAnno object %d of %d' %(index+1, len(genomes)), 1, timestamp(120))
+                except:
+                    pass
+                entry = genomes[index]
+                entryInput = dict(entry)
+                entryInput['verbose'] = input['verbose']
+                objectSaveData = self._makeProbAnnoObject(entryInput, genomeObjects[index], genomeRolestringTuples[index], 'annotate_batch')
+                saveData.setdefault(entry['probanno_workspace'], list()).append(objectSaveData)
+
+            # Store the ProbAnno objects in the specified workspaces.
+            try:
+                ujsClient.update_job_progress(job['id'], self.ctx['token'], 'saving %d ProbAnno objects' %(len(genomes)), 1, timestamp(600))
+            except:
+                pass
+            self.metrics.startStage('save_object')
+            for workspace in sorted(saveData.keys()):
+                objects = saveData[workspace]
+                for start in range(0, len(objects), SaveBatchSize):
+                    self._saveObjects(workspace, objects[start:start+SaveBatchSize], wsClient)
+
+            # Mark the job as done.
+            status = "done"
+            tb = None
+            self._log(log.INFO, 'Job %s finished for batch of %d genomes' %(job['id'], len(genomes)))
+
+        except:
+            tb = traceback.format_exc()
+            sys.stderr.write('\n'+tb)
+            status = "failed"
+            self._log(log.ERR, 'Job %s failed for batch of %d genomes' %(job['id'], len(genomes)))
+
+        # Mark the job as complete with the given status and the metrics of the job.
+        results = self._saveMetrics(job)
+        ujsClient.complete_job(job['id'], self.ctx['token'], status, tb, results)
+
+        # Remove the temporary files from the work directory.
+        if self.logger.get_log_level() < log.DEBUG2 and status == 'done':
+            try:
+                self._cleanWorkFolder(workFolder)
+            except OSError:
+                msg = 'Unable to delete temporary files in %s\n' %(workFolder)
+                sys.stderr.write('WARNING: '+msg)
+                self._log(log.WARNING, msg)
+
+        return
+
+    def _applyInputParameters(self, input):
+
+        ''' Override configuration variables with the input parameters of the job.
+
+            @param input Dictionary of input parameters to annotate() or annotate_batch() function
+            @return Nothing
+        '''
+
+        for name in HitCutoffParameters:
+            if input.get(name, None) is not None:
+                self.config[name] = str(input[name])
+        return
+
+    def _rolesetProbabilities(self, input, proteins, workFolder, ujsClient, jobId):
+
+        ''' Search for the query proteins and calculate the roleset probabilities for each feature.
 
             @param input Dictionary of input parameters to annotate() function
-            @param genomeObject Genome typed object from workspace
+            @param proteins Ordered dictionary returned by _genomeProteins()
             @param workFolder Path to directory in which to store temporary files
-            @return Path to fasta file with query proteins
+            @param ujsClient User and job state client for updating the progress of the job
+            @param jobId Job identifier
+            @return Dictionary keyed by query gene of list of tuples with roleset and likelihood
+            @raise BlastError, BadLikelihoodError, NoTargetIdError
+        '''
+
+        self.metrics.startStage('lookup_hits')
+        self.hitCache = self._openHitCache()
+        try:
+            exactHits = self._lookupExactMatches(proteins)
+            cachedHits = self._lookupCachedHits(proteins, exactHits)
+            cachedHits.update(exactHits)
+            queries = self._genomeToFasta(input, proteins, cachedHits)
+            searchedHits = None
+            if self.hitCache is not None:
+                searchedHits = dict()
+
+            # Select candidate targets for the query proteins when the search prefilter is turned on.
+            self.searchDatabase = None
+            if len(queries) > 0 and prefilter_kmer_size(self.config) > 0:
+                self.metrics.startStage('prefilter')
+                self.searchDatabase = self._prefilterDatabase(input, queries, workFolder)
+
+            if len(queries) == 0:
+                # Every protein was found in the exact match index or the hit cache so there is
+                # nothing to search for.
+                rolestringTuples = dict()
+
+            elif self.config['search_output_mode'] == 'stream':
+                # Run blast using the fasta file and calculate roleset probabilities for each
+                # query protein as the results are produced.
+                try:
+                    ujsClient.update_job_progress(jobId, self.ctx['token'], 'running blast and calculating roleset probabilities', 2, timestamp(3600))
+                except:
+                    pass
+                self.metrics.startStage('search_and_marble')
+                rolestringTuples = self._runBlastStream(input, queries, workFolder, searchedHits)
+
+            else:
+                # Run blast using the fasta file.
+                try:
+                    ujsClient.update_job_progress(jobId, self.ctx['token'], 'running blast', 1, timestamp(3600))
+                except:
+                    pass
+                self.metrics.startStage('search')
+                blastResultFile = self._runBlast(input, queries, workFolder)
+
+                # Calculate roleset probabilities.
+                try:
+                    ujsClient.update_job_progress(jobId, self.ctx['token'], 'calculating roleset probabilities', 1, timestamp(300))
+                except:
+                    pass
+                self.metrics.startStage('marble')
+                if self.config['marble_engine'] == 'numpy' and numpy is None:
+                    self._log(log.WARNING, 'NumPy is not available so the python marble-picking engine is used')
+                if self.config['marble_engine'] == 'numpy' and numpy is not None:
+                    rolestringTuples = self._rolesetProbabilitiesMarbleVectorized(input, blastResultFile, workFolder, searchedHits)
+                else:
+                    rolestringTuples = self._rolesetProbabilitiesMarble(input, blastResultFile, workFolder, searchedHits)
+
+            # Add the roleset probabilities for proteins that were not searched for and save
+            # the new search results in the hit cache.
+            self.metrics.startStage('store_hits')
+            self._addUnsearchedProteins(input, proteins, cachedHits, rolestringTuples, workFolder)
+            self._storeCachedHits(proteins, cachedHits, searchedHits)
+
+        finally:
+            if self.hitCache is not None:
+                self.hitCache.close()
+                self.hitCache = None
+            self.searchDatabase = None
+
+        return rolestringTuples
+
+    def _getGenomeObjects(self, objectIds, wsClient):
+
+        ''' Get Genome objects from the workspace.
+
+            When genome_fetch_mode is "subset", only the parts of the Genome objects used by
+            annotate jobs (feature IDs and protein sequences) are fetched and the contigs,
+            DNA sequences, and other feature fields are never transferred from the workspace.
+
+            @param objectIds List of object identity dictionaries
+            @param wsClient Workspace client object
+            @return List of object data dictionaries
+        '''
+
+        if self.config['genome_fetch_mode'] == 'subset':
+            subObjectIds = list()
+            for objectId in objectIds:
+                subObjectId = dict(objectId)
+                subObjectId['included'] = GenomeIncludedPaths
+                subObjectIds.append(subObjectId)
+            return wsClient.get_object_subset(subObjectIds)
+        return wsClient.get_objects(objectIds)
+
+    def _genomeProteins(self, input, genomeObject, prefix=''):
+
+        ''' Get the unique protein sequences from a Genome object.
+
+            Features with identical protein sequences only need to be searched for once.
+            The first feature with a sequence is the representative used as the query
+            for the sequence.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param genomeObject Genome typed object from workspace
+            @param prefix String added to the start of each feature ID to make it unique in a batch
+            @return Ordered dictionary keyed by sequence checksum of a tuple with the
+                sequence and list of feature IDs with the sequence
             @raise NoFeaturesError
         '''
 
         # Make sure the Genome object has features.
         if "features" not in genomeObject["data"]:
             raise NoFeaturesError("The input Genome object %s/%s has no features. Did you forget to run annotate_genome?\n" %(input["genome_workspace"], input["genome"]))
-    
-        # Open the fasta file.
-        fastaFile = os.path.join(workFolder, "%s.faa" %(input["genome"]))
-        fid = open(fastaFile, "w")
-        sys.stderr.write('Creating fasta file %s...' %(fastaFile))
-        
-        # Run the list of features to build the fasta file.
-        numProteins = 0
-        features = genomeObject["data"]["features"]
-        for feature in features:
+
+        proteins = OrderedDict()
+        for feature in genomeObject["data"]["features"]:
             # Not a protein-encoding gene
             if "protein_translation" not in feature:
                 continue
-            fid.write('>%s\n%s\n' %(feature['id'], feature['protein_translation']))
-            numProteins += 1
-        
+            checksum = sequenceChecksum(feature['protein_translation'])
+            if checksum in proteins:
+                proteins[checksum][1].append(prefix+feature['id'])
+            else:
+                proteins[checksum] = ( feature['protein_translation'], [ prefix+feature['id'] ] )
+        return proteins
+
+    def _previousRolesetProbabilities(self, input, genomeObject, proteins, wsClient):
+
+        ''' Get the roleset probabilities for unchanged features from the previous version of the ProbAnno object.
+
+            A feature is unchanged when the Genome object the previous version was built
+            from has a feature with the same ID and protein sequence.  The previous results
+            are only used when they were calculated with the same static database files
+            and parameters.  The unchanged features are removed from the proteins so they
+            are not searched for.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param genomeObject Genome typed object from workspace
+            @param proteins Ordered dictionary returned by _genomeProteins() (updated)
+            @param wsClient Workspace client object
+            @return Dictionary keyed by query gene of list of tuples with roleset and likelihood
+                for the unchanged features
+        '''
+
+        # Get the previous version of the ProbAnno object.
+        try:
+            previousObject = wsClient.get_objects( [ make_object_identity(input['probanno_workspace'], input['probanno']) ] )[0]
+        except Exception as e:
+            self._log(log.INFO, 'Searching for all proteins since previous ProbAnno object %s/%s is not available: %s' \
+                %(input['probanno_workspace'], input['probanno'], e))
+            return dict()
+
+        # Make sure the previous results were calculated the same way.
+        if previousObject['info'][2] not in ProbAnnoTypes:
+            self._log(log.INFO, 'Searching for all proteins since previous ProbAnno object type %s is not supported' %(previousObject['info'][2]))
+            return dict()
+        dbChecksum, annotationChecksum = self._annotationChecksums()
+        metadata = previousObject['info'][10]
+        if metadata is None or metadata.get('static_data_checksum', None) != dbChecksum or \
+                metadata.get('annotation_checksum', None) != annotationChecksum:
+            self._log(log.INFO, 'Searching for all proteins since static database files or parameters changed after previous ProbAnno object was built')
+            return dict()
+
+        # Get the Genome object the previous version was built from.
+        try:
+            previousGenomeRef = previousObject['provenance'][0]['input_ws_objects'][0]
+            previousGenome = self._getGenomeObjects( [ { 'ref': previousGenomeRef } ], wsClient)[0]
+        except Exception as e:
+            self._log(log.INFO, 'Searching for all proteins since previous Genome object is not available: %s' %(e))
+            return dict()
+
+        # Find the features with the same ID and sequence.
+        previousChecksums = dict()
+        for feature in previousGenome['data'].get('features', []):
+            if 'protein_translation' in feature:
+                previousChecksums[feature['id']] = sequenceChecksum(feature['protein_translation'])
+        roles, rolesets, featureProbs = probanno_rolesets(previousObject, self.config['separator'])
+        previousProbs = expand_rolesets(roles, rolesets, featureProbs, self.config['separator'])
+        previousTuples = dict()
+        numUnchanged = 0
+        for checksum in proteins.keys():
+            sequence, featureIds = proteins[checksum]
+            changedIds = list()
+            for featureId in featureIds:
+                if previousChecksums.get(featureId, None) == checksum:
+                    # A feature without results in the previous version had no hits.
+                    if featureId in previousProbs:
+                        previousTuples[featureId] = [ tuple(t) for t in previousProbs[featureId] ]
+                    numUnchanged += 1
+                else:
+                    changedIds.append(featureId)
+            if len(changedIds) == 0:
+                del proteins[checksum]
+            else:
+                proteins[checksum] = ( sequence, changedIds )
+
+        message = 'Reused results for %d unchanged features from previous ProbAnno object built from %s' %(numUnchanged, previousGenomeRef)
+        sys.stderr.write(message+'\n')
+        self._log(log.INFO, message)
+        return previousTuples
+
+    def _genomeToFasta(self, input, proteins, cachedHits):
+
+        ''' Convert the proteins from a Genome object into amino-acid FASTA records (for BLAST purposes).
+
+            Only the representative feature of each unique sequence that was not found in
+            the exact match index or the hit cache is a query protein.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param proteins Ordered dictionary returned by _genomeProteins()
+            @param cachedHits Dictionary keyed by sequence checksum of hits found in the exact match index or hit cache
+            @return List of fasta records with query proteins
+        '''
+
+        queries = list()
+        for checksum in proteins:
+            if checksum in cachedHits:
+                continue
+            sequence, featureIds = proteins[checksum]
+            queries.append('>%s\n%s\n' %(featureIds[0], sequence))
+        self._log(log.DEBUG, 'Found %d query proteins for genome %s' %(len(queries), input['genome']))
+        return queries
+
+    def _writeQueryFile(self, input, queries, workFolder, index, numShards):
+
+        ''' Write fasta records with query proteins to a file.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param queries List of fasta records with query proteins
+            @param workFolder Path to directory in which to store temporary files
+            @param index Index of the shard with the query proteins
+            @param numShards Number of shards the query proteins are split across
+            @return Path to fasta file with query proteins
+        '''
+
+        if numShards == 1:
+            fastaFile = os.path.join(workFolder, "%s.faa" %(input["genome"]))
+        else:
+            fastaFile = os.path.join(workFolder, "%s.%d.faa" %(input["genome"], index))
+        sys.stderr.write('Creating fasta file %s...' %(fastaFile))
+        fid = open(fastaFile, "w")
+        fid.writelines(queries)
         fid.close()
-        sys.stderr.write('wrote %d protein sequences\n' %(numProteins))
-        self._log(log.DEBUG, 'Wrote %d protein sequences to %s' %(numProteins, fastaFile))
+        sys.stderr.write('wrote %d protein sequences\n' %(len(queries)))
+        self._log(log.DEBUG, 'Wrote %d protein sequences to %s' %(len(queries), fastaFile))
         return fastaFile
-        
-    def _runBlast(self, input, queryFile, workFolder):
+
+    def _openHitCache(self):
+
+        ''' Open the hit cache for the current static database files and search parameters.
+
+            @return HitCache object or None if the hit cache is turned off or cannot be opened
+        '''
+
+        maxSize = int(self.config['hit_cache_size']) * 1024 * 1024
+        path = self.config['hit_cache_path']
+        if maxSize <= 0 or not path:
+            return None
+
+        namespace = searchNamespace(self.dataParser.getStaticDataChecksum(), self._searchParameters())
+        try:
+            return HitCache(path, maxSize, namespace)
+        except sqlite3.Error as e:
+            self._log(log.WARNING, 'Hit cache %s is not used because it could not be opened: %s' %(path, e))
+            return None
+
+    def _searchParameters(self):
+
+        ''' Get the parameters that change the hits found by the search program.
+
+            @return Dictionary of parameter names and values
+        '''
+
+        return search_parameters(self.config)
+
+    def _annotationChecksums(self):
+
+        ''' Get the checksums that identify how roleset probabilities are calculated.
+
+            @return Checksum of the static database files, checksum of the static database
+                files and the parameters that change the roleset probabilities
+        '''
+
+        dbChecksum = self.dataParser.getStaticDataChecksum()
+        params = self._searchParameters()
+        params['pseudo_count'] = self.config['pseudo_count']
+        if hit_cutoffs(self.config)[1] > 0.0:
+            params['min_relative_score'] = self.config['min_relative_score']
+        return dbChecksum, searchNamespace(dbChecksum, params)
+
+    def _lookupExactMatches(self, proteins):
+
+        ''' Find the hits for the proteins that are identical to reference proteins in the exact match index.
+
+            @param proteins Ordered dictionary returned by _genomeProteins()
+            @return Dictionary keyed by sequence checksum of list of tuples with target ID and score
+        '''
+
+        params = self.dataParser.getExactMatchIndexParameters()
+        if params is None:
+            return dict()
+        if params != reference_search_parameters(self.config):
+            self._log(log.NOTICE, 'Exact match index is not used because it was built with different search parameters')
+            return dict()
+        path = self.dataParser.IndexFiles['subsystem_exact_match_file']
+        try:
+            index = ExactMatchIndex(path)
+            try:
+                exactHits = index.lookup(proteins.keys())
+            finally:
+                index.close()
+        except (ExactMatchIndexError, sqlite3.Error) as e:
+            self._log(log.WARNING, 'Exact match index %s is not used because lookup failed: %s' %(path, e))
+            return dict()
+
+        numFeatures = sum([ len(proteins[checksum][1]) for checksum in exactHits ])
+        message = 'Exact match index resolved %d unique proteins from %d protein features without searching' %(len(exactHits), numFeatures)
+        sys.stderr.write(message+'\n')
+        self._log(log.INFO, message)
+        return exactHits
+
+    def _lookupCachedHits(self, proteins, exactHits):
+
+        ''' Find the hits for the proteins that are in the hit cache.
+
+            @param proteins Ordered dictionary returned by _genomeProteins()
+            @param exactHits Dictionary keyed by sequence checksum of hits found in the exact match index
+            @return Dictionary keyed by sequence checksum of list of tuples with target ID and score
+        '''
+
+        if self.hitCache is None:
+            return dict()
+        try:
+            return self.hitCache.lookup([ checksum for checksum in proteins if checksum not in exactHits ])
+        except sqlite3.Error as e:
+            self._log(log.WARNING, 'Hit cache %s is not used because lookup failed: %s' %(self.hitCache.path, e))
+            self.hitCache.close()
+            self.hitCache = None
+            return dict()
+
+    def _storeCachedHits(self, proteins, cachedHits, searchedHits):
+
+        ''' Save the hits for the proteins that were searched for in the hit cache and report the cache counters.
+
+            @param proteins Ordered dictionary returned by _genomeProteins()
+            @param cachedHits Dictionary keyed by sequence checksum of hits found in the exact match index or hit cache
+            @param searchedHits Dictionary keyed by query gene of list of tuples with target ID and score
+                from the search results or None when the hit cache is turned off
+            @return Nothing
+        '''
+
+        numFeatures = sum([ len(proteins[checksum][1]) for checksum in proteins ])
+        if self.hitCache is None:
+            self._log(log.INFO, 'Searched for %d unique proteins from %d protein features' %(len(proteins) - len(cachedHits), numFeatures))
+            return
+
+        # A protein without any hits is saved with an empty list so it is not searched for again.
+        checksumToHits = dict()
+        for checksum in proteins:
+            if checksum not in cachedHits:
+                checksumToHits[checksum] = searchedHits.get(proteins[checksum][1][0], [])
+        try:
+            self.hitCache.store(checksumToHits)
+        except sqlite3.Error as e:
+            self._log(log.WARNING, 'Failed to save hits to hit cache %s: %s' %(self.hitCache.path, e))
+
+        stats = self.hitCache.statistics()
+        message = 'Hit cache %d hits, %d misses, %d added, %d evicted for %d unique proteins from %d protein features' \
+            %(stats['hits'], stats['misses'], stats['added'], stats['evicted'], len(proteins), numFeatures)
+        sys.stderr.write(message+'\n')
+        self._log(log.INFO, message)
+        return
+
+    def _addUnsearchedProteins(self, input, proteins, cachedHits, rolestringTuples, workFolder):
+
+        ''' Add the roleset probabilities for proteins that were not searched for.
+
+            The roleset probabilities for proteins found in the exact match index or the hit
+            cache are calculated from the known hits after applying the per-query cutoffs.
+            Features with the same sequence as a representative feature get the roleset
+            probabilities of the representative.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param proteins Ordered dictionary returned by _genomeProteins()
+            @param cachedHits Dictionary keyed by sequence checksum of hits found in the exact match index or hit cache
+            @param rolestringTuples Dictionary keyed by query gene of list of tuples with roleset and likelihood (updated)
+            @param workFolder Path to directory in which to store temporary files
+            @return Nothing
+            @raise BadLikelihoodError, NoTargetIdError
+        '''
+
+        targetIdToRoleString = self.dataParser.getTargetRolestrings()
+        maxTargets, minRelativeScore = hit_cutoffs(self.config)
+        numAdded = 0
+        for checksum in proteins:
+            featureIds = proteins[checksum][1]
+            if checksum in cachedHits and len(cachedHits[checksum]) > 0:
+                hits, numDropped, droppedScore = self.dataParser.truncateHits(cachedHits[checksum], maxTargets, minRelativeScore)
+                maxscore, rolestringToScore = self._rolestringScores(hits, targetIdToRoleString)
+                self._recordHitCutoffs(1, maxscore, rolestringToScore, len(hits), numDropped, droppedScore)
+                rolestringTuples[featureIds[0]] = self._rolestringLikelihoods(featureIds[0], maxscore, rolestringToScore)
+                numAdded += 1
+            if featureIds[0] in rolestringTuples:
+                for featureId in featureIds[1:]:
+                    rolestringTuples[featureId] = list(rolestringTuples[featureIds[0]])
+                    numAdded += 1
+
+        # Save the complete set of roleset probabilities when debug is turned on.
+        if numAdded > 0:
+            self._saveRolesetProbabilities(input, rolestringTuples, workFolder)
+        return
+
+    def _runBlast(self, input, queries, workFolder):
 
         ''' A simplistic wrapper to BLAST the query proteins against the subsystem proteins.
 
+            When the search is sharded, a search is run concurrently for each shard of the
+            query proteins and the results are merged in shard order into one output file.
+
             @param input Dictionary of input parameters to annotate() function
-            @param queryFile Path to fasta file with query proteins
+            @param queries List of fasta records with query proteins
             @param workFolder Path to directory in which to store temporary files
             @return Path to output file from BLAST
             @raise BlastError
         '''
 
-        # Generate path to output file.  Output format 6 is tab-delimited format.
+        # Generate path to output file.  Output format 6 is tab-delimited format with the
+        # columns used to score hits.
         blastResultFile = os.path.join(workFolder, "%s.blastout" %(input["genome"]))
 
-        # Build the command based on the configured search program.
-        if self.config['search_program'] == 'usearch':
-            args = [ self.config['search_program_path'], '-ublast', queryFile,
-                     '-db', self.dataParser.SearchFiles['subsystem_udb_file'],
-                     '-evalue', self.config['search_program_evalue'],
-                     '-accel', self.config['usearch_accel'],
-                     '-threads', self.config['blast_threads'],
-                     '-blast6out', blastResultFile ]
+        # Split the query proteins into shards and generate a path to the output file for each shard.
+        shards = self._shardQueries(input, queries)
+        if len(shards) == 1:
+            outputFiles = [ blastResultFile ]
         else:
-            args = [ self.config['search_program_path'], "-query", queryFile,
-                     "-db", self.dataParser.DataFiles["subsystem_otu_fasta_file"],
-                     "-outfmt", "6", "-evalue", self.config['search_program_evalue'],
-                     "-num_threads", self.config["blast_threads"],
-                     "-out", blastResultFile ]
+            outputFiles = [ '%s.%d' %(blastResultFile, index) for index in range(len(shards)) ]
+
+        # Run the commands to search for proteins against subsystem proteins.
+        searches = self._startSearches(input, shards, workFolder, outputFiles)
+        try:
+            for search in searches:
+                self._waitForSearch(search)
+        except:
+            self._stopSearches(searches)
+            raise
+
+        # Merge the output files from the shards in a stable order.
+        if len(outputFiles) > 1:
+            fid = open(blastResultFile, 'w')
+            for outputFile in outputFiles:
+                shutil.copyfileobj(open(outputFile, 'r'), fid)
+                os.remove(outputFile)
+            fid.close()
+        sys.stderr.write('done\n')
+
+        return blastResultFile
+
+    def _prefilterDatabase(self, input, queries, workFolder):
+        ''' Build a search database with the candidate targets of the query proteins.
+
+            The k-mer prefilter selects the subsystem proteins that share at least
+            prefilter_min_kmers k-mers with a query protein, keeping the
+            prefilter_max_candidates proteins with the most shared k-mers for each query
+            protein.  The search program then only searches the candidate targets.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param queries List of fasta records with query proteins
+            @param workFolder Path to directory in which to store temporary files
+            @return Dictionary with path to candidate database and number of letters in the full
+                database or None when the full database is searched
+        '''
+
+        kmerSize = prefilter_kmer_size(self.config)
+        if kmerSize == 0:
+            return None
+        kmerIndex = self.dataParser.readKmerIndex(kmerSize)
+        if kmerIndex is None:
+            self._log(log.WARNING, 'Search prefilter is not used because the k-mer index is missing or not current')
+            return None
+        try:
+            candidateIds = self._prefilterCandidates(queries, kmerIndex, kmerSize)
+        finally:
+            kmerIndex.close()
+
+        # A database cannot be empty so search the full database when there are no candidates.
+        if len(candidateIds) == 0:
+            self._log(log.INFO, 'Search prefilter found no candidate targets so the full database is searched')
+            return None
+        fastaFile = os.path.join(workFolder, '%s.candidates.faa' %(input['genome']))
+        try:
+            dbSize = self.dataParser.buildCandidateDatabase(candidateIds, fastaFile)
+        except MakeblastdbError as e:
+            self._log(log.WARNING, 'Search prefilter is not used because building the candidate database failed: %s' %(e))
+            return None
+
+        message = 'Search prefilter selected %d candidate targets for %d query proteins' %(len(candidateIds), len(queries))
+        sys.stderr.write(message+'\n')
+        self._log(log.INFO, message)
+        return { 'path': fastaFile, 'size': dbSize }
+
+    def _prefilterCandidates(self, queries, kmerIndex, kmerSize):
+        ''' Select the subsystem proteins that share k-mers with the query proteins.
+
+            @param queries List of fasta records with query proteins
+            @param kmerIndex CompiledMapping object with the k-mer index
+            @param kmerSize Length of k-mers in the k-mer index
+            @return List of feature IDs of candidate targets
+        '''
+
+        minKmers = int(self.config['prefilter_min_kmers'])
+        maxCandidates = int(self.config['prefilter_max_candidates'])
+        candidates = set()
+        for record in queries:
+            sequence = record.split('\n')[1]
+            targetCounts = dict()
+            for kmer in set([ sequence[index:index+kmerSize] for index in xrange(len(sequence) - kmerSize + 1) ]):
+                for targetId in kmerIndex.getIds(kmer):
+                    targetCounts[targetId] = targetCounts.get(targetId, 0) + 1
+            selected = [ targetId for targetId in targetCounts if targetCounts[targetId] >= minKmers ]
+            if len(selected) > maxCandidates:
+                selected = heapq.nlargest(maxCandidates, selected, key=targetCounts.get)
+            candidates.update(selected)
+        return [ kmerIndex.string(targetId) for targetId in candidates ]
+
+    def _startSearches(self, input, shards, workFolder, outputFiles):
+        ''' Start a search for each shard of the query proteins.
+
+            When search_input_mode is "stdin", the query proteins are written to the standard
+            input of the search program and a fasta file is only written when debug is turned on.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param shards List of lists of fasta records with query proteins for each shard
+            @param workFolder Path to directory in which to store temporary files
+            @param outputFiles List of paths to output file for each shard or None to read the
+                results from the standard output of the search programs
+            @return List of dictionaries returned by _startSearch()
+            @raise BlastError
+        '''
+
+        useStdin = self.config['search_input_mode'] == 'stdin'
+        numResidues = sum([ len(record.split('\n')[1]) for shard in shards for record in shard ])
+        threads = search_thread_count(self.config, numResidues, len(shards))
+        self._log(log.DEBUG, 'Using %s threads for each of %d searches' %(threads, len(shards)))
+        searches = list()
+        try:
+            for index in range(len(shards)):
+                queryFile = None
+                if not useStdin or self.logger.get_log_level() >= log.DEBUG2:
+                    queryFile = self._writeQueryFile(input, shards[index], workFolder, index, len(shards))
+                if outputFiles is None:
+                    outputFile = None
+                    stdout = subprocess.PIPE
+                else:
+                    outputFile = outputFiles[index]
+                    stdout = None
+                if useStdin:
+                    args = self._searchCommand(None, outputFile, threads)
+                    searches.append(self._startSearch(args, workFolder, index, stdout=stdout, queries=shards[index]))
+                else:
+                    args = self._searchCommand(queryFile, outputFile, threads)
+                    searches.append(self._startSearch(args, workFolder, index, stdout=stdout))
+        except:
+            self._stopSearches(searches)
+            raise
+        return searches
+
+    def _searchCommand(self, queryFile, outputFile, threads):
+        ''' Build the command to search for the query proteins with the configured search backend.
+
+            @param queryFile Path to fasta file with query proteins or None to read the query proteins from stdin
+            @param outputFile Path to output file or None to write the results to stdout
+            @param threads Number of threads used by the search program
+            @return List of arguments for the command
+        '''
+
+        maxTargets = hit_cutoffs(self.config)[0]
+        return self.dataParser.searchBackend.searchCommand(queryFile, outputFile, threads, SearchOutputColumns, maxTargets, self.searchDatabase)
+
+    def _startSearch(self, args, workFolder, index, stdout=None, queries=None):
+        ''' Start a search program.
+
+            Messages from the search program go to a file so the program never blocks writing
+            to a pipe that is not being read.  The file is in the work folder unless the query
+            proteins are written to the standard input of the search program and debug is
+            turned off.  The query proteins are written by a separate thread so the search
+            program never blocks writing results while the query proteins are being written.
+
+            @param args List of arguments for the command
+            @param workFolder Path to directory in which to store temporary files
+            @param index Index of the shard searched by the command
+            @param stdout Where to send the standard output of the command (None for the message file)
+            @param queries List of fasta records with query proteins to write to the standard input
+                of the command or None when the command reads a query file
+            @return Dictionary with the process object, arguments, message file, query writer thread, and start time of the search
+            @raise BlastError
+        '''
 
-        # Run the command to search for proteins against subsystem proteins.
         cmd = ' '.join(args)
-        sys.stderr.write("Started search with command: %s..." %(cmd))
+        sys.stderr.write("Started search with command: %s\n" %(cmd))
         self._log(log.INFO, 'Started search with command: '+cmd)
+        if queries is not None and self.logger.get_log_level() < log.DEBUG2:
+            messageFile = tempfile.TemporaryFile()
+        else:
+            messageFile = open(os.path.join(workFolder, 'search.%d.log' %(index)), 'w+')
+        if stdout is None:
+            stdout = messageFile
+        stdin = None
+        if queries is not None:
+            stdin = subprocess.PIPE
         try:
-            proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-            (stdout, stderr) = proc.communicate()
-            if proc.returncode < 0:
-                raise BlastError("'%s' was terminated by signal %d" %(args[0], -proc.returncode))
-            else:
-                if proc.returncode > 0:
-                    details = "'%s' failed with return code %d\nCommand: '%s'\nStdout: '%s'\nStderr: '%s'" \
-                        %(args[0], proc.returncode, cmd, stdout, stderr)
-                    raise BlastError(details)
+            proc = subprocess.Popen(args, stdin = stdin, stdout = stdout, stderr = messageFile)
         except OSError as e:
+            messageFile.close()
             raise BlastError("Failed to run '%s': %s" %(args[0], e.strerror))
+        writer = None
+        if queries is not None:
+            writer = threading.Thread(target=self._writeQueries, args=(proc, queries))
+            writer.start()
+        return { 'proc': proc, 'args': args, 'messages': messageFile, 'writer': writer, 'started': time.time() }
+
+    def _writeQueries(self, proc, queries):
+        ''' Write query proteins to the standard input of a search program.
+
+            An error writing to the search program means it exited early which is reported
+            by the return code of the search program.
+
+            @param proc Process object of search program
+            @param queries List of fasta records with query proteins
+            @return Nothing
+        '''
+
+        try:
+            for record in queries:
+                proc.stdin.write(record)
+            proc.stdin.close()
+        except IOError:
+            pass
+        return
+
+    def _waitForSearch(self, search):
+        ''' Wait for a search program to finish and check that it was successful.
+
+            The resource usage of the search program is added to the metrics of the job.
+
+            @param search Dictionary returned by _startSearch()
+            @return Nothing
+            @raise BlastError
+        '''
+
+        proc = search['proc']
+        args = search['args']
+        (pid, exitStatus, rusage) = os.wait4(proc.pid, 0)
+        if os.WIFSIGNALED(exitStatus):
+            proc.returncode = -os.WTERMSIG(exitStatus)
+        else:
+            proc.returncode = os.WEXITSTATUS(exitStatus)
+        self.metrics.addSearch(args, time.time() - search['started'], rusage)
+        if search['writer'] is not None:
+            search['writer'].join()
+        search['messages'].seek(0)
+        messages = search['messages'].read()
+        search['messages'].close()
+        if proc.returncode < 0:
+            raise BlastError("'%s' was terminated by signal %d" %(args[0], -proc.returncode))
+        else:
+            if proc.returncode > 0:
+                details = "'%s' failed with return code %d\nCommand: '%s'\nOutput: '%s'" \
+                    %(args[0], proc.returncode, ' '.join(args), messages)
+                raise BlastError(details)
+        return
+
+    def _stopSearches(self, searches):
+        ''' Stop search programs that are still running after an error.
+
+            @param searches List of dictionaries returned by _startSearch()
+            @return Nothing
+        '''
+
+        for search in searches:
+            if search['proc'].poll() is None:
+                search['proc'].kill()
+            search['proc'].wait()
+            if search['writer'] is not None:
+                search['writer'].join()
+            if not search['messages'].closed:
+                search['messages'].close()
+        return
+
+    def _shardQueries(self, input, queries):
+        ''' Split the query proteins into shards that are searched concurrently.
+
+            The number of shards comes from the search_shards input parameter or configuration
+            variable but is reduced so that every shard has at least MinProteinsPerShard
+            proteins.  Proteins are assigned to shards so that each shard has about the same
+            number of residues and proteins keep their order from the query list within a shard.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param queries List of fasta records with query proteins
+            @return List of lists of fasta records with the query proteins for each shard
+        '''
+
+        # Get the requested number of shards.
+        numShards = input.get('search_shards', None)
+        if numShards is None:
+            numShards = self.config['search_shards']
+        numShards = int(numShards)
+
+        # Small genomes use fewer shards.
+        numShards = min(numShards, len(queries) // MinProteinsPerShard)
+        if numShards <= 1:
+            return [ queries ]
+
+        # Assign the longest proteins first, each to the shard with the fewest residues.
+        shardSizes = [ (0, index) for index in range(numShards) ]
+        shardRecords = [ list() for index in range(numShards) ]
+        order = sorted(range(len(queries)), key=lambda index: len(queries[index]), reverse=True)
+        for recordIndex in order:
+            size, shard = heapq.heappop(shardSizes)
+            shardRecords[shard].append(recordIndex)
+            heapq.heappush(shardSizes, (size + len(queries[recordIndex]), shard))
+
+        shards = [ [ queries[recordIndex] for recordIndex in sorted(shardRecords[shard]) ] for shard in range(numShards) ]
+        self._log(log.DEBUG, 'Split %d query proteins into %d shards' %(len(queries), numShards))
+        return shards
+
+    def _runBlastStream(self, input, queries, workFolder, queryToHits=None):
+
+        ''' Search for the query proteins and calculate roleset probabilities while the search runs.
+
+            The results are read from the search program's stdout as they are produced.
+            The search programs write all of the hits for a query protein together so the
+            roleset probabilities for a query protein are calculated as soon as the next
+            query protein is seen and only the hits for one query protein are kept in memory.
+            If the hits for a query protein are split up in the output, the sums for the
+            query protein are kept and the probabilities are calculated again.  When the
+            search is sharded, the output of each shard is read by a separate thread.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param queries List of fasta records with query proteins
+            @param workFolder Path to directory in which to store temporary files
+            @param queryToHits Dictionary keyed by query gene of list of tuples with target ID and score
+                that is updated with the hits from the search results or None to not keep the hits
+            @return Dictionary keyed by query gene of list of tuples with roleset and likelihood
+            @raise BlastError, BadLikelihoodError, NoTargetIdError
+        '''
+
+        # Get the "rolestring" of each target.
+        targetIdToRoleString = self.dataParser.getTargetRolestrings()
+
+        # Dictionary keyed by query gene of a list with the maximum score and a dictionary
+        # keyed by rolestring of the sum of squares of the scores.  Shards have different
+        # query genes so the readers can share the dictionaries.
+        queryToScores = dict()
+        rolestringTuples = dict()
+
+        # Start the search for each shard of the query proteins.
+        searches = self._startSearches(input, self._shardQueries(input, queries), workFolder, None)
+
+        # Read and score the output from the searches.
+        errors = list()
+        if len(searches) == 1:
+            self._scoreSearchOutput(input, searches[0], 0, targetIdToRoleString, queryToScores, rolestringTuples, workFolder, errors, queryToHits)
+        else:
+            readers = list()
+            for index in range(len(searches)):
+                reader = threading.Thread(target=self._scoreSearchOutput,
+                                          args=(input, searches[index], index, targetIdToRoleString, queryToScores, rolestringTuples, workFolder, errors, queryToHits))
+                reader.start()
+                readers.append(reader)
+            for reader in readers:
+                reader.join()
+        try:
+            if len(errors) > 0:
+                raise errors[0][0], errors[0][1], errors[0][2]
+            for search in searches:
+                self._waitForSearch(search)
+        except:
+            self._stopSearches(searches)
+            raise
         sys.stderr.write('done\n')
 
-        return blastResultFile
+        self._saveRolesetProbabilities(input, rolestringTuples, workFolder)
+        return rolestringTuples
+
+    def _scoreSearchOutput(self, input, search, index, targetIdToRoleString, queryToScores, rolestringTuples, workFolder, errors, queryToHits=None):
+        ''' Read the output from a search program and calculate roleset probabilities for each query protein.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param search Dictionary returned by _startSearch()
+            @param index Index of the shard searched by the search program
+            @param targetIdToRoleString Dictionary mapping a target ID to rolestring
+            @param queryToScores Dictionary keyed by query gene of list with maximum score and
+                dictionary of sum of squared scores for each rolestring (updated)
+            @param rolestringTuples Dictionary keyed by query gene of list of tuples with roleset and likelihood (updated)
+            @param workFolder Path to directory in which to store temporary files
+            @param errors List of exception info tuples from sys.exc_info() (updated)
+            @param queryToHits Dictionary keyed by query gene of list of tuples with target ID and score
+                (updated) or None to not keep the hits
+            @return Nothing
+        '''
+
+        # Save the search results to a file when debug is turned on.
+        blastResultFile = None
+        if self.logger.get_log_level() >= log.DEBUG2:
+            blastResultFile = open(os.path.join(workFolder, "%s.blastout.%d" %(input["genome"], index)), 'w')
+
+        try:
+            lines = self._readLines(search['proc'].stdout, blastResultFile)
+            for query, hits in self.dataParser.iterateBlastOutput(lines):
+                likelihoods = self._finishQuery(query, hits, targetIdToRoleString, queryToScores)
+                if len(likelihoods) > 0:
+                    rolestringTuples[query] = likelihoods
+                if queryToHits is not None:
+                    queryToHits.setdefault(query, list()).extend(hits)
+        except:
+            errors.append(sys.exc_info())
+            # Stop the search program since the results cannot be used.
+            if search['proc'].poll() is None:
+                search['proc'].kill()
+        finally:
+            if blastResultFile is not None:
+                blastResultFile.close()
+        return
+
+    def _readLines(self, stream, copyFile=None):
+        ''' Read lines from a pipe as they are written.
+
+            @param stream File object of pipe
+            @param copyFile File object where a copy of each line is written or None
+            @return Generator of lines
+        '''
+
+        for line in iter(stream.readline, ''):
+            if copyFile is not None:
+                copyFile.write(line)
+            yield line
+        return
+
+    def _finishQuery(self, query, hits, targetIdToRoleString, queryToScores):
+        ''' Add hits to the sums for a query protein and calculate its roleset probabilities.
+
+            The per-query cutoffs are applied to each group of hits for the query protein.
+
+            @param query Query gene ID
+            @param hits List of tuples with target ID and score
+            @param targetIdToRoleString Dictionary mapping a target ID to rolestring
+            @param queryToScores Dictionary keyed by query gene of list with maximum score and
+                dictionary of sum of squared scores for each rolestring (updated)
+            @return List of tuples with roleset and likelihood
+        '''
+
+        if query in queryToScores:
+            maxscore, rolestringToScore = queryToScores[query]
+            numQueries = 0
+            self._log(log.DEBUG, 'Hits for query %s are not together in search results' %(query))
+        else:
+            maxscore, rolestringToScore = 0, None
+            numQueries = 1
+        maxTargets, minRelativeScore = hit_cutoffs(self.config)
+        hits, numDropped, droppedScore = self.dataParser.truncateHits(hits, maxTargets, minRelativeScore)
+        maxscore, rolestringToScore = self._rolestringScores(hits, targetIdToRoleString, maxscore, rolestringToScore)
+        self._recordHitCutoffs(numQueries, maxscore, rolestringToScore, len(hits), numDropped, droppedScore)
+        queryToScores[query] = [ maxscore, rolestringToScore ]
+        return self._rolestringLikelihoods(query, maxscore, rolestringToScore)
     
-    def _rolesetProbabilitiesMarble(self, input, blastResultFile, workFolder):
+    def _rolesetProbabilitiesMarble(self, input, blastResultFile, workFolder, queryToHits=None):
 
         ''' Calculate the probabilities of rolesets from the BLAST results.
 
@@ -236,93 +1208,334 @@ class ProbabilisticAnnotationWorker:
             query gene of lists of tuples where each tuple contains (1) roleset
             string, and (2) likelihood value.  The roleset string is a concatenation
             of all of the roles of a protein with a single function (order does
-            not matter).
+            not matter).  The BLAST results are read one query gene at a time so only
+            the hits for one query gene are kept in memory.
     
             @param input Dictionary of input parameters to annotate() function
             @param blastResultFile Path to output file from BLAST
             @param workFolder Path to directory in which to store temporary files
+            @param queryToHits Dictionary keyed by query gene of list of tuples with target ID and score
+                that is updated with the hits from the search results or None to not keep the hits
             @return Dictionary keyed by query gene of list of tuples with roleset and likelihood
             @raise BadLikelihoodError, NoTargetIdError
         '''
 
         sys.stderr.write("Performing marble-picking on rolesets for genome %s..." %(input["genome"]))
     
-        # Read in the target roles (this function returns the roles as lists!)
-        targetIdToRole, targetRoleToId = self.dataParser.readFilteredOtuRoles()
-    
-        # Convert the lists of roles into "rolestrings" (sort the list so that order doesn't matter)
-        # in order to deal with the case where some of the hits are multi-functional and others only have
-        # a single function.
-        targetIdToRoleString = dict()
-        for target in targetIdToRole:
-            stri = self.config["separator"].join(sorted(targetIdToRole[target]))
-            targetIdToRoleString[target] = stri
-
-        # Parse the output from BLAST which returns a dictionary keyed by query gene of a list
-        # of tuples with target gene and score.
-        # query --> [ (target1, score 1), (target 2, score 2), ... ]
-        idToTargetList = self.dataParser.parseBlastOutput(blastResultFile)
-    
+        # Get the "rolestring" of each target (the roles of the target sorted so that order doesn't
+        # matter) in order to deal with the case where some of the hits are multi-functional and
+        # others only have a single function.
+        targetIdToRoleString = self.dataParser.getTargetRolestrings()
+
         # This is a holder for all of our results which is a dictionary keyed by query gene
         # of a list of tuples with roleset and likelihood.
         # query -> [ (roleset1, likelihood_1), (roleset2, likelihood_2), ...]
         rolestringTuples = dict()
 
-        # For each query gene we calculate the likelihood of each possible rolestring.
-        # See equation 2 in the paper ("Calculating annotation likelihoods" section).
-        for query in idToTargetList:
-            # First we need to know the maximum score for this gene.
-            # I have no idea why but I'm pretty sure Python is silently turning the second
-            # element of these tuples into strings.  That's why I turn them back to floats.
-            maxscore = 0
-            for tup in idToTargetList[query]:
-                if float(tup[1]) > maxscore:
-                    maxscore = float(tup[1])
+        # Dictionary keyed by query gene of a list with the maximum score and a dictionary
+        # keyed by rolestring of the sum of squares of the scores.
+        queryToScores = dict()
+
+        # Parse the output from BLAST which returns the hits for each query gene as a list
+        # of tuples with target gene and score and calculate the likelihood of each possible
+        # rolestring for the query gene (the per-query cutoffs are applied to the hits).
+        # query --> [ (target1, score 1), (target 2, score 2), ... ]
+        fid = open(blastResultFile, 'r')
+        try:
+            for query, hits in self.dataParser.iterateBlastOutput(fid):
+                likelihoods = self._finishQuery(query, hits, targetIdToRoleString, queryToScores)
+                if len(likelihoods) > 0:
+                    rolestringTuples[query] = likelihoods
+                if queryToHits is not None:
+                    queryToHits.setdefault(query, list()).extend(hits)
+        finally:
+            fid.close()
     
-            # Now we calculate the cumulative squared scores for each possible rolestring.
-            # This along with pseudocount*maxscore is equivalent to multiplying all scores
-            # by themselves and then dividing by the max score.
-            # This is done to avoid some pathological cases and give more weight to higher-scoring hits
-            # and not let much lower-scoring hits \ noise drown them out.
-            # Build a dictionary keyed by rolestring of the sum of squares of the log-scores.
-            rolestringToScore = dict()
-            for tup in idToTargetList[query]:
+        # Save the generated data when debug is turned on.
+        self._saveRolesetProbabilities(input, rolestringTuples, workFolder)
+            
+        sys.stderr.write("done\n")
+        return rolestringTuples
+            
+    def _rolesetProbabilitiesMarbleVectorized(self, input, blastResultFile, workFolder, queryToHits=None):
+
+        ''' Calculate the probabilities of rolesets from the BLAST results using NumPy arrays.
+
+            This produces the same output as _rolesetProbabilitiesMarble() (which is kept as
+            the reference implementation) but the calculation is done over columnar arrays
+            of query index, rolestring index, and score for all of the hits at once instead
+            of one hit at a time.  Likelihoods can differ from the reference implementation
+            in the last few bits because the sums are accumulated in a different order.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param blastResultFile Path to output file from BLAST
+            @param workFolder Path to directory in which to store temporary files
+            @param queryToHits Dictionary keyed by query gene of list of tuples with target ID and score
+                that is updated with the hits from the search results or None to not keep the hits
+            @return Dictionary keyed by query gene of list of tuples with roleset and likelihood
+            @raise BadLikelihoodError, NoTargetIdError
+        '''
+
+        sys.stderr.write("Performing vectorized marble-picking on rolesets for genome %s..." %(input["genome"]))
+
+        # Build arrays of query index, rolestring index, and score for every hit.
+        queryIndex, rolestringIndex, scores, queryList, rolestringList = self._hitArrays(blastResultFile, queryToHits)
+        numQueries = len(queryList)
+        numRolestrings = len(rolestringList)
+
+        rolestringTuples = dict()
+        if len(scores) > 0:
+            # Find the maximum score for each query gene (the maximum is never less than zero).
+            maxscore = numpy.zeros(numQueries)
+            numpy.maximum.at(maxscore, queryIndex, scores)
+
+            # Apply the per-query cutoffs to the hits.
+            keep = self._hitArraysCutoffs(queryIndex, scores, numQueries)
+            numKept = int(numpy.count_nonzero(keep))
+            if numKept < len(scores):
+                droppedCount = numpy.bincount(queryIndex[~keep], minlength=numQueries)
+                droppedScore = numpy.bincount(queryIndex[~keep], weights=scores[~keep] ** 2, minlength=numQueries)
+                keptScore = numpy.bincount(queryIndex[keep], weights=scores[keep] ** 2, minlength=numQueries)
+                truncated = droppedCount > 0
+                droppedMass = droppedScore[truncated] / (float(self.config["pseudo_count"]) * maxscore[truncated] + keptScore[truncated] + droppedScore[truncated])
+                self.metrics.addHitCutoffs(numQueries, int(numpy.count_nonzero(truncated)), numKept, len(scores) - numKept, float(droppedMass.sum()))
+                queryIndex = queryIndex[keep]
+                rolestringIndex = rolestringIndex[keep]
+                scores = scores[keep]
+            else:
+                self.metrics.addHitCutoffs(numQueries, 0, numKept, 0, 0.0)
+
+            # Sum the squared scores for each (query, rolestring) pair.
+            pairKey = queryIndex.astype(numpy.int64) * numRolestrings + rolestringIndex
+            uniquePairs, pairInverse = numpy.unique(pairKey, return_inverse=True)
+            pairScore = numpy.bincount(pairInverse, weights=scores * scores)
+            pairQuery = uniquePairs // numRolestrings
+            pairRolestring = uniquePairs % numRolestrings
+
+            # The denominator for a query gene is the pseudo count times the maximum score plus
+            # the sum of squared scores for all rolestrings.
+            denom = float(self.config["pseudo_count"]) * maxscore + numpy.bincount(pairQuery, weights=pairScore, minlength=numQueries)
+            bad = numpy.flatnonzero(numpy.isnan(denom))
+            if len(bad) > 0:
+                message = 'Denominator in likelihood calculation for gene %s is NaN %f' %(queryList[bad[0]], denom[bad[0]])
+                sys.stderr.write(message+'\n')
+                raise BadLikelihoodError(message)
+            likelihood = pairScore / denom[pairQuery]
+            bad = numpy.flatnonzero(numpy.isnan(likelihood))
+            if len(bad) > 0:
+                message = 'Likelihood for rolestring %s in gene %s is NaN based on score %f' \
+                    %(rolestringList[pairRolestring[bad[0]]], queryList[pairQuery[bad[0]]], pairScore[bad[0]])
+                sys.stderr.write(message+'\n')
+                raise BadLikelihoodError(message)
+
+            # Convert the arrays to the output dictionary.
+            for query, rolestring, p in zip(pairQuery.tolist(), pairRolestring.tolist(), likelihood.tolist()):
+                query = queryList[query]
+                if query in rolestringTuples:
+                    rolestringTuples[query].append( (rolestringList[rolestring], p) )
+                else:
+                    rolestringTuples[query] = [ (rolestringList[rolestring], p) ]
+
+        # Save the generated data when debug is turned on.
+        self._saveRolesetProbabilities(input, rolestringTuples, workFolder)
+
+        sys.stderr.write("done\n")
+        return rolestringTuples
+
+    def _hitArraysCutoffs(self, queryIndex, scores, numQueries):
+
+        ''' Apply the per-query cutoffs to columnar arrays of hits.
+
+            This selects the same hits as DataParser.truncateHits() for each query gene.
+
+            @param queryIndex NumPy array of query index for each hit
+            @param scores NumPy array of score for each hit
+            @param numQueries Number of query genes
+            @return NumPy array of booleans that are True for the hits that are kept
+        '''
+
+        maxTargets, minRelativeScore = hit_cutoffs(self.config)
+        keep = numpy.ones(len(scores), dtype=bool)
+        if maxTargets > 0:
+            # Rank the hits for each query gene by score (ties keep the order of the search results).
+            order = numpy.lexsort((numpy.arange(len(scores)), -scores, queryIndex))
+            sortedQuery = queryIndex[order]
+            first = numpy.concatenate(([ True ], sortedQuery[1:] != sortedQuery[:-1]))
+            starts = numpy.flatnonzero(first)
+            rank = numpy.arange(len(scores)) - starts[numpy.cumsum(first) - 1]
+            keep[order] = rank < maxTargets
+        if minRelativeScore > 0.0:
+            bestscore = numpy.empty(numQueries)
+            bestscore.fill(-numpy.inf)
+            numpy.maximum.at(bestscore, queryIndex, scores)
+            keep &= (scores >= bestscore[queryIndex] * minRelativeScore) | (bestscore[queryIndex] <= 0.0)
+        return keep
+
+    def _hitArrays(self, blastResultFile, queryToHits=None):
+
+        ''' Read BLAST results into columnar arrays.
+
+            @param blastResultFile Path to output file from BLAST
+            @param queryToHits Dictionary keyed by query gene of list of tuples with target ID and score
+                that is updated with the hits from the search results or None to not keep the hits
+            @return NumPy array of query index, NumPy array of rolestring index, NumPy array of
+                score for each hit, list of query gene IDs, list of rolestrings
+            @raise NoTargetIdError
+        '''
+
+        targetIdToRoleString = self.dataParser.getTargetRolestrings()
+        queryToIndex = dict()
+        queryList = list()
+        rolestringToIndex = dict()
+        rolestringList = list()
+        targetToIndex = dict()
+        queryColumn = list()
+        targetColumn = list()
+        evalueColumn = list()
+        queryField, targetField, evalueField, bitscoreField, numFields = self.dataParser.searchColumnIndexes()
+        for line in open(blastResultFile, 'r'):
+            fields = line.strip('\r\n').split('\t')
+            if len(fields) < numFields:
+                continue
+            if float(fields[bitscoreField]) < 0.0: # Throw out alignments with a negative bit score
+                continue
+
+            # Intern the query and target IDs (all targets with the same rolestring share an index).
+            query = fields[queryField]
+            if query not in queryToIndex:
+                queryToIndex[query] = len(queryList)
+                queryList.append(query)
+            target = fields[targetField]
+            if target not in targetToIndex:
                 try:
-                    rolestring = targetIdToRoleString[tup[0]]
+                    rolestring = targetIdToRoleString[target]
                 except KeyError:
-                    message = 'Target id %s from search results file had no roles in rolestring dictionary' %(tup[0])
+                    message = 'Target id %s from search results file had no roles in rolestring dictionary' %(target)
                     sys.stderr.write(message+'\n')
                     raise NoTargetIdError(message)
-                if rolestring in rolestringToScore:
-                    rolestringToScore[rolestring] += (float(tup[1]) ** 2)
-                else:
-                    rolestringToScore[rolestring] = (float(tup[1]) ** 2)
-    
-            # Calculate the likelihood that this gene has the given functional annotation.
-            # Start with the denominator which is the sum of squares of the log-scores for
-            # all possible rolestrings.
-            denom = float(self.config["pseudo_count"]) * maxscore
-            for stri in rolestringToScore:
-                denom += rolestringToScore[stri]
-            if math.isnan(denom):
-                message = 'Denominator in likelihood calculation for gene %s is NaN %f' %(query, denom)
+                if rolestring not in rolestringToIndex:
+                    rolestringToIndex[rolestring] = len(rolestringList)
+                    rolestringList.append(rolestring)
+                targetToIndex[target] = rolestringToIndex[rolestring]
+            queryColumn.append(queryToIndex[query])
+            targetColumn.append(targetToIndex[target])
+            evalueColumn.append(fields[evalueField])
+            if queryToHits is not None:
+                queryToHits.setdefault(query, list()).append( (target, -1.0 * math.log10(float(fields[evalueField]) + MIN_EVALUE)) )
+
+        # The score is the negative log E-value.
+        queryIndex = numpy.array(queryColumn, dtype=numpy.int64)
+        rolestringIndex = numpy.array(targetColumn, dtype=numpy.int64)
+        scores = -1.0 * numpy.log10(numpy.array(evalueColumn, dtype=numpy.float64) + MIN_EVALUE)
+        return queryIndex, rolestringIndex, scores, queryList, rolestringList
+
+    def _rolestringScores(self, hits, targetIdToRoleString, maxscore=0, rolestringToScore=None):
+
+        ''' Calculate the maximum score and the sum of squared scores for each rolestring from the hits for a query gene.
+
+            @param hits List of tuples with target ID and score
+            @param targetIdToRoleString Dictionary mapping a target ID to rolestring
+            @param maxscore Maximum score from earlier hits for the query gene
+            @param rolestringToScore Dictionary keyed by rolestring of sum of squared scores from
+                earlier hits for the query gene or None if there are no earlier hits
+            @return Maximum score, dictionary keyed by rolestring of sum of squared scores
+            @raise NoTargetIdError
+        '''
+
+        # First we need to know the maximum score for this gene.
+        # I have no idea why but I'm pretty sure Python is silently turning the second
+        # element of these tuples into strings.  That's why I turn them back to floats.
+        for tup in hits:
+            if float(tup[1]) > maxscore:
+                maxscore = float(tup[1])
+
+        # Now we calculate the cumulative squared scores for each possible rolestring.
+        # This along with pseudocount*maxscore is equivalent to multiplying all scores
+        # by themselves and then dividing by the max score.
+        # This is done to avoid some pathological cases and give more weight to higher-scoring hits
+        # and not let much lower-scoring hits \ noise drown them out.
+        # Build a dictionary keyed by rolestring of the sum of squares of the log-scores.
+        if rolestringToScore is None:
+            rolestringToScore = dict()
+        for tup in hits:
+            try:
+                rolestring = targetIdToRoleString[tup[0]]
+            except KeyError:
+                message = 'Target id %s from search results file had no roles in rolestring dictionary' %(tup[0])
+                sys.stderr.write(message+'\n')
+                raise NoTargetIdError(message)
+            if rolestring in rolestringToScore:
+                rolestringToScore[rolestring] += (float(tup[1]) ** 2)
+            else:
+                rolestringToScore[rolestring] = (float(tup[1]) ** 2)
+        return maxscore, rolestringToScore
+
+    def _recordHitCutoffs(self, numQueries, maxscore, rolestringToScore, numKept, numDropped, droppedScore):
+
+        ''' Add the hits dropped by the per-query cutoffs for a query gene to the metrics of the job.
+
+            @param numQueries Number of new query genes (0 when earlier hits for the query gene were recorded)
+            @param maxscore Maximum score of the hits for the query gene
+            @param rolestringToScore Dictionary keyed by rolestring of sum of squared scores of kept hits
+            @param numKept Number of hits that were kept
+            @param numDropped Number of hits that were dropped
+            @param droppedScore Sum of squared scores of dropped hits
+            @return Nothing
+        '''
+
+        # The dropped hits would have added their squared scores to the numerators and the denominator.
+        droppedMass = 0.0
+        if droppedScore > 0.0:
+            droppedMass = droppedScore / (float(self.config["pseudo_count"]) * maxscore + sum(rolestringToScore.values()) + droppedScore)
+        self.metrics.addHitCutoffs(numQueries, int(numDropped > 0), numKept, numDropped, droppedMass)
+        return
+
+    def _rolestringLikelihoods(self, query, maxscore, rolestringToScore):
+
+        ''' Calculate the likelihood of each rolestring for a query gene.
+
+            See equation 2 in the paper ("Calculating annotation likelihoods" section).
+
+            @param query Query gene ID
+            @param maxscore Maximum score of the hits for the query gene
+            @param rolestringToScore Dictionary keyed by rolestring of sum of squared scores
+            @return List of tuples with roleset and likelihood
+            @raise BadLikelihoodError
+        '''
+
+        # Calculate the likelihood that this gene has the given functional annotation.
+        # Start with the denominator which is the sum of squares of the log-scores for
+        # all possible rolestrings.
+        denom = float(self.config["pseudo_count"]) * maxscore
+        for stri in rolestringToScore:
+            denom += rolestringToScore[stri]
+        if math.isnan(denom):
+            message = 'Denominator in likelihood calculation for gene %s is NaN %f' %(query, denom)
+            sys.stderr.write(message+'\n')
+            raise BadLikelihoodError(message)
+
+        # The numerators are the sum of squares for each rolestring.
+        # Calculate the likelihood for each rolestring.
+        likelihoods = list()
+        for stri in rolestringToScore:
+            p = rolestringToScore[stri] / denom
+            if math.isnan(p):
+                message = 'Likelihood for rolestring %s in gene %s is NaN based on score %f' %(stri, query, rolestringToScore[stri])
                 sys.stderr.write(message+'\n')
                 raise BadLikelihoodError(message)
+            likelihoods.append( (stri, p) )
+        return likelihoods
+
+    def _saveRolesetProbabilities(self, input, rolestringTuples, workFolder):
+
+        ''' Save the roleset probabilities to a file when debug is turned on.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param rolestringTuples Dictionary keyed by query gene of list of tuples with roleset and likelihood
+            @param workFolder Path to directory in which to store temporary files
+            @return Nothing
+        '''
 
-            # The numerators are the sum of squares for each rolestring.
-            # Calculate the likelihood for each rolestring and store in the output dictionary.
-            for stri in rolestringToScore:
-                p = rolestringToScore[stri] / denom
-                if math.isnan(p):
-                    message = 'Likelihood for rolestring %s in gene %s is NaN based on score %f' %(stri, query, rolestringToScore[stri])
-                    sys.stderr.write(message+'\n')
-                    raise BadLikelihoodError(message)
-                if query in rolestringTuples:
-                    rolestringTuples[query].append( (stri, p) )
-                else:
-                    rolestringTuples[query] = [ (stri, p) ]
-    
-        # Save the generated data when debug is turned on.
         if self.logger.get_log_level() >= log.DEBUG2:
             rolesetProbabilityFile = os.path.join(workFolder, "%s.rolesetprobs" %(input['genome']))
             fid = open(rolesetProbabilityFile, "w")
@@ -330,20 +1543,14 @@ class ProbabilisticAnnotationWorker:
                 for tup in rolestringTuples[query]:
                     fid.write("%s\t%s\t%1.4f\n" %(query, tup[0], tup[1]))
             fid.close()
-            
-        sys.stderr.write("done\n")
-        return rolestringTuples
-            
-    def _buildProbAnnoObject(self, input, genomeObject, blastResultFile, queryToRolesetProbs, workFolder, wsClient):
+        return
 
-        ''' Create a ProbAnno typed object and save it to a workspace.
+    def _buildProbAnnoObject(self, input, genomeObject, queryToRolesetProbs, workFolder, wsClient):
 
-            The queryToRolesetProbs dictionary has this format: querygene -> [ (roleset, likelihood), ... ]
-            The probabilistic annotation object adds fields for the probability of each role being linked to each gene.
+        ''' Create a ProbAnno typed object and save it to a workspace.
 
             @param input Dictionary of input parameters to annotate() function
             @param genomeObject Genome typed object from workspace
-            @param blastResultFile Path to output file from BLAST in tab-delimited format
             @param queryToRolesetProbs: Dictionary keyed by query protein of list of tuples with roleset and likelihood
             @param workFolder Path to directory in which to store temporary files
             @param wsClient Workspace client object
@@ -352,19 +1559,29 @@ class ProbabilisticAnnotationWorker:
         '''
     
         sys.stderr.write("Building ProbAnno object %s/%s for genome %s..." %(input["probanno_workspace"], input["probanno"], input["genome"]))
+        objectSaveData = self._makeProbAnnoObject(input, genomeObject, queryToRolesetProbs, 'annotate')
+        self.metrics.startStage('save_object')
+        objectInfo = self._saveObjects(input['probanno_workspace'], [ objectSaveData ], wsClient)
+        sys.stderr.write("done\n")
+        return objectInfo[0]
+
+    def _makeProbAnnoObject(self, input, genomeObject, queryToRolesetProbs, method):
+
+        ''' Create the data for saving a ProbAnno typed object to a workspace.
+
+            The queryToRolesetProbs dictionary has this format: querygene -> [ (roleset, likelihood), ... ]
+            The probabilistic annotation object adds fields for the probability of each role being linked to each gene.
+            The rolesets are stored once in a dictionary of rolesets and each gene has a list
+            of (roleset index, likelihood) tuples.
+
+            @param input Dictionary of input parameters to annotate() function
+            @param genomeObject Genome typed object from workspace
+            @param queryToRolesetProbs: Dictionary keyed by query protein of list of tuples with roleset and likelihood
+            @param method Name of method recorded in the provenance of the object
+            @return Dictionary with object save data for save_objects()
+            @raise NoGeneIdsError
+        '''
 
-        # Read in the target roles (this function returns the roles as lists!)
-        targetToRoles, rolesToTargets = self.dataParser.readFilteredOtuRoles()
-        targetToRoleSet = dict()
-        for target in targetToRoles:
-            stri = self.config["separator"].join(sorted(targetToRoles[target]))
-            targetToRoleSet[target] = stri
-
-        # This is a dictionary from query ID to (target, -log E-value) pairs.
-        # We just use it to identify whether or not we actually hit anything in the db
-        # when searching for the query gene.
-        queryToTargetEvals = self.dataParser.parseBlastOutput(blastResultFile)
-        
         # For each query ID:
         # 1. Identify their rolestring probabilities (these are the first and second elements of the tuple)
         # 2. Iterate over the target genes and identify those with each function (a list of these and their blast scores is
@@ -378,7 +1595,8 @@ class ProbabilisticAnnotationWorker:
         objectData["id"] = input["probanno"]
         objectData["genome"] = input["genome"]
         objectData["genome_workspace"] = input["genome_workspace"];
-        objectData["roleset_probabilities"] = queryToRolesetProbs;
+        objectData["roles"], objectData["rolesets"], objectData["feature_probabilities"] = \
+            compact_rolesets(queryToRolesetProbs, self.config["separator"])
         objectData["skipped_features"] = []
         
         for ii in range(len(genomeObject["data"]["features"])):
@@ -388,19 +1606,20 @@ class ProbabilisticAnnotationWorker:
             queryid = feature["id"]
     
             # This can happen if I couldn't find hits from that gene to anything in the database. In this case, I'll just skip it.
+            # Every query gene with a hit in the search results has at least one roleset probability.
             # TODO Or should I make an empty object? I should ask Chris.
-            if queryid not in queryToRolesetProbs or queryid not in queryToTargetEvals:
+            if queryid not in queryToRolesetProbs:
                 objectData["skipped_features"].append(queryid)
                 
-        # Store the ProbAnno object in the specified workspace.
         objectMetaData = dict()
-        objectMetaData['num_rolesets'] = len(objectData["roleset_probabilities"])
+        objectMetaData['num_rolesets'] = len(objectData["feature_probabilities"])
         objectMetaData['num_skipped_features'] = len(objectData["skipped_features"])
+        objectMetaData['static_data_checksum'], objectMetaData['annotation_checksum'] = self._annotationChecksums()
         objectProvData = dict()
         objectProvData['time'] = timestamp(0)
         objectProvData['service'] = os.environ['KB_SERVICE_NAME']
         objectProvData['service_ver'] = ServiceVersion
-        objectProvData['method'] = 'annotate'
+        objectProvData['method'] = method
         objectProvData['method_params'] = input.items()
         objectProvData['input_ws_objects'] = [ '%s/%s/%d' %(genomeObject['info'][7], genomeObject['info'][1], genomeObject['info'][4]) ]
         objectSaveData = dict()
@@ -409,21 +1628,80 @@ class ProbabilisticAnnotationWorker:
         objectSaveData['data'] = objectData
         objectSaveData['meta'] = objectMetaData
         objectSaveData['provenance'] = [ objectProvData ]
+        return objectSaveData
+
+    def _saveObjects(self, workspace, objects, wsClient):
+
+        ''' Save objects to a workspace, trying again when there is an HTTP error.
+
+            @param workspace Name of workspace
+            @param objects List of dictionaries with object save data
+            @param wsClient Workspace client object
+            @return List of object info tuples
+            @raise HTTPError when saving the objects failed after all retries
+        '''
+
         retryCount = 3
         while retryCount > 0:
             try:
-                objectInfo = wsClient.save_objects( { 'workspace': input["probanno_workspace"], 'objects': [ objectSaveData ] } )
-                sys.stderr.write("done\n")
-                return objectInfo[0]
+                return wsClient.save_objects( { 'workspace': workspace, 'objects': objects } )
             except HTTPError as e:
-                # Hopefully this is just a temporary glitch, try again in a few seconds since we worked so hard to build the object.
+                # Hopefully this is just a temporary glitch, try again in a few seconds since we worked so hard to build the objects.
                 retryCount -= 1
-                self._log(log.WARNING, 'HTTP error %s when saving %s to workspace %s' %(e.reason, input['probanno'], input['probanno_workspace']))
+                names = ', '.join([ objectSaveData['name'] for objectSaveData in objects ])
+                self._log(log.WARNING, 'HTTP error %s when saving %s to workspace %s' %(e.reason, names, workspace))
                 time.sleep(15)
         
-        # Saving the object failed so raise the last exception that was caught.
+        # Saving the objects failed so raise the last exception that was caught.
         raise e
 
+    def _saveMetrics(self, job):
+
+        ''' Finish measuring the job and save the metrics to a file in the job directory.
+
+            @param job Job dictionary created by server's annotate() or annotate_batch() function
+            @return Results structure with the metrics for the user and job state service
+        '''
+
+        self.metrics.finish()
+        metricsFile = os.path.join(self.config['work_folder_path'], job['id'], MetricsFileName)
+        try:
+            self.metrics.write(metricsFile)
+        except IOError as e:
+            self._log(log.WARNING, 'Failed to save metrics to %s: %s' %(metricsFile, e))
+        total = self.metrics.toDict()['total']
+        self._log(log.INFO, 'Job %s used %.3f seconds wall time, %.3f seconds CPU time, %d KB peak RSS' \
+            %(job['id'], total['wall_time'], total['user_time'] + total['system_time'], total['peak_rss_kb']))
+
+        # Report the latency of the first job after the search database was warmed up so cold
+        # and warm starts can be compared.
+        warmup = self.dataParser.claimFirstJob()
+        if warmup is not None:
+            searchTime = sum([ stage['wall_time'] for stage in self.metrics.stages if stage['name'] in [ 'search', 'search_and_marble' ] ])
+            self._log(log.NOTICE, 'First job %s after static database files were loaded (%s) used %.3f seconds wall time, %.3f seconds searching' \
+                %(job['id'], warmup, total['wall_time'], searchTime))
+        return self.metrics.jobResults(metricsFile)
+
+    def _cleanWorkFolder(self, workFolder):
+
+        ''' Remove the temporary files from the work directory of a job.
+
+            The metrics file is kept so the metrics of finished jobs can be collected.
+
+            @param workFolder Path to directory with temporary files
+            @return Nothing
+        '''
+
+        for name in os.listdir(workFolder):
+            if name == MetricsFileName:
+                continue
+            path = os.path.join(workFolder, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        return
+
     def _log(self, level, message):
         ''' Log a message to the system log.
 
@@ -447,3 +1725,10 @@ class ProbabilisticAnnotationWorker:
         submod = os.environ.get('KB_SERVICE_NAME', 'ProbabilisticAnnotation')
         self.logger = log.log(submod, ip_address=True, authuser=True, module=True, method=True,
             call_id=True, config=os.getenv('KB_DEPLOYMENT_CONFIG'))
+
+        # Search database used by the search program or None for the full database.
+        self.searchDatabase = None
+
+        # Metrics of the stages of the current job.
+        self.metrics = JobMetrics()
+        return
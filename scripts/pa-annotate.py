@@ -34,6 +34,23 @@ DESCRIPTION
       using the --probanno option for the fba-gapfill command or as input to the
       pa-calculate command to calculate reaction likelihoods.
 
+      The --shards optional argument specifies the number of concurrent searches
+      the query proteins are split across.  The default is the value configured
+      for the service.  Small genomes automatically use fewer searches.
+
+      The --max-targets optional argument specifies the maximum number of hits
+      with the highest scores kept for each protein and the --min-relative-score
+      optional argument drops hits with a score (negative log E-value) less
+      than the specified fraction of the best score for the protein.  The hits
+      that are dropped contribute little to the likelihoods.  The default is
+      the value configured for the service.
+
+      The --incremental optional argument reuses the results from the previous
+      version of the ProbAnno object for features with the same ID and protein
+      sequence as the Genome object the previous version was built from.  Only
+      the new and changed proteins are searched for.  All of the proteins are
+      searched for when the static database or service parameters changed.
+
       The --url optional argument specifies an alternate URL for the service
       endpoint.
 
@@ -66,6 +83,10 @@ if __name__ == "__main__":
     parser.add_argument('probanno', help='ID of ProbAnno object', action='store', default=None)
     parser.add_argument('-w', '--probannows', help='workspace where ProbAnno object is saved', action='store', dest='probannows', default=None)
     parser.add_argument('--genomews', help='workspace where Genome object is saved', action='store', dest='genomews', default=None)
+    parser.add_argument('--shards', help='number of concurrent searches', action='store', dest='shards', type=int, default=None)
+    parser.add_argument('--max-targets', help='maximum number of hits kept for each protein', action='store', dest='maxTargets', type=int, default=None)
+    parser.add_argument('--min-relative-score', help='minimum score of a hit as a fraction of the best score', action='store', dest='minRelativeScore', type=float, default=None)
+    parser.add_argument('--incremental', help='only search for new and changed proteins', action='store_true', dest='incremental', default=False)
     parser.add_argument('--url', help='url for service', action='store', dest='url', default=None)
     parser.add_argument('-e', '--show-error', help='show detailed information for an exception', action='store_true', dest='showError', default=False)
     usage = parser.format_usage()
@@ -85,6 +106,14 @@ if __name__ == "__main__":
         input['probanno_workspace'] = user_workspace()
     else:
         input['probanno_workspace'] = args.probannows
+    if args.shards is not None:
+        input['search_shards'] = args.shards
+    if args.maxTargets is not None:
+        input['max_targets_per_query'] = args.maxTargets
+    if args.minRelativeScore is not None:
+        input['min_relative_score'] = args.minRelativeScore
+    if args.incremental:
+        input['incremental'] = 1
                 
     # Create a probabilistic annotation client.
     if args.url is None:
@@ -0,0 +1,130 @@
+import argparse
+import traceback
+import sys
+from biokbase.probabilistic_annotation.Helpers import get_url
+from biokbase.probabilistic_annotation.Client import ProbabilisticAnnotation
+from biokbase.workspace.ScriptHelpers import user_workspace
+
+desc1 = '''
+NAME
+      pa-annotatebatch -- generate probabilistic annotations for a batch of genomes
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Generate alternative annotations for every gene in a batch of genomes
+      together with their likelihoods in one job.  The query proteins from all
+      of the genomes are searched for in one search so a batch of genomes
+      finishes much faster than running pa-annotate for each genome.
+
+      The batchFile argument is the path to a tab-delimited file with one line
+      for each genome in the batch.  A line has these fields: (1) ID of Genome
+      object, (2) ID of the created ProbAnno object, (3) optional workspace
+      where the Genome object is saved, and (4) optional workspace where the
+      ProbAnno object is saved.  The --genomews and --probannows optional
+      arguments specify the workspace for lines without the corresponding
+      fields.  The default is the user's current workspace.
+
+      A job is started to run the search and this command returns the job ID.
+      Use the pa-checkjob command to see if the job has finished.  When it is
+      done the results are saved in a ProbAnno typed object for each genome.
+
+      The --shards optional argument specifies the number of concurrent searches
+      the query proteins are split across.  The default is the value configured
+      for the service.
+
+      The --max-targets optional argument specifies the maximum number of hits
+      with the highest scores kept for each protein and the --min-relative-score
+      optional argument drops hits with a score (negative log E-value) less
+      than the specified fraction of the best score for the protein.  The hits
+      that are dropped contribute little to the likelihoods.  The default is
+      the value configured for the service.
+
+      The --url optional argument specifies an alternate URL for the service
+      endpoint.
+
+      The --show-error optional argument shows additional detailed information
+      when an exception occurs.
+'''
+
+desc3 = '''
+EXAMPLES
+      Generate probabilistic annotations for the genomes listed in a file:
+      > pa-annotatebatch genomes.txt
+
+SEE ALSO
+      pa-annotate
+      pa-checkjob
+      pa-getprobanno
+      pa-url
+
+AUTHORS
+      Matt Benedict, Mike Mundy
+'''
+
+if __name__ == "__main__":
+    # Parse options.
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='pa-annotatebatch', epilog=desc3)
+    parser.add_argument('batchFile', help='path to file with list of genomes', action='store', default=None)
+    parser.add_argument('-w', '--probannows', help='workspace where ProbAnno objects are saved', action='store', dest='probannows', default=None)
+    parser.add_argument('--genomews', help='workspace where Genome objects are saved', action='store', dest='genomews', default=None)
+    parser.add_argument('--shards', help='number of concurrent searches', action='store', dest='shards', type=int, default=None)
+    parser.add_argument('--max-targets', help='maximum number of hits kept for each protein', action='store', dest='maxTargets', type=int, default=None)
+    parser.add_argument('--min-relative-score', help='minimum score of a hit as a fraction of the best score', action='store', dest='minRelativeScore', type=float, default=None)
+    parser.add_argument('--url', help='url for service', action='store', dest='url', default=None)
+    parser.add_argument('-e', '--show-error', help='show detailed information for an exception', action='store_true', dest='showError', default=False)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    # Get the default workspaces.
+    if args.genomews is None:
+        args.genomews = user_workspace()
+    if args.probannows is None:
+        args.probannows = user_workspace()
+
+    # Create input parameters for annotate_batch() function.
+    input = dict()
+    input['genomes'] = list()
+    for line in open(args.batchFile, 'r'):
+        fields = line.strip('\r\n').split('\t')
+        if len(fields) < 2 or fields[0] == '':
+            continue
+        entry = dict()
+        entry['genome'] = fields[0]
+        entry['probanno'] = fields[1]
+        if len(fields) > 2 and fields[2] != '':
+            entry['genome_workspace'] = fields[2]
+        else:
+            entry['genome_workspace'] = args.genomews
+        if len(fields) > 3 and fields[3] != '':
+            entry['probanno_workspace'] = fields[3]
+        else:
+            entry['probanno_workspace'] = args.probannows
+        input['genomes'].append(entry)
+    if args.shards is not None:
+        input['search_shards'] = args.shards
+    if args.maxTargets is not None:
+        input['max_targets_per_query'] = args.maxTargets
+    if args.minRelativeScore is not None:
+        input['min_relative_score'] = args.minRelativeScore
+
+    # Create a probabilistic annotation client.
+    if args.url is None:
+        args.url = get_url()
+    paClient = ProbabilisticAnnotation(url=args.url)
+
+    # Submit a job to annotate the specified genomes.
+    try:
+        jobid = paClient.annotate_batch(input)
+        print 'Probabilistic annotation job %s for %d genomes successfully submitted' %(jobid, len(input['genomes']))
+    except Exception as e:
+        print 'Error starting job: %s' %(e.message)
+        if args.showError:
+            traceback.print_exc(file=sys.stdout)
+        exit(1)
+
+    exit(0)
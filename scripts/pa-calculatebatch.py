@@ -0,0 +1,120 @@
+import argparse
+import traceback
+import sys
+from biokbase.probabilistic_annotation.Helpers import get_url
+from biokbase.probabilistic_annotation.Client import ProbabilisticAnnotation
+from biokbase.workspace.ScriptHelpers import user_workspace, printObjectInfo
+
+desc1 = '''
+NAME
+      pa-calculatebatch -- calculate reaction likelihoods from a batch of probabilistic annotations
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Calculate reaction likelihoods from a batch of probabilistic annotations
+      generated by the pa-annotate or pa-annotatebatch commands.  The reaction
+      likelihoods for the probabilistic annotations in the batch are calculated
+      in parallel so a batch finishes much faster than running pa-calculate for
+      each probabilistic annotation.
+
+      The batchFile argument is the path to a tab-delimited file with one line
+      for each probabilistic annotation in the batch.  A line has these fields:
+      (1) ID of ProbAnno object, (2) ID of the created RxnProbs object, (3)
+      optional workspace where the ProbAnno object is stored, and (4) optional
+      workspace where the RxnProbs object is saved.  The --probannows and
+      --rxnprobsws optional arguments specify the workspace for lines without
+      the corresponding fields.  The default is the user's current workspace.
+
+      The --template optional argument specifies the ModelTemplate object to use
+      for every probabilistic annotation in the batch.  The default is to use
+      all reactions in the biochemistry database.  The --templatews optional
+      argument specifies the workspace for the ModelTemplate object.  The
+      default is the user's current workspace.
+
+      The --url optional argument specifies an alternate URL for the service
+      endpoint.
+
+      The --show-error optional argument shows additional detailed information
+      when an exception occurs.
+'''
+
+desc3 = '''
+EXAMPLES
+      Calculate reaction likelihoods for the probabilistic annotations listed
+      in a file:
+      > pa-calculatebatch probannos.txt
+
+SEE ALSO
+      pa-calculate
+      pa-annotatebatch
+      pa-getrxnprobs
+      pa-url
+
+AUTHORS
+      Matt Benedict, Mike Mundy
+'''
+
+if __name__ == "__main__":
+    # Parse options.
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='pa-calculatebatch', epilog=desc3)
+    parser.add_argument('batchFile', help='path to file with list of ProbAnno objects', action='store', default=None)
+    parser.add_argument('-w', '--rxnprobsws', help='workspace where RxnProbs objects are saved', action='store', dest='rxnprobsws', default=None)
+    parser.add_argument('--probannows', help='workspace where ProbAnno objects are stored', action='store', dest='probannows', default=None)
+    parser.add_argument('-t', '--template', help='ID of ModelTemplate object', action='store', dest='template', default=None)
+    parser.add_argument('--templatews', help='workspace where ModelTemplate object is stored', action='store', dest='templatews', default=None)
+    parser.add_argument('--url', help='url for service', action='store', dest='url', default=None)
+    parser.add_argument('-e', '--show-error', help='show detailed information for an exception', action='store_true', dest='showError', default=False)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    # Get the default workspaces.
+    if args.probannows is None:
+        args.probannows = user_workspace()
+    if args.rxnprobsws is None:
+        args.rxnprobsws = user_workspace()
+
+    # Create input parameters for calculate_batch() function.
+    input = dict()
+    input['probannos'] = list()
+    for line in open(args.batchFile, 'r'):
+        fields = line.strip('\r\n').split('\t')
+        if len(fields) < 2 or fields[0] == '':
+            continue
+        entry = dict()
+        entry['probanno'] = fields[0]
+        entry['rxnprobs'] = fields[1]
+        if len(fields) > 2 and fields[2] != '':
+            entry['probanno_workspace'] = fields[2]
+        else:
+            entry['probanno_workspace'] = args.probannows
+        if len(fields) > 3 and fields[3] != '':
+            entry['rxnprobs_workspace'] = fields[3]
+        else:
+            entry['rxnprobs_workspace'] = args.rxnprobsws
+        input['probannos'].append(entry)
+    input['template_model'] = args.template
+    input['template_workspace'] = args.templatews
+
+    # Create a probabilistic annotation client.
+    if args.url is None:
+        args.url = get_url()
+    paClient = ProbabilisticAnnotation(url=args.url)
+
+    # Calculate reaction probabilities from the probabilistic annotations.
+    try:
+        objectInfoList = paClient.calculate_batch(input)
+        print '%d RxnProbs objects successfully generated in workspace:' %(len(objectInfoList))
+        for objectInfo in objectInfoList:
+            printObjectInfo(objectInfo)
+    except Exception as e:
+        print 'Error calculating reaction probabilities: %s' %(e.message)
+        if args.showError:
+            traceback.print_exc(file=sys.stdout)
+        exit(1)
+
+    exit(0)
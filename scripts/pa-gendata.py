@@ -6,7 +6,7 @@ import os
 import traceback
 import argparse
 from biokbase.probabilistic_annotation.DataParser import DataParser
-from biokbase.probabilistic_annotation.Helpers import get_config, now
+from biokbase.probabilistic_annotation.Helpers import get_config, now, prefilter_kmer_size
 from biokbase.probabilistic_annotation.DataExtractor import *
 
 desc1 = '''
@@ -22,9 +22,26 @@ DESCRIPTION
       files containing intermediate data.  The configFilePath argument specifies
       the path to the configuration file for the service.
 
-      The --makedb optional argument only builds the search database for the
-      configured search program.  Note that the input subsystem FASTA file must
-      be available before using this option.
+      The exact match index maps each unique sequence in the subsystem FASTA
+      file to the reference proteins with the sequence and to the hits found by
+      searching for the sequence with the configured search program and search
+      parameters.  Annotate jobs use the hits from the index for query proteins
+      that are identical to a reference protein instead of searching for them.
+      The index is optional and is only used when it was built from the current
+      subsystem FASTA file with the current search parameters.
+
+      The reaction ModelSEED ID file maps each reaction ID in KBase format to
+      the reaction ID in ModelSEED format so the calculate() method translates
+      reaction IDs without querying the central data model server.  The file
+      is optional and the server queries the central data model server when
+      the file is not available.
+
+      When the search_prefilter configuration variable is "kmer", a k-mer index
+      of the subsystem proteins is built with the search database.
+
+      The --makedb optional argument only builds the search database and the
+      exact match index for the configured search program.  Note that the input
+      subsystem FASTA file must be available before using this option.
 
       The --force optional argument deletes all existing files before they are
       generated.
@@ -60,6 +77,10 @@ def generate_data(dataParser, config, force):
         sys.stderr.write("Removing all static database files...")
         for filename in dataParser.DataFiles.values():
             safeRemove(filename)
+        for filename in dataParser.IndexFiles.values():
+            safeRemove(filename)
+        if prefilter_kmer_size(config) > 0:
+            safeRemove(dataParser.kmerIndexPath(prefilter_kmer_size(config)))
         sys.stderr.write("done\n")
     
     sys.stderr.write("Generating static database files in '%s'...\n" %(config["data_folder_path"]))
@@ -133,9 +154,16 @@ def generate_data(dataParser, config, force):
     fidsToSeqs = fidsToSequences(otuFidsToRoles.keys(), config)
     sys.stderr.write("Writing amino acid sequences to FASTA file '%s'\nGenerating file and making search database...\n" %(dataParser.DataFiles['subsystem_otu_fasta_file']))
     dataParser.writeSubsystemFasta(fidsToSeqs)
-    dataParser.buildSearchDatabase()
+    dataParser.buildSearchDatabase(prefilter_kmer_size(config))
     sys.stderr.write("Done at %s\n\n" %(now()))
     del otuFidsToRoles, fidsToSeqs
+
+    # Search for the reference proteins so query proteins identical to a reference protein
+    # do not need to be searched for when annotating a genome.
+    sys.stderr.write("Building exact match index of reference proteins at %s\n" %(now()))
+    sys.stderr.write("Saving index in file '%s'\nSearching for reference proteins...\n" %(dataParser.IndexFiles['subsystem_exact_match_file']))
+    numSequences = dataParser.buildExactMatchIndex(config)
+    sys.stderr.write("Stored %d unique reference sequences\nDone at %s\n\n" %(numSequences, now()))
     
     # Create a mapping of complexes to roles which is needed to go from annotation likelihoods to
     # reaction likelihoods.  Note that it is easier to go in this direction because we need all
@@ -156,6 +184,15 @@ def generate_data(dataParser, config, force):
     sys.stderr.write("Stored %d reaction to complexes mappings\nDone at %s\n\n" %(len(reactionToComplexes), now()))
     del reactionToComplexes, complexesToReactions
     
+    # Create a mapping of reactions to ModelSEED IDs so calculate() can translate the reaction IDs
+    # without querying the cdmi server.
+    sys.stderr.write("Getting mapping of reaction to ModelSEED ID at %s\n" %(now()))
+    sys.stderr.write("Saving reaction to ModelSEED ID mapping in file '%s'\nDownloading from cdmi server...\n" %(dataParser.IndexFiles['reaction_modelseed_ids_file']))
+    rxnToModelSeedId = reactionModelSeedIds(5000, config)
+    dataParser.writeReactionModelSeedIds(rxnToModelSeedId)
+    sys.stderr.write("Stored %d reaction to ModelSEED ID mappings\nDone at %s\n\n" %(len(rxnToModelSeedId), now()))
+    del rxnToModelSeedId
+    
     sys.stderr.write("Done generating static database files\n")
     return
 
@@ -166,7 +203,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='pa-gendata', epilog=desc3)
     parser.add_argument('configFilePath', help='path to configuration file', action='store', default=None)
     parser.add_argument('--force', help='remove existing static database files first', dest='force', action='store_true', default=False)
-    parser.add_argument('--makedb', help='only make the protein search database', dest='makeDB', action='store_true', default=False)
+    parser.add_argument('--makedb', help='only make the protein search database and exact match index', dest='makeDB', action='store_true', default=False)
     usage = parser.format_usage()
     parser.description = desc1 + '      ' + usage + desc2
     parser.usage = argparse.SUPPRESS
@@ -182,10 +219,16 @@ if __name__ == "__main__":
     # Update the status file.
     dataParser.writeStatusFile('building')
 
+    # The generated files do not match the files in Shock so remove the checksums of the
+    # files loaded from Shock.
+    if os.path.exists(dataParser.StatusFiles['cache_file']):
+        os.remove(dataParser.StatusFiles['cache_file'])
+
     # Generate the static database files.
     try:
         if args.makeDB:
-            dataParser.buildSearchDatabase()
+            dataParser.buildSearchDatabase(prefilter_kmer_size(config))
+            dataParser.buildExactMatchIndex(config)
         else:
             generate_data(dataParser, config, args.force)
         status = "ready"
@@ -3,7 +3,7 @@
 import argparse
 import os
 from biokbase.probabilistic_annotation.DataParser import DataParser
-from biokbase.probabilistic_annotation.Helpers import get_config
+from biokbase.probabilistic_annotation.Helpers import get_config, prefilter_kmer_size
 from biokbase import log
 
 desc1 = '''
@@ -24,7 +24,7 @@ DESCRIPTION
 
       Note that a probabilistic annotation server is unable to service client
       requests for the annotate() and calculate() methods while this command is
-      running and must be restarted to use the new files.
+      running.  Requests started after this command finishes use the new files.
 '''
 
 desc3 = '''
@@ -66,6 +66,6 @@ if __name__ == "__main__":
     # Get the static database files.  If the files do not exist and they are downloaded
     # from Shock, the command may run for a long time.
     testDataPath = os.path.join(os.environ['KB_TOP'], 'services', submod, 'testdata')
-    dataOption = dataParser.getDatabaseFiles(mylog, testDataPath)
+    dataOption = dataParser.getDatabaseFiles(mylog, testDataPath, prefilter_kmer_size(config))
 
     exit(0)
@@ -18,7 +18,7 @@ if __name__ == "__main__":
     job = json.load(open(jobDataPath, 'r'))
     try:
         worker = ProbabilisticAnnotationWorker()
-        worker.runAnnotate(job)
+        worker.runJob(job)
     except Exception as e:
         # Mark the job as failed.
         tb = traceback.format_exc()
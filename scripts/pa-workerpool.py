@@ -0,0 +1,180 @@
+#! /usr/bin/python
+
+import argparse
+import sys
+import os
+import json
+import time
+import signal
+import traceback
+from multiprocessing import Process
+from biokbase.probabilistic_annotation.Worker import ProbabilisticAnnotationWorker
+from biokbase.probabilistic_annotation.DataParser import DataParser
+from biokbase.probabilistic_annotation.Helpers import get_config, set_config_defaults, make_job_queue_directory, \
+    claim_queued_jobs, finish_queued_job, requeue_running_jobs, queued_job_id
+from biokbase.userandjobstate.client import UserAndJobState
+from biokbase import log
+
+desc1 = '''
+NAME
+      pa-workerpool -- run annotate jobs in a resident pool of workers
+
+SYNOPSIS
+'''
+
+desc2 = '''
+DESCRIPTION
+      Run annotate jobs submitted to the worker pool queue by a probabilistic
+      annotation server with the job_queue configuration variable set to
+      "pool".  The static database files are loaded once when the pool starts
+      so each job starts with the data already in memory instead of reading
+      and parsing the files again.  The search database files are warmed up
+      as selected by the search_database_warmup and search_database_copy_path
+      configuration variables.  Up to pool_size jobs are run at the same
+      time and jobs are run in the order they were submitted.  The
+      configFilePath argument specifies the path to the configuration file
+      for the service.
+
+      The pool stops taking new jobs when it receives a SIGTERM or SIGINT
+      signal and exits after the running jobs finish.  Jobs that were running
+      when the pool last stopped are submitted again when the pool starts.
+      Jobs started after new static database files are loaded use the new
+      files.
+'''
+
+desc3 = '''
+EXAMPLES
+      Run the worker pool:
+      > pa-workerpool deploy.cfg
+
+SEE ALSO
+      pa-annotate
+      pa-loaddata
+
+AUTHORS
+      Matt Benedict, Mike Mundy
+'''
+
+# Number of seconds to wait between checks of the queue.
+PollInterval = 1
+
+# Set to True when a signal is received to stop the pool.
+Stopping = False
+
+def stopPool(signum, frame):
+    ''' Stop taking new jobs when a signal is received.
+
+        @param signum Signal number
+        @param frame Current stack frame
+        @return Nothing
+    '''
+
+    global Stopping
+    Stopping = True
+    return
+
+def runJob(jobDirectory):
+    ''' Run an annotate job in a worker process.
+
+        @param jobDirectory Path to job directory for the job
+        @return Nothing
+    '''
+
+    # Send output from the job to log files in the job directory the same as pa-runjob.
+    sys.stdout = open(os.path.join(jobDirectory, 'stdout.log'), 'w', 0)
+    sys.stderr = open(os.path.join(jobDirectory, 'stderr.log'), 'w', 0)
+    os.dup2(sys.stdout.fileno(), 1)
+    os.dup2(sys.stderr.fileno(), 2)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # Run the job.
+    job = json.load(open(os.path.join(jobDirectory, 'jobdata.json'), 'r'))
+    try:
+        worker = ProbabilisticAnnotationWorker()
+        worker.runJob(job)
+    except Exception as e:
+        # Mark the job as failed.
+        tb = traceback.format_exc()
+        sys.stderr.write(tb)
+        ujsClient = UserAndJobState(job['config']['userandjobstate_url'], token=job['context']['token'])
+        ujsClient.complete_job(job['id'], job['context']['token'], 'failed', tb, { })
+    return
+
+# Main script function
+if __name__ == "__main__":
+
+    # Parse arguments.
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, prog='pa-workerpool', epilog=desc3)
+    parser.add_argument('configFilePath', help='path to configuration file', action='store', default=None)
+    usage = parser.format_usage()
+    parser.description = desc1 + '      ' + usage + desc2
+    parser.usage = argparse.SUPPRESS
+    args = parser.parse_args()
+
+    # Create a log object.
+    submod = os.environ.get('KB_SERVICE_NAME', 'probabilistic_annotation')
+    mylog = log.log(submod, ip_address=True, authuser=True, module=True, method=True,
+        call_id=True, config=args.configFilePath)
+
+    # Get the probabilistic_annotation section from the configuration file.
+    config = set_config_defaults(get_config(args.configFilePath))
+    if config['job_queue'] != 'pool':
+        print 'Configuration variable job_queue is %s so the worker pool is not needed' %(config['job_queue'])
+        exit(0)
+    poolSize = int(config['pool_size'])
+    if poolSize < 1:
+        print 'Configuration variable pool_size must be greater than 0'
+        exit(1)
+
+    # Load the static data so it is inherited by every worker process.
+    dataParser = DataParser(config)
+    try:
+        dataParser.checkIfDatabaseFilesExist()
+        dataParser.getTargetRolestrings()
+        dataParser.getFilteredOtuRoles()
+        dataParser.warmSearchDatabase(mylog)
+    except Exception as e:
+        mylog.log_message(log.NOTICE, 'Worker pool started without static data loaded: %s' %(e))
+
+    # Submit jobs again that were running when the pool last stopped.
+    queueDirectory = make_job_queue_directory(config['work_folder_path'])
+    for entryName in requeue_running_jobs(config['work_folder_path']):
+        mylog.log_message(log.NOTICE, 'Job %s submitted again to worker pool' %(queued_job_id(entryName)))
+
+    signal.signal(signal.SIGTERM, stopPool)
+    signal.signal(signal.SIGINT, stopPool)
+    mylog.log_message(log.NOTICE, 'Worker pool started with %d workers using queue %s' %(poolSize, queueDirectory))
+
+    running = dict()
+    while not Stopping or len(running) > 0:
+        # Remove the entries for jobs that are finished.
+        for entryName in running.keys():
+            if not running[entryName].is_alive():
+                running[entryName].join()
+                finish_queued_job(config['work_folder_path'], entryName)
+                mylog.log_message(log.NOTICE, 'Job %s finished with exit code %s' %(queued_job_id(entryName), running[entryName].exitcode))
+                del running[entryName]
+
+        # Start jobs from the queue while there are idle workers.
+        if not Stopping and len(running) < poolSize:
+            # Reload the static data when the static database files changed so new workers start
+            # with a warm cache.
+            try:
+                dataParser.refreshStaticData()
+                dataParser.getTargetRolestrings()
+                dataParser.getFilteredOtuRoles()
+            except Exception as e:
+                pass
+            # Claim the jobs by moving their entries.  Another pool using the same queue may claim a job first.
+            for entryName in claim_queued_jobs(config['work_folder_path'], poolSize-len(running)):
+                jobDirectory = os.path.join(config['work_folder_path'], queued_job_id(entryName))
+                worker = Process(target=runJob, args=(jobDirectory,))
+                worker.start()
+                running[entryName] = worker
+                mylog.log_message(log.NOTICE, 'Job %s started in worker process %d' %(queued_job_id(entryName), worker.pid))
+
+        time.sleep(PollInterval)
+
+    mylog.log_message(log.NOTICE, 'Worker pool stopped')
+    exit(0)